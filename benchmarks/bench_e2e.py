@@ -0,0 +1,164 @@
+# Runs main() end to end against synthetic deployments served by a local CDN stand-in and records wall time,
+# time per phase and counters (from main.py's run report), peak RSS and bytes transferred of every scenario as JSON,
+# for comparing runs before and after a change
+# Usage: python -m benchmarks.bench_e2e [--icons N] [--mods N] [--scenarios cold warm partial] [--output PATH] [--compare PATH]
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+from benchmarks import synthetic
+from benchmarks.cdn_server import CdnServer
+from modules.metrics import peak_rss
+
+
+REPOSITORY: Path = Path(__file__).resolve().parent.parent
+SOURCE_VERSION: int = 684
+TARGET_VERSION: int = 691  # Odd, icons move between the two versions
+
+# Scenario -> extra arguments for main.py. "warm" reuses the package cache filled by the scenario before it
+SCENARIOS: dict[str, list[str]] = {
+    "cold": [],
+    "warm": [],
+    "partial": ["--partial"],
+}
+
+
+def run(arguments: list[str]) -> dict:
+    # Runs in a fresh process, with the CDN and the cache set in the environment
+    start: float = time.perf_counter()
+    logging.getLogger().addHandler(logging.NullHandler())  # main()'s logging.basicConfig is a no-op now, the run is quiet
+
+    sys.path.insert(0, str(REPOSITORY))
+    import main as updater
+
+    report_path = Path("report.json").resolve()
+    sys.argv = ["main.py", *arguments, "--report", str(report_path)]
+    exit_code: int = 0
+    try:
+        updater.main()
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    end: float = time.perf_counter()
+    with open(report_path, "r") as file:
+        report: dict = json.load(file)
+
+    children_peak_rss: int = 0
+    try:
+        import resource
+        children_peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    except ImportError:
+        pass
+    return {
+        "exit_code": exit_code,
+        "wall_time": end - start,
+        "phases": {name: stats["time"] for name, stats in report["phases"].items()},  # Summed over mods updated in parallel
+        "counters": report["counters"],
+        "peak_rss": peak_rss(),
+        "peak_rss_workers": children_peak_rss,
+    }
+
+
+def write_mods(directory: Path, count: int, icons: list[str], modded_fraction: float) -> list[Path]:
+    shutil.rmtree(directory, ignore_errors=True)
+    mods: list[Path] = []
+    for index in range(count):
+        mod: Path = directory / f"mod{index}"
+        synthetic.write_mod(mod, SOURCE_VERSION, icons, modded_fraction, seed=index)
+        mods.append(mod)
+    return mods
+
+
+def compare(results: list[dict], config: dict, baseline_path: Path) -> None:
+    with open(baseline_path, "r") as file:
+        data: dict = json.load(file)
+    baseline: dict[str, dict] = {result["scenario"]: result for result in data["results"]}
+
+    def change(value: float, old: float) -> str:
+        return f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"\nCompared to {baseline_path}")
+    if data["config"] != config:
+        print(f"Warning: the runs used different options ({data['config']} before, {config} now)")
+    print(f"{'scenario':<10} {'phase':<10} {'before':>10} {'after':>10} {'change':>8}")
+    for result in results:
+        old: dict | None = baseline.get(result["scenario"])
+        if old is None:
+            continue
+        for phase, duration in [("total", result["wall_time"]), *result["phases"].items()]:
+            old_duration: float | None = old["wall_time"] if phase == "total" else old["phases"].get(phase)
+            if old_duration is not None:
+                print(f"{result['scenario']:<10} {phase:<10} {old_duration * 1000:>8.1f}ms {duration * 1000:>8.1f}ms {change(duration, old_duration):>8}")
+        print(f"{result['scenario']:<10} {'peak RSS':<10} {old['peak_rss'] / (1024 * 1024):>8.1f}MB {result['peak_rss'] / (1024 * 1024):>8.1f}MB {change(result['peak_rss'], old['peak_rss']):>8}")
+
+
+def main() -> None:
+    if sys.argv[1:2] == ["--run"]:  # Each scenario runs in a fresh process so peak RSS is measured separately
+        print(json.dumps(run(sys.argv[2:])))
+        return
+
+    parser = argparse.ArgumentParser(description="Run main() end to end against synthetic deployments served by a local CDN stand-in and record timings as JSON")
+    parser.add_argument("--icons", type=int, default=2000, help="number of icons per size class (default: %(default)s)")
+    parser.add_argument("--mods", type=int, default=1, help="number of mods updated in one run (default: %(default)s)")
+    parser.add_argument("--modded-fraction", type=float, default=0.2, help="fraction of modded icons (default: %(default)s)")
+    parser.add_argument("--filler-files", type=int, default=8, help="LuaPackages members the updater doesn't need (default: %(default)s)")
+    parser.add_argument("--filler-size", type=float, default=1, metavar="MB", help="size of each filler member (default: %(default)s)")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--jobs", type=int, default=None, help="passed on to main.py")
+    parser.add_argument("--output", type=Path, default=None, metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--compare", type=Path, default=None, metavar="PATH", help="results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    config: dict = {key: value for key, value in vars(args).items() if key in ("icons", "mods", "modded_fraction", "filler_files", "filler_size", "jobs")}
+    results: list[dict] = []
+    with TemporaryDirectory(prefix="sober-mod-updater-bench-") as tmp:
+        temp_dir = Path(tmp)
+        icons: list[str] = synthetic.icon_names(args.icons)
+        synthetic.write_cdn(temp_dir / "cdn", [SOURCE_VERSION, TARGET_VERSION], icons, filler_files=args.filler_files, filler_size=int(args.filler_size * 1024 * 1024))
+        package_size: int = (temp_dir / "cdn" / f"{synthetic.version_hash(TARGET_VERSION)}-{synthetic.PACKAGE}").stat().st_size
+        print(f"{args.mods} mods, {args.icons} icons per size class, packages of {package_size / (1024 * 1024):.2f} MB")
+
+        with CdnServer(temp_dir / "cdn") as server:
+            for scenario in args.scenarios:
+                if scenario != "warm":
+                    shutil.rmtree(temp_dir / "cache", ignore_errors=True)
+                mods: list[Path] = write_mods(temp_dir / "mods", args.mods, icons, args.modded_fraction)
+                arguments: list[str] = ["--batch", "--target-version", str(TARGET_VERSION), *SCENARIOS[scenario]]
+                for mod in mods:
+                    arguments += ["--mod", str(mod)]
+                if args.jobs is not None:
+                    arguments += ["--jobs", str(args.jobs)]
+
+                env: dict[str, str] = dict(os.environ, SOBER_MOD_UPDATER_CDN=server.url, SOBER_MOD_UPDATER_CACHE=str(temp_dir / "cache"))
+                env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPOSITORY), env.get("PYTHONPATH")]))
+                server.reset_counters()
+                process = subprocess.run([sys.executable, "-m", "benchmarks.bench_e2e", "--run", *arguments], cwd=temp_dir, env=env, stdin=subprocess.DEVNULL, capture_output=True, text=True)
+                if process.returncode != 0:
+                    raise SystemExit(f"Scenario '{scenario}' failed:\n{process.stderr}")
+                result: dict = {"scenario": scenario, **json.loads(process.stdout.splitlines()[-1]), "bytes_transferred": server.bytes_sent, "requests": server.requests}
+                if result["exit_code"] != 0:
+                    raise SystemExit(f"Scenario '{scenario}': main() exited with {result['exit_code']}")
+                results.append(result)
+
+    print(f"{'scenario':<10} {'wall time':>10} {'peak RSS':>10} {'transferred':>12} {'requests':>9}  phases")
+    for result in results:
+        phases: str = ", ".join(f"{phase} {duration * 1000:.0f}ms" for phase, duration in result["phases"].items())
+        print(f"{result['scenario']:<10} {result['wall_time'] * 1000:>8.0f}ms {result['peak_rss'] / (1024 * 1024):>8.1f}MB {result['bytes_transferred'] / (1024 * 1024):>10.2f}MB {result['requests']:>9}  {phases}")
+    for result in results:
+        print(f"{result['scenario']:<10} " + ", ".join(f"{name} {value}" for name, value in result["counters"].items()))
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump({"config": config, "results": results}, file, indent=4)
+    if args.compare is not None:
+        compare(results, config, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Measures encode time and output size of every PNG mode over the imageSets an update writes
+# Usage: python -m benchmarks.bench_encode [--icons N] [--threads 0 2 4 ...]
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from tempfile import TemporaryDirectory
+import time
+
+from PIL import Image
+
+from benchmarks import synthetic
+from modules import imagesets
+from modules.detection import ModdedIconData, detect_modded_icons
+from modules.imagesets import ImageSet, get_imagesetdata
+from modules.png import PNG_MODES, PngEncoder
+from modules.updater import repaint_imagesets
+from modules.zip_fs import ZipFS
+
+
+def painted_imagesets(temp_dir: Path, icon_count: int) -> list[Image.Image]:
+    # The imageSets of a synthetic update from a mod's version to a version that moved every icon
+    icons: list[str] = synthetic.icon_names(icon_count)
+    synthetic.write_package(temp_dir / "source.zip", 2, icons)
+    synthetic.write_package(temp_dir / "target.zip", 3, icons)
+    synthetic.write_mod(temp_dir / "mod", 2, icons)
+    mod_imagesets: Path = temp_dir / "mod" / "ExtraContent" / "LuaPackages" / synthetic.IMAGE_SET_DIRECTORY
+    image_set_directory = PurePosixPath(synthetic.IMAGE_SET_DIRECTORY)
+    output: Path = temp_dir / "output"
+    output.mkdir()
+
+    with ZipFS(temp_dir / "source.zip") as source, ZipFS(temp_dir / "target.zip") as target:
+        source_imagesetdata: list[ImageSet] = get_imagesetdata(source.imagesetdata_file(image_set_directory), source.path(image_set_directory))
+        modded_icon_data: ModdedIconData = detect_modded_icons(source_imagesetdata, mod_imagesets)
+        target_imagesetdata: list[ImageSet] = get_imagesetdata(target.imagesetdata_file(image_set_directory), target.path(image_set_directory))
+        updated_icon_data, _ = synthetic.remap_by_name(target_imagesetdata, modded_icon_data)
+        repaint_imagesets(target_imagesetdata, updated_icon_data, output, encoder=PngEncoder("fast"))
+
+    painted: list[Image.Image] = []
+    for path in sorted(output.iterdir()):
+        with Image.open(path) as image:
+            painted.append(image.convert("RGBA"))
+    return painted
+
+
+def encode(images: list[Image.Image], encoder: PngEncoder) -> int:
+    # Total size of the encoded images
+    def save(image: Image.Image) -> int:
+        buffer = BytesIO()
+        encoder.save(image, buffer)
+        return buffer.tell()
+
+    if encoder.threads == 0:
+        return sum(save(image) for image in images)
+    with ThreadPoolExecutor(max_workers=encoder.threads, thread_name_prefix="encode") as executor:
+        return sum(executor.map(save, images))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure encode time and output size of every PNG mode")
+    parser.add_argument("--icons", type=int, default=4000, help="number of icons per size class (default: %(default)s)")
+    parser.add_argument("--threads", type=int, nargs="+", default=[0, 2], help="encoder threads to measure, 0 encodes in the main thread (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with TemporaryDirectory(prefix="sober-mod-updater-bench-") as tmp:
+        imagesets.LAYOUT_CACHE = None
+        images: list[Image.Image] = painted_imagesets(Path(tmp), args.icons)
+    pixels: int = sum(image.width * image.height for image in images)
+    print(f"{len(images)} imageSets, {pixels * 4 / (1024 * 1024):.1f} MB of RGBA pixels")
+
+    results: list[tuple[str, int, float, int]] = []
+    for mode in PNG_MODES:
+        for threads in args.threads:
+            encoder = PngEncoder(mode, threads)
+            duration: float = float("inf")
+            for _ in range(args.repeat):
+                start: float = time.perf_counter()
+                size: int = encode(images, encoder)
+                duration = min(duration, time.perf_counter() - start)
+            results.append((mode, threads, duration, size))
+
+    baseline: float = next(duration for mode, threads, duration, _ in results if mode == "default" and threads == args.threads[0])
+    print(f"{'mode':<8} {'threads':>7} {'encode':>10} {'speedup':>8} {'output':>10}")
+    for mode, threads, duration, size in results:
+        print(f"{mode:<8} {threads:>7} {duration * 1000:>8.1f}ms {baseline / duration:>7.2f}x {size / (1024 * 1024):>8.2f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Compares the old full extraction with selective, streaming extraction
+# Usage: python -m benchmarks.bench_extract [--icons N] [--filler-files N] [--filler-size MB]
+import argparse
+import json
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+import time
+from zipfile import ZipFile
+
+from benchmarks import synthetic
+from modules import zip_extractor
+from modules.imagesets import get_imageset_members
+from modules.metrics import peak_rss
+
+
+MODES: list[str] = ["legacy", "full", "selective", "selective-threaded"]
+
+
+def legacy_extract(source: Path, destination: Path) -> None:
+    # zip_extractor.extract before selective extraction, kept as the baseline
+    destination.mkdir(parents=True, exist_ok=True)
+    with ZipFile(source, "r") as archive:
+        for member in archive.namelist():
+            normalized = member.lstrip("\\/").replace("\\\\", "/").replace("\\", "/")
+            if not normalized.strip():
+                continue
+            target: Path = destination / normalized
+            if normalized.endswith("/"):
+                target.mkdir(parents=True, exist_ok=True)
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                with archive.open(member) as archived, open(target, "wb") as file:
+                    file.write(archived.read())
+
+
+def run(mode: str, source: Path, destination: Path) -> dict:
+    start: float = time.perf_counter()
+    if mode == "legacy":
+        legacy_extract(source, destination)
+    elif mode == "full":
+        zip_extractor.extract(source, destination)
+    else:
+        with ZipFile(source, "r") as archive:
+            members: list[str] = get_imageset_members(archive.namelist())
+            zip_extractor.extract(archive, destination, members, workers=4 if mode == "selective-threaded" else 1)
+    duration: float = time.perf_counter() - start
+    files: int = sum(1 for path in destination.rglob("*") if path.is_file())
+    return {"mode": mode, "wall_time": duration, "peak_rss": peak_rss(), "files": files}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare full extraction with selective, streaming extraction")
+    parser.add_argument("--icons", type=int, default=2000)
+    parser.add_argument("--filler-files", type=int, default=16)
+    parser.add_argument("--filler-size", type=float, default=16, metavar="MB")
+    parser.add_argument("--run", nargs=3, metavar=("MODE", "SOURCE", "DESTINATION"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:  # Each mode runs in a fresh process so peak RSS is measured separately
+        mode, source, destination = args.run
+        print(json.dumps(run(mode, Path(source), Path(destination))))
+        return
+
+    with TemporaryDirectory(prefix="sober-mod-updater-bench-") as tmp:
+        temp_dir = Path(tmp)
+        package: Path = temp_dir / synthetic.PACKAGE
+        synthetic.write_package(package, 1, synthetic.icon_names(args.icons), filler_files=args.filler_files, filler_size=int(args.filler_size * 1024 * 1024))
+        print(f"Package: {package.stat().st_size / (1024 * 1024):.2f} MB")
+
+        results: list[dict] = []
+        for mode in MODES:
+            destination: Path = temp_dir / mode
+            output: str = subprocess.run([sys.executable, "-m", "benchmarks.bench_extract", "--run", mode, str(package), str(destination)], check=True, capture_output=True, text=True).stdout
+            results.append(json.loads(output))
+            shutil.rmtree(destination)
+
+    print(f"{'mode':<20} {'wall time':>12} {'peak RSS':>12} {'files':>8}")
+    for result in results:
+        print(f"{result['mode']:<20} {result['wall_time'] * 1000:>10.1f}ms {result['peak_rss'] / (1024 * 1024):>10.1f}MB {result['files']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Measures peak memory of detecting and repainting mods of increasing size. Fails if peak RSS grows with
+# the size of the mod by more than a few of the largest imageSets, instead of staying bounded by them
+# Usage: python -m benchmarks.bench_memory [--icons N N ...] [--modded-fraction F] [--tolerance N]
+import argparse
+import json
+from pathlib import Path, PurePosixPath
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+import time
+
+from benchmarks import synthetic
+from modules import imagesets
+from modules.detection import ModdedIconData, detect_modded_icons
+from modules.imagesets import ImageSet, get_imagesetdata
+from modules.metrics import peak_rss
+from modules.patch import IconPatch
+from modules.updater import repaint_imagesets
+from modules.zip_fs import ZipFS
+
+
+def run(directory: Path) -> dict:
+    # Same steps as an update: detect against the mod's version, paint the target version and write the icon patch
+    imagesets.LAYOUT_CACHE = None
+    image_set_directory = PurePosixPath(synthetic.IMAGE_SET_DIRECTORY)
+    mod_imagesets: Path = directory / "mod" / "ExtraContent" / "LuaPackages" / synthetic.IMAGE_SET_DIRECTORY
+    output: Path = directory / "output"
+    output.mkdir(exist_ok=True)
+
+    start: float = time.perf_counter()
+    with ZipFS(directory / "source.zip") as source, ZipFS(directory / "target.zip") as target:
+        source_imagesetdata: list[ImageSet] = get_imagesetdata(source.imagesetdata_file(image_set_directory), source.path(image_set_directory))
+        modded_icon_data: ModdedIconData = detect_modded_icons(source_imagesetdata, mod_imagesets, icon_file=directory / "modded_icons")
+
+        target_imagesetdata: list[ImageSet] = get_imagesetdata(target.imagesetdata_file(image_set_directory), target.path(image_set_directory))
+        updated_icon_data, updated_patch_data = synthetic.remap_by_name(target_imagesetdata, modded_icon_data)
+        repaint_imagesets(target_imagesetdata, updated_icon_data, output)
+        IconPatch.from_modded_icon_data(updated_patch_data, 2, "00" * 32, "00" * 32).write(directory / "icons.patch")
+
+    modded_pixels: int = 0
+    for icons in modded_icon_data.values():
+        for x0, y0, x1, y1 in (box for box, _ in icons.values()):
+            modded_pixels += (x1 - x0) * (y1 - y0) * 4
+    return {
+        "wall_time": time.perf_counter() - start,
+        "peak_rss": peak_rss(),
+        "modded_icons": sum(len(icons) for icons in modded_icon_data.values()),
+        "modded_bytes": modded_pixels,
+        "imagesets": len(target_imagesetdata),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure peak memory of detecting and repainting mods of increasing size")
+    parser.add_argument("--icons", type=int, nargs="+", default=[1000, 4000, 8000], help="icons per size class of each mod (default: %(default)s)")
+    parser.add_argument("--modded-fraction", type=float, default=0.5)
+    parser.add_argument("--tolerance", type=float, default=3, help="allowed peak RSS growth, in decoded sizes of the largest imageSet (default: %(default)s)")
+    parser.add_argument("--run", metavar="DIRECTORY", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:  # Each mod size runs in a fresh process so peak RSS is measured separately
+        print(json.dumps(run(Path(args.run))))
+        return
+
+    # The largest imageSet is a full 3x atlas of build_layout's default size
+    largest_imageset: int = (512 * 3) ** 2 * 4
+    results: list[tuple[int, dict]] = []
+    with TemporaryDirectory(prefix="sober-mod-updater-bench-") as tmp:
+        for icon_count in sorted(args.icons):
+            directory: Path = Path(tmp) / str(icon_count)
+            icons: list[str] = synthetic.icon_names(icon_count)
+            # Odd versions shuffle their icons, so every target imageSet takes icons from many source imageSets
+            synthetic.write_package(directory / "source.zip", 2, icons)
+            synthetic.write_package(directory / "target.zip", 3, icons)
+            synthetic.write_mod(directory / "mod", 2, icons, args.modded_fraction)
+            output: str = subprocess.run([sys.executable, "-m", "benchmarks.bench_memory", "--run", str(directory)], check=True, capture_output=True, text=True).stdout
+            results.append((icon_count, json.loads(output)))
+
+    print(f"{'icons':>6} {'imageSets':>10} {'modded':>8} {'modded pixels':>14} {'wall time':>12} {'peak RSS':>10}")
+    for icon_count, result in results:
+        print(f"{icon_count:>6} {result['imagesets']:>10} {result['modded_icons']:>8} {result['modded_bytes'] / (1024 * 1024):>12.1f}MB {result['wall_time'] * 1000:>10.1f}ms {result['peak_rss'] / (1024 * 1024):>8.1f}MB")
+
+    growth: int = results[-1][1]["peak_rss"] - results[0][1]["peak_rss"]
+    limit: float = args.tolerance * largest_imageset
+    print(f"Peak RSS growth: {growth / (1024 * 1024):.1f}MB, limit {limit / (1024 * 1024):.1f}MB")
+    if growth > limit:
+        raise SystemExit(f"Peak memory grows with the size of the mod ({growth / (1024 * 1024):.1f}MB > {limit / (1024 * 1024):.1f}MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Measures modded icon detection and imageSet repainting with process pools of different sizes
+# Usage: python -m benchmarks.bench_parallel [--icons N] [--jobs 1 2 4 ...]
+import argparse
+from pathlib import Path, PurePosixPath
+import shutil
+from tempfile import TemporaryDirectory
+import time
+
+from benchmarks import synthetic
+from modules import imagesets
+from modules.detection import detect_modded_icons
+from modules.imagesets import ImageSet, get_imagesetdata
+from modules.parallel import create_pool, default_jobs
+from modules.updater import repaint_imagesets
+from modules.zip_fs import ZipFS
+
+
+def warm_up(executor) -> None:
+    # Workers are started on demand, start all of them so process startup isn't measured
+    if executor is not None:
+        list(executor.map(time.sleep, [0.05] * executor._max_workers))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure detection and repainting with process pools of different sizes")
+    parser.add_argument("--icons", type=int, default=6000, help="number of icons per size class (default: %(default)s)")
+    parser.add_argument("--jobs", type=int, nargs="+", default=None, help="pool sizes to measure (default: 1, 2, 4, ... up to the number of CPUs)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    jobs: list[int] = args.jobs or sorted({1} | {2 ** exponent for exponent in range(1, 8) if 2 ** exponent <= default_jobs()} | {default_jobs()})
+
+    with TemporaryDirectory(prefix="sober-mod-updater-bench-") as tmp:
+        temp_dir = Path(tmp)
+        imagesets.LAYOUT_CACHE = temp_dir / "layouts"
+        icons: list[str] = synthetic.icon_names(args.icons)
+        package: Path = temp_dir / synthetic.PACKAGE
+        synthetic.write_package(package, 2, icons)
+        synthetic.write_mod(temp_dir / "mod", 2, icons)
+        mod_imagesets: Path = temp_dir / "mod" / "ExtraContent" / "LuaPackages" / synthetic.IMAGE_SET_DIRECTORY
+        image_set_directory = PurePosixPath(synthetic.IMAGE_SET_DIRECTORY)
+
+        with ZipFS(package) as fs:
+            imagesetdata: list[ImageSet] = get_imagesetdata(fs.imagesetdata_file(image_set_directory), fs.path(image_set_directory))
+            print(f"{len(imagesetdata)} imageSets, {sum(len(imageset.icons) for imageset in imagesetdata)} icons, {default_jobs()} CPUs")
+
+            results: list[tuple[int, float, float]] = []
+            expected_count: int | None = None
+            for job_count in jobs:
+                executor = create_pool(job_count)
+                try:
+                    warm_up(executor)
+                    detect_time: float = float("inf")
+                    repaint_time: float = float("inf")
+                    for _ in range(args.repeat):
+                        start: float = time.perf_counter()
+                        modded_icon_data = detect_modded_icons(imagesetdata, mod_imagesets, executor=executor)
+                        detect_time = min(detect_time, time.perf_counter() - start)
+
+                        # Same layout in both versions, every modded icon stays where it is
+                        updated_icon_data, _ = synthetic.remap_by_name(imagesetdata, modded_icon_data)
+
+                        output: Path = temp_dir / "output"
+                        shutil.rmtree(output, ignore_errors=True)
+                        output.mkdir()
+                        start = time.perf_counter()
+                        repaint_imagesets(imagesetdata, updated_icon_data, output, executor)
+                        repaint_time = min(repaint_time, time.perf_counter() - start)
+
+                    modded_count: int = sum(len(icons) for icons in modded_icon_data.values())
+                    if expected_count is not None and modded_count != expected_count:
+                        raise AssertionError(f"--jobs {job_count} detected {modded_count} modded icons, expected {expected_count}")
+                    expected_count = modded_count
+                finally:
+                    if executor is not None:
+                        executor.shutdown()
+                results.append((job_count, detect_time, repaint_time))
+
+    baseline: float = results[0][1] + results[0][2]
+    print(f"{'jobs':>4} {'detect':>10} {'repaint':>10} {'total':>10} {'speedup':>8}")
+    for job_count, detect_time, repaint_time in results:
+        total: float = detect_time + repaint_time
+        print(f"{job_count:>4} {detect_time * 1000:>8.1f}ms {repaint_time * 1000:>8.1f}ms {total * 1000:>8.1f}ms {baseline / total:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
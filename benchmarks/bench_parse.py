@@ -0,0 +1,88 @@
+# Compares the old two-regex GetImageSetData.lua parser with the single-pass parser and the layout cache
+# Usage: python -m benchmarks.bench_parse [--icons N]
+import argparse
+from pathlib import Path
+import re
+from tempfile import TemporaryDirectory
+import time
+
+from benchmarks import synthetic
+from modules import imagesets
+from modules.hashing import sha256sum
+from modules.imagesets import Icon, ImageSet, get_imagesetdata
+
+
+def legacy_get_imagesetdata(data_file: Path, imageset_directory: Path) -> list[ImageSet]:
+    # get_imagesetdata and _parse_file_content before the single-pass parser, kept as the baseline
+    with open(data_file, "r") as file:
+        content: str = file.read()
+
+    icon_map: dict[str, dict[str, dict[str, str | int]]] = {}
+    image_size_pattern: str = r"function make_assets_(\dx)\(\).*?(\{.*?\}) end"
+    icon_data_pattern: str = r"\['([^']+)'\] = \{ ImageRectOffset = Vector2\.new\((\d+), (\d+)\), ImageRectSize = Vector2\.new\((\d+), (\d+)\), ImageSet = '([^']+)' \}"
+    for size, data in re.findall(image_size_pattern, content, re.DOTALL):
+        if size not in icon_map:
+            icon_map[size] = {}
+        for name, x, y, w, h, image_set in re.findall(icon_data_pattern, data):
+            icon_map[size][name] = {"image_set": image_set, "x": int(x), "y": int(y), "w": int(w), "h": int(h)}
+
+    imagesets_dict: dict[str, ImageSet] = {}
+    for size, icons in icon_map.items():
+        for name, data in icons.items():
+            imageset: str = data["image_set"]
+            x, y, w, h = data["x"], data["y"], data["w"], data["h"]
+            icon: Icon = Icon(name, imageset, x, y, w, h, (x, y, x + w, y + h))
+            imageset_item: ImageSet | None = imagesets_dict.get(imageset)
+            if imageset_item is None:
+                imagesets_dict[imageset] = ImageSet(imageset, imageset_directory / f"{imageset}.png", size, [icon])
+            else:
+                imageset_item.icons.append(icon)
+    return list(imagesets_dict.values())
+
+
+def measure(function, repeat: int) -> float:
+    best: float = float("inf")
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the two-regex GetImageSetData.lua parser with the single-pass parser and the layout cache")
+    parser.add_argument("--icons", type=int, default=50000, help="total number of icons over all size classes (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with TemporaryDirectory(prefix="sober-mod-updater-bench-") as tmp:
+        temp_dir = Path(tmp)
+        imagesets.LAYOUT_CACHE = temp_dir / "layouts"
+        data_file: Path = temp_dir / "GetImageSetData.lua"
+        layout = synthetic.build_layout(1, synthetic.icon_names(args.icons // len(synthetic.SCALES)))
+        data_file.write_text(synthetic.render_imagesetdata(layout))
+        sha256: str = sha256sum(data_file)
+        print(f"GetImageSetData.lua: {data_file.stat().st_size / (1024 * 1024):.2f} MB, {sum(len(entries) for entries in layout.values())} icons")
+
+        expected = legacy_get_imagesetdata(data_file, temp_dir)
+        if get_imagesetdata(data_file, temp_dir) != expected:
+            raise AssertionError("The single-pass parser doesn't match the legacy parser")
+
+        def cached_from_disk() -> None:
+            imagesets._layouts.clear()
+            get_imagesetdata(data_file, temp_dir, sha256)
+
+        results: list[tuple[str, float]] = [
+            ("legacy", measure(lambda: legacy_get_imagesetdata(data_file, temp_dir), args.repeat)),
+            ("single-pass", measure(lambda: get_imagesetdata(data_file, temp_dir), args.repeat)),
+            ("layout cache (disk)", measure(cached_from_disk, args.repeat)),
+            ("layout cache (memory)", measure(lambda: get_imagesetdata(data_file, temp_dir, sha256), args.repeat)),
+        ]
+
+    print(f"{'parser':<24} {'time':>10}")
+    for name, duration in results:
+        print(f"{name:<24} {duration * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Local stand-in for setup.rbxcdn.com: serves a directory written by synthetic.write_cdn,
+# with Range requests, and counts what it sends
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import re
+import threading
+
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class CdnServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    root: Path
+    bytes_sent: int
+    requests: int
+    _lock: threading.Lock
+    _thread: threading.Thread | None
+
+    def __init__(self, root: Path) -> None:
+        super().__init__(("127.0.0.1", 0), CdnRequestHandler)
+        self.root = root
+        self.bytes_sent = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self) -> "CdnServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="cdn", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.bytes_sent = 0
+            self.requests = 0
+
+    def count(self, size: int) -> None:
+        with self._lock:
+            self.bytes_sent += size
+            self.requests += 1
+
+
+class CdnRequestHandler(BaseHTTPRequestHandler):
+    server: CdnServer
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        self.send(head=True)
+
+    def do_GET(self) -> None:
+        self.send(head=False)
+
+    def send(self, head: bool) -> None:
+        path: Path = self.server.root / self.path.split("?")[0].lstrip("/")
+        if not path.is_file() or not path.resolve().is_relative_to(self.server.root.resolve()):
+            self.send_error(404)
+            return
+
+        size: int = path.stat().st_size
+        start, end = 0, size - 1
+        match: re.Match | None = RANGE_PATTERN.match(self.headers.get("Range", ""))
+        if match is not None and match.group(1) + match.group(2):
+            if not match.group(1):  # Suffix range: the last N bytes
+                start = max(size - int(match.group(2)), 0)
+            else:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else end
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if head:
+            return
+
+        with open(path, "rb") as file:
+            file.seek(start)
+            body: bytes = file.read(end - start + 1)
+        self.wfile.write(body)
+        self.server.count(len(body))
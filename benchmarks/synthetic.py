@@ -0,0 +1,155 @@
+import hashlib
+from io import BytesIO
+import json
+from pathlib import Path
+import random
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from PIL import Image
+
+from modules.detection import Box, IconSource, ModdedIconData
+from modules.imagesets import ImageSet
+
+
+IMAGE_SET_DIRECTORY: str = "Packages/_Index/FoundationImages/FoundationImages/SpriteSheets"
+IMAGESETDATA_FILE: str = "Packages/_Index/FoundationImages/FoundationImages/Generated/GetImageSetData.lua"
+PACKAGE: str = "extracontent-luapackages.zip"
+SCALES: dict[str, int] = {"1x": 1, "2x": 2, "3x": 3}
+MOD_COLOR: tuple[int, int, int, int] = (255, 0, 255, 255)
+
+# (icon name, imageSet, x, y, w, h) per size class
+Layout = dict[str, list[tuple[str, str, int, int, int, int]]]
+
+
+def icon_names(count: int) -> list[str]:
+    return [f"icons/synthetic/icon_{index}" for index in range(count)]
+
+
+def version_hash(fileVersion: int) -> str:
+    return f"version-{fileVersion:016x}"
+
+
+def icon_image(name: str, size: int) -> Image.Image:
+    # Deterministic per icon, so an icon looks the same in every version it appears in
+    rnd = random.Random(hashlib.md5(name.encode()).digest())
+    image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    color = (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), 255)
+    inset: int = max(size // 4, 1)
+    image.paste(color, (inset, inset, size - inset, size - inset))
+    image.putpixel((0, 0), (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), rnd.randrange(1, 256)))
+    return image
+
+
+def build_layout(fileVersion: int, icons: list[str], icon_size: int = 16, atlas_size: int = 512, shuffle: bool = True) -> Layout:
+    # Odd versions shuffle the icon order so icons move between versions
+    names: list[str] = list(icons)
+    if shuffle and fileVersion % 2:
+        random.Random(fileVersion).shuffle(names)
+
+    layout: Layout = {}
+    for size, scale in SCALES.items():
+        icon_pixels: int = icon_size * scale
+        per_row: int = (atlas_size * scale) // icon_pixels
+        per_imageset: int = per_row * per_row
+        entries: list[tuple[str, str, int, int, int, int]] = []
+        for index, name in enumerate(names):
+            imageset: str = f"img_set_{size}_{index // per_imageset + 1}"
+            position: int = index % per_imageset
+            entries.append((name, imageset, (position % per_row) * icon_pixels, (position // per_row) * icon_pixels, icon_pixels, icon_pixels))
+        layout[size] = entries
+    return layout
+
+
+def render_imagesetdata(layout: Layout) -> str:
+    lines: list[str] = []
+    for size, entries in layout.items():
+        assets: str = ", ".join(f"['{name}'] = {{ ImageRectOffset = Vector2.new({x}, {y}), ImageRectSize = Vector2.new({w}, {h}), ImageSet = '{imageset}' }}" for name, imageset, x, y, w, h in entries)
+        lines.append(f"local function make_assets_{size}() return {{ {assets} }} end")
+    lines.append("return function(scale) if scale > 2.5 then return make_assets_3x() elseif scale > 1.5 then return make_assets_2x() end return make_assets_1x() end")
+    return "\n".join(lines) + "\n"
+
+
+def render_imagesets(layout: Layout) -> dict[str, Image.Image]:
+    extents: dict[str, tuple[int, int]] = {}
+    for entries in layout.values():
+        for _, imageset, x, y, w, h in entries:
+            width, height = extents.get(imageset, (0, 0))
+            extents[imageset] = (max(width, x + w), max(height, y + h))
+
+    imagesets: dict[str, Image.Image] = {imageset: Image.new("RGBA", extent, (0, 0, 0, 0)) for imageset, extent in extents.items()}
+    for entries in layout.values():
+        for name, imageset, x, y, w, h in entries:
+            imagesets[imageset].paste(icon_image(name, w), (x, y))
+    return imagesets
+
+
+def encode_png(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def write_package(path: Path, fileVersion: int, icons: list[str], filler_files: int = 0, filler_size: int = 256 * 1024, **layout_options) -> Layout:
+    # Filler members stand in for the rest of LuaPackages, which the updater doesn't need
+    layout: Layout = build_layout(fileVersion, icons, **layout_options)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rnd = random.Random(fileVersion)
+    with ZipFile(path, "w", ZIP_DEFLATED) as archive:
+        for index in range(filler_files):
+            words: list[str] = [f"local value_{rnd.randrange(10000)} = {rnd.randrange(10 ** 6)}" for _ in range(filler_size // 32)]
+            archive.writestr(f"Packages/_Index/Filler{index}/Filler/init.lua", "\n".join(words))
+        for imageset, image in render_imagesets(layout).items():
+            archive.writestr(f"{IMAGE_SET_DIRECTORY}/{imageset}.png", encode_png(image))
+        archive.writestr(IMAGESETDATA_FILE, render_imagesetdata(layout))
+    return layout
+
+
+def write_mod(path: Path, fileVersion: int, icons: list[str], modded_fraction: float = 0.2, seed: int = 0, **layout_options) -> set[str]:
+    # Returns the names of the modded icons
+    layout: Layout = build_layout(fileVersion, icons, **layout_options)
+    imagesets: dict[str, Image.Image] = render_imagesets(layout)
+    rnd = random.Random(seed)
+    modded: set[str] = {name for name in icons if rnd.random() < modded_fraction}
+    for entries in layout.values():
+        for name, imageset, x, y, w, h in entries:
+            if name in modded:
+                imagesets[imageset].paste(MOD_COLOR, (x + 1, y + 1, x + w - 1, y + h - 1))
+
+    directory: Path = path / "ExtraContent" / "LuaPackages" / IMAGE_SET_DIRECTORY
+    directory.mkdir(parents=True, exist_ok=True)
+    for imageset, image in imagesets.items():
+        image.save(directory / f"{imageset}.png", format="PNG")
+    with open(path / "info.json", "w") as file:
+        json.dump({"fileVersion": fileVersion}, file, indent=4)
+    return modded
+
+
+def remap_by_name(target_imagesetdata: list[ImageSet], modded_icon_data: ModdedIconData) -> tuple[dict[str, list[tuple[Box, IconSource]]], ModdedIconData]:
+    # The modded icons at their positions in the target version, by imageSet name and by size class.
+    # Only by name: synthetic versions never rename icons, unlike updater._remap_icons
+    updated_icon_data: dict[str, list[tuple[Box, IconSource]]] = {}
+    updated_patch_data: ModdedIconData = {}
+    for imageset in target_imagesetdata:
+        for icon in imageset.icons:
+            modded_icon = modded_icon_data.get(imageset.size, {}).get(icon.name)
+            if modded_icon is not None:
+                updated_icon_data.setdefault(imageset.name, []).append((icon.box, modded_icon[1]))
+                updated_patch_data.setdefault(imageset.size, {})[icon.name] = (icon.box, modded_icon[1])
+    return updated_icon_data, updated_patch_data
+
+
+def render_deploy_history(fileVersions: list[int]) -> str:
+    lines: list[str] = []
+    for fileVersion in fileVersions:
+        lines.append(f"New WindowsPlayer {version_hash(fileVersion + 100000)} at 1/1/2025 1:00:00 AM, file version: 0, {fileVersion}, 0, 0, git hash: 0 ...")
+        lines.append(f"New Studio64 {version_hash(fileVersion)} at 1/1/2025 1:00:00 AM, file version: 0, {fileVersion}, 0, 0, git hash: 0 ...")
+    return "\n".join(lines) + "\n"
+
+
+def write_cdn(directory: Path, fileVersions: list[int], icons: list[str], **package_options) -> None:
+    # The same layout as setup.rbxcdn.com, ready to be served by a static file server
+    directory.mkdir(parents=True, exist_ok=True)
+    for fileVersion in fileVersions:
+        write_package(directory / f"{version_hash(fileVersion)}-{PACKAGE}", fileVersion, icons, **package_options)
+    with open(directory / "DeployHistory.txt", "w") as file:
+        file.write(render_deploy_history(fileVersions))
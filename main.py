@@ -1,257 +1,478 @@
-import hashlib
+import argparse
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import asdict
 import json
 import logging
-import os
 from pathlib import Path
-import re
 import shutil
 import sys
 from tempfile import TemporaryDirectory
+import threading
+import time
 
 try:
-    from modules.deployments import DeployHistory, Deployment
-    from modules.mod import Mod
-    from modules.imagesets import Icon, ImageSet, get_imagesetdata
-    from modules import zip_extractor
-
-    from PIL import Image
+    from modules.backup import Backup, BackupError, BackupStats, backup_path
+    from modules.deployments import DeployHistory, DeployHistoryError
+    from modules.downloader import DownloadError
+    from modules.icon_manifest import IconManifest, has_manifest, load_manifest, save_manifest
+    from modules.layout_hashes import known_layout_hash
+    from modules.metrics import METRICS, PHASES, phase
+    from modules.mod import Mod, ModError
+    from modules.package_cache import PackageCache
+    from modules.parallel import create_pool, default_jobs
+    from modules.png import PNG_MODES, PngEncoder
+    from modules.patch import PATCH_FILE
+    from modules.paths import cache_directory
+    from modules.updater import PackageStore, UpdateError, UpdateResult, update_mod
+    from modules.watch import Watcher
 except (ImportError, ModuleNotFoundError) as e:
     input(e)
     sys.exit(1)
 
 
-class Config:
-    PATH = Path("config.json").resolve()
+INTERACTIVE: bool = True
 
-    target_version: int
-    mod_path: Path
 
-    def __init__(self) -> None:
-        if not self.PATH.exists():
-            logging.error(f"Failed to load config: Config not found! ({self.PATH})")
-            input("Press ENTER to exit...")
-            sys.exit(1)
+def pause() -> None:
+    if INTERACTIVE:
+        input("Press ENTER to exit...")
 
-        with open(self.PATH, "r") as file:
-            data = json.load(file)
-        target_version = data.get("target_version")
-        mod_path = data.get("mod_path")
 
+def fail(message: str) -> None:
+    logging.error(message)
+    pause()
+    sys.exit(1)
+
+
+class Config:
+    PATH = Path("config.json").resolve()
+
+    target_versions: list[int]
+    mod_paths: list[Path]
+    batch: bool  # Several mods, or --batch: never prompt
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        # Command line arguments take precedence over config.json
+        data: dict = {}
+        if self.PATH.exists():
+            with open(self.PATH, "r") as file:
+                data = json.load(file)
+        elif not args.mod or (args.target_version is None and not args.watch and not args.restore):
+            fail(f"Failed to load config: Config not found! ({self.PATH})")
+
+        if args.mod:
+            mod_paths: list = [str(path) for path in args.mod]
+        elif data.get("mods") is not None:
+            mod_paths = data["mods"]
+            if not isinstance(mod_paths, list) or not mod_paths:
+                fail("Failed to load config[mods]: mods must be a non-empty list of paths")
+        else:
+            mod_path = data.get("mod_path")
+            if mod_path is None:
+                if not INTERACTIVE:
+                    fail("Failed to load config[mod_path]: mod_path is None")
+                logging.warning("Failed to load config[mod_path]: mod_path is None")
+                print()
+                mod_path = input("Mod path: ")
+            mod_paths = [mod_path]
+
+        self.mod_paths = []
+        for mod_path in mod_paths:
+            if isinstance(mod_path, str):
+                mod_path = Path(mod_path).expanduser().resolve()
+            elif isinstance(mod_path, list) and all(isinstance(item, str) for item in mod_path):
+                mod_path = Path(*mod_path).expanduser().resolve()
+            else:
+                fail(f"Failed to load config[mod_path]: TypeError: mod_path must be of type 'str' or 'list[str]', not '{type(mod_path)}'")
+            if not mod_path.exists() and not (args.restore and backup_path(mod_path).exists()):
+                fail(f"Failed to load config[mod_path]: Path does not exist! ({mod_path})")
+            self.mod_paths.append(mod_path)
+        self.batch = args.batch or len(self.mod_paths) > 1 or args.watch
+        if args.restore or args.watch:  # No target version needed
+            return
+
+        # A single version or a list of versions
+        target_version = args.target_version if args.target_version is not None else data.get("target_version")
         try:
             if target_version is None:
+                if self.batch:
+                    fail("Failed to load config[target_version]: target_version is None")
                 logging.warning("Failed to load config[target_version]: target_version is None")
                 print()
-                target_version = input("Target version: ")
-            target_version = int(target_version)
-            self.target_version = target_version
-        except ValueError as e:
-            logging.error(f"Failed to load config[target_version]: {e}")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-
-        if mod_path is None:
-                logging.warning("Failed to load config[mod_path]: mod_path is None")
-                print()
-                mod_path = input("Mod path: ")
-        if isinstance(mod_path, str):
-            mod_path = Path(mod_path).expanduser().resolve()
-        elif isinstance(mod_path, list) and all(isinstance(item, str) for item in mod_path):
-            mod_path = Path(*mod_path).expanduser().resolve()
-        else:
-            logging.error(f"Failed to load config[mod_path]: TypeError: mod_path must be of type 'str' or 'list[str]', not '{type(mod_path)}'")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-        if not mod_path.exists():
-            logging.error("Failed to load config[mod_path]: Path does not exist!")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-        self.mod_path = mod_path
-
-
-# https://stackoverflow.com/a/44873382
-def sha256sum(target: Path) -> str:
-    h  = hashlib.sha256()
-    b  = bytearray(128*1024)
-    mv = memoryview(b)
-    with open(target, 'rb', buffering=0) as f:
-        while n := f.readinto(mv):
-            h.update(mv[:n])
-    return h.hexdigest()
-
-
-def compare_images(image1: Image.Image, image2: Image.Image) -> bool:
-    if image1.size != image2.size:
-        return False
-    
-    image1_data = image1.getdata()
-    image2_data = image2.getdata()
-
-    for pixel1, pixel2 in zip(image1_data, image2_data):
-        a1, a2 = pixel1[3], pixel2[3]
-        if a1 != a2:
-            return False
-        elif a1 == 0:
+                target_version = input("Target version: ").replace(",", " ").split()
+            target_versions: list = target_version if isinstance(target_version, list) else [target_version]
+            if not target_versions:
+                raise ValueError("no target version")
+            self.target_versions = list(dict.fromkeys(int(version) for version in target_versions))
+        except (TypeError, ValueError) as e:
+            fail(f"Failed to load config[target_version]: {e}")
+
+
+def parse_version_range(value: str) -> list[int]:
+    # "690" or "680-697"
+    start, _, end = value.partition("-")
+    try:
+        first: int = int(start)
+        last: int = int(end) if end else first
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid version range: '{value}'")
+    if last < first:
+        raise argparse.ArgumentTypeError(f"invalid version range: '{value}'")
+    return list(range(first, last + 1))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Update your Roblox mods")
+    cache = parser.add_argument_group("package cache")
+    cache.add_argument("--no-cache", action="store_true", help="bypass the package cache, always download packages")
+    cache.add_argument("--cache-dir", type=Path, default=None, help="package cache location (default: ~/.cache/sober-mod-updater/packages)")
+    cache.add_argument("--cache-size", type=int, default=PackageCache.DEFAULT_MAX_SIZE // (1024 * 1024), metavar="MB", help="maximum size of the package cache (default: %(default)s)")
+    cache.add_argument("--cache-info", action="store_true", help="list cached packages and exit")
+    cache.add_argument("--cache-prune", action="store_true", help="remove corrupted and least recently used packages and exit")
+    parser.add_argument("--refresh-history", action="store_true", help="check for new deployments even if the requested versions are in the cached DeployHistory")
+    parser.add_argument("--partial", action="store_true", help="only download the package members that are needed using HTTP Range requests (bypasses the package cache)")
+    parser.add_argument("--jobs", type=int, default=default_jobs(), metavar="N", help="number of processes used to detect modded icons and update imageSets (default: number of CPUs, %(default)s)")
+    png = parser.add_argument_group("PNG encoding")
+    png.add_argument("--png", choices=list(PNG_MODES), default="default", help="'fast' writes imageSets faster but larger, 'max' writes the smallest files (default: %(default)s)")
+    png.add_argument("--encode-threads", type=int, default=0, metavar="N", help="with --jobs 1, paint and encode imageSets on N threads instead of the main thread (default: %(default)s)")
+    parser.add_argument("--no-patch", action="store_true", help="ignore the mods' icon patches and detect modded icons again")
+    manifests = parser.add_argument_group("icon manifests")
+    manifests.add_argument("--build-manifests", type=parse_version_range, default=None, metavar="VERSIONS", help="build icon manifests for a file version or an inclusive range of versions (e.g. 680-697) and exit")
+    manifests.add_argument("--no-manifest", action="store_true", help="ignore icon manifests, always download the mod's version")
+    parser.add_argument("--restore", action="store_true", help="restore the mods from their backups and exit")
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument("--mod", type=Path, action="append", metavar="PATH", help="mod to update, can be given several times (default: mods or mod_path from config.json)")
+    batch.add_argument("--target-version", type=int, nargs="+", default=None, metavar="VERSION", help="file version(s) to update to, with several versions the mod is left untouched and one updated copy per version is written (default: target_version from config.json)")
+    batch.add_argument("--output", type=Path, default=None, metavar="DIR", help="where the copies for several target versions are written (default: next to the mod)")
+    batch.add_argument("--batch", action="store_true", help="never prompt for input, implied when updating several mods")
+    batch.add_argument("--batch-workers", type=int, default=4, metavar="N", help="number of mods updated at the same time (default: %(default)s)")
+    batch.add_argument("--summary", type=Path, default=None, metavar="PATH", help="write the results of every mod to a JSON file")
+    watch = parser.add_argument_group("watch mode")
+    watch.add_argument("--watch", action="store_true", help="keep running, download and parse every new deployment as soon as it appears in DeployHistory")
+    watch.add_argument("--watch-interval", type=float, default=300, metavar="SECONDS", help="how often DeployHistory is checked (default: %(default)s)")
+    watch.add_argument("--auto-update", action="store_true", help="update the configured mods to every new file version")
+    metrics = parser.add_argument_group("metrics")
+    metrics.add_argument("--report", type=Path, default=None, metavar="PATH", help="write the time spent in every phase and counters of the run to a JSON file")
+    metrics.add_argument("--trace-memory", action="store_true", help="record the peak of Python allocations of every phase with tracemalloc (slower)")
+    metrics.add_argument("--profile", choices=PHASES, default=None, metavar="PHASE", help=f"profile a phase with cProfile, one of {', '.join(PHASES)}")
+    metrics.add_argument("--profile-output", type=Path, default=None, metavar="PATH", help="where the profile is written (default: <phase>.prof)")
+    return parser.parse_args()
+
+
+def get_package_cache(args: argparse.Namespace) -> PackageCache | None:
+    if args.no_cache:
+        return None
+    directory: Path = args.cache_dir.expanduser().resolve() if args.cache_dir is not None else cache_directory() / "packages"
+    return PackageCache(directory, args.cache_size * 1024 * 1024)
+
+
+def print_cache_info(cache: PackageCache) -> None:
+    entries = cache.entries()
+    print(f"Package cache: {cache.directory}")
+    print(f"{len(entries)} packages, {cache.size / (1024 * 1024):.2f} / {cache.max_size / (1024 * 1024):.2f} MB")
+    for entry in entries:
+        last_used: str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.last_used))
+        deployment = DeployHistory.find(entry.version, refresh=False)  # Offline, versions that aren't in the cached DeployHistory show no file version
+        file_version: str = f"  file version {deployment.fileVersion}" if deployment is not None else ""
+        print(f"  {entry.key}{file_version}  {entry.size / (1024 * 1024):.2f} MB  (last used: {last_used})")
+
+
+def update_single(mod_path: Path, config: Config, store: PackageStore, temp_dir: Path, executor: Executor | None, args: argparse.Namespace) -> list[UpdateResult] | None:
+    # Results for several target versions, None if the single target version was updated
+    logging.info("Loading mod info...")
+    try:
+        mod = Mod(mod_path)
+    except ModError as e:
+        fail(str(e))
+
+    if config.target_versions == [mod.fileVersion]:
+        logging.warning("Mod version and target version are the same!")
+        pause()
+        sys.exit(0)
+
+    try:
+        results: list[UpdateResult] = update_mod(mod, config.target_versions, store, temp_dir, executor, not args.no_patch, not args.no_manifest, args.output, PngEncoder(args.png, args.encode_threads))
+    except UpdateError as e:
+        fail(str(e))
+
+    if len(results) > 1:
+        return results
+    if results[0].status == "failed":
+        fail(results[0].message)
+    if results[0].status != "updated":
+        logging.warning(results[0].message)
+        pause()
+        sys.exit(1)
+    return None
+
+
+def update_batch(config: Config, store: PackageStore, temp_dir: Path, executor: Executor | None, args: argparse.Namespace) -> list[UpdateResult]:
+    # Mods are grouped by their file version so every deployment is downloaded and parsed once,
+    # then updated in parallel. A failing mod doesn't stop the others
+    results: dict[Path, list[UpdateResult]] = {}
+    mods: list[Mod] = []
+    for mod_path in config.mod_paths:
+        logging.info(f"Loading mod info: {mod_path}")
+        try:
+            mods.append(Mod(mod_path, interactive=False))
+        except ModError as e:
+            logging.error(f"{mod_path.name}: {e}")
+            results[mod_path] = [UpdateResult(mod_path, "failed", None, target_version, str(e)) for target_version in config.target_versions]
+
+    groups: dict[int, list[Mod]] = {}
+    for mod in mods:
+        groups.setdefault(mod.fileVersion, []).append(mod)
+    for fileVersion, group in sorted(groups.items()):
+        logging.info(f"File version {fileVersion}: {', '.join(mod.name for mod in group)}")
+
+    # Targets known to have the same layout as a group's version (see modules/layout_hashes.py) aren't downloaded for it
+    needed_targets: dict[int, list[int]] = {}
+    for fileVersion in groups:
+        known_hash: str | None = known_layout_hash(fileVersion)
+        needed_targets[fileVersion] = [target_version for target_version in config.target_versions if known_hash is None or known_layout_hash(target_version) != known_hash]
+    target_versions: list[int] = [target_version for target_version in config.target_versions if any(target_version in targets for targets in needed_targets.values())]
+
+    # Mods with an icon patch or an icon manifest of their version most likely don't need their version's package
+    fileVersions: list[int] = []
+    for fileVersion, group in sorted(groups.items()):
+        if fileVersion in config.target_versions or not needed_targets[fileVersion]:
             continue
-        elif pixel1[:3] != pixel2[:3]:
-            return False
-    return True
+        if not args.no_manifest and has_manifest(fileVersion):
+            continue
+        if not args.no_patch and all((mod.path / PATCH_FILE).exists() for mod in group):
+            continue
+        fileVersions.append(fileVersion)
+    if any(fileVersion not in config.target_versions for fileVersion in groups):
+        logging.info(f"Downloading LuaPackages for {len(fileVersions) + len(target_versions)} deployments...")
+        store.prefetch(fileVersions + target_versions)
+
+    def run(index: int, mod: Mod) -> list[UpdateResult]:
+        threading.current_thread().name = mod.name
+        start: float = time.perf_counter()
+        mod_temp_dir: Path = temp_dir / f"{index}-{mod.name}"
+        mod_temp_dir.mkdir()
+        try:
+            return update_mod(mod, config.target_versions, store, mod_temp_dir, executor, not args.no_patch, not args.no_manifest, args.output, PngEncoder(args.png, args.encode_threads))
+        except Exception as e:
+            message: str = str(e) if isinstance(e, UpdateError) else f"{type(e).__name__}: {e}"
+            logging.error(message)
+            return [UpdateResult(mod.path, "failed", mod.fileVersion, target_version, message, duration=time.perf_counter() - start) for target_version in config.target_versions]
+        finally:
+            shutil.rmtree(mod_temp_dir, ignore_errors=True)
+
+    with ThreadPoolExecutor(max_workers=max(args.batch_workers, 1)) as executor:
+        futures = [executor.submit(run, index, mod) for index, mod in enumerate(mods)]
+        for mod, future in zip(mods, futures):
+            results[mod.path] = future.result()
+
+    return [result for mod_path in config.mod_paths for result in results[mod_path]]
+
+
+def watch_deployments(config: Config | None, cache: PackageCache, args: argparse.Namespace) -> None:
+    # Runs until interrupted. With a config (--auto-update), its mods are updated to every new file version
+    def update(fileVersion: int) -> None:
+        config.target_versions = [fileVersion]
+        with TemporaryDirectory(prefix="sober-mod-updater-") as tmp:
+            executor: Executor | None = create_pool(args.jobs)
+            try:
+                results: list[UpdateResult] = update_batch(config, store, Path(tmp).resolve(), executor, args)
+            finally:
+                if executor is not None:
+                    executor.shutdown(cancel_futures=True)
+        print_summary(results)
+        if args.summary is not None:
+            write_summary(args.summary, results)
+
+    with PackageStore(cache, cache.directory / "download") as store:
+        try:
+            Watcher(store, args.watch_interval).run(update if config is not None else None)
+        except KeyboardInterrupt:
+            logging.info("Stopped watching")
+
+
+def build_manifests(fileVersions: list[int], store: PackageStore, executor: Executor | None) -> None:
+    # Versions that aren't in the DeployHistory are skipped, so ranges can have gaps
+    failed: bool = False
+    for fileVersion in fileVersions:
+        if load_manifest(fileVersion) is not None:
+            logging.info(f"Icon manifest of version {fileVersion} already exists")
+            continue
+        try:
+            manifest: IconManifest = store.get(fileVersion).manifest(executor)
+        except DeployHistoryError as e:
+            logging.warning(f"Skipping version {fileVersion}: {e}")
+            continue
+        except (DownloadError, UpdateError) as e:
+            logging.error(f"Failed to build icon manifest of version {fileVersion}: {e}")
+            failed = True
+            continue
+        finally:
+            store.release(fileVersion)
+        save_manifest(manifest)
+        logging.info(f"Icon manifest of version {fileVersion}: {sum(len(hashes) for hashes in manifest.hashes.values())} icons")
+    if failed:
+        pause()
+        sys.exit(1)
+
+
+def restore_backups(mod_paths: list[Path]) -> None:
+    failed: bool = False
+    for mod_path in mod_paths:
+        logging.info(f"Restoring backup: {backup_path(mod_path)}")
+        try:
+            stats: BackupStats = Backup(mod_path).restore()
+        except BackupError as e:
+            logging.error(str(e))
+            failed = True
+            continue
+        logging.info(f"Backup restored! ({stats})")
+    if failed:
+        pause()
+        sys.exit(1)
+
+
+def print_summary(results: list[UpdateResult]) -> None:
+    print()
+    print(f"{'Mod':<32} {'Status':<10} {'Version':<12} {'Icons':>6} {'Time':>9}  Message")
+    for result in results:
+        version: str = f"{result.source_version if result.source_version is not None else '?'} -> {result.target_version}"
+        print(f"{result.mod.name:<32} {result.status:<10} {version:<12} {result.modded_icons:>6} {result.duration:>8.2f}s  {result.message}")
+    counts: dict[str, int] = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+
+
+def write_summary(path: Path, results: list[UpdateResult]) -> None:
+    data: list[dict] = []
+    for result in results:
+        item: dict = asdict(result)
+        item["mod"] = str(result.mod)
+        item["output"] = str(result.output) if result.output is not None else None
+        data.append(item)
+    with open(path, "w") as file:
+        json.dump(data, file, indent=4)
+
+
+def use_batch_log_format() -> None:
+    # Log lines of mods updated in parallel are interleaved, prefix them with the mod name
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter("[%(levelname)-8s] | %(threadName)-16s | %(message)s"))
+
+
+def write_metrics(args: argparse.Namespace, exit_code: int) -> None:
+    if args.report is not None:
+        METRICS.write_report(args.report, exit_code)
+        logging.info(f"Run report written to {args.report}")
+    if args.profile is not None:
+        path: Path = args.profile_output or Path(f"{args.profile}.prof")
+        if METRICS.write_profile(path):
+            logging.info(f"Profile of phase '{args.profile}' written to {path}")
+        else:
+            logging.warning(f"Phase '{args.profile}' didn't run, no profile written")
 
 
 def main() -> None:
+    args = parse_args()
+    METRICS.configure(args.trace_memory, args.profile)
+    exit_code: int = 1  # An uncaught exception
+    try:
+        run(args)
+        exit_code = 0
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+        raise
+    finally:
+        write_metrics(args, exit_code)
+
+
+def run(args: argparse.Namespace) -> None:
+    global INTERACTIVE
+    INTERACTIVE = not args.batch
+
     logging.basicConfig(
         level=logging.INFO,
         format="[%(levelname)-8s] | %(message)s"
     )
 
-    logging.info("Loading config...")
-    config = Config()
-
-    logging.info("Loading mod info...")
-    mod = Mod(config.mod_path)
+    cache: PackageCache | None = get_package_cache(args)
+    if args.cache_info or args.cache_prune:
+        if cache is None:
+            logging.error("The package cache is disabled (--no-cache)")
+            return
+        if args.cache_prune:
+            freed: int = cache.prune()
+            logging.info(f"Pruned package cache: {freed / (1024 * 1024):.2f} MB freed")
+        print_cache_info(cache)
+        return
+
+    if args.build_manifests is not None:
+        with TemporaryDirectory(prefix="sober-mod-updater-") as tmp:
+            executor: Executor | None = create_pool(args.jobs)
+            try:
+                with PackageStore(cache, Path(tmp) / "download", args.partial) as store:
+                    build_manifests(args.build_manifests, store, executor)
+            finally:
+                if executor is not None:
+                    executor.shutdown(cancel_futures=True)
+        return
+
+    if args.watch:
+        if cache is None:
+            fail("Watch mode needs the package cache (--no-cache)")
+        INTERACTIVE = False
+        watch_config: Config | None = None
+        if args.auto_update:
+            logging.info("Loading config...")
+            with phase("config"):
+                watch_config = Config(args)
+            use_batch_log_format()
+        try:
+            watch_deployments(watch_config, cache, args)
+        except DeployHistoryError as e:
+            fail(str(e))
+        return
 
-    if mod.fileVersion == config.target_version:
-        logging.warning("Mod version and target version are the same!")
-        input("Press ENTER to exit...")
-        sys.exit(0)
+    logging.info("Loading config...")
+    with phase("config"):
+        config = Config(args)
+    if args.restore:
+        restore_backups(config.mod_paths)
+        return
+    if config.batch:
+        INTERACTIVE = False
+        use_batch_log_format()
 
     with TemporaryDirectory(prefix="sober-mod-updater-") as tmp:
         temp_dir = Path(tmp).resolve()
         logging.info(f"Temporary directory: {temp_dir}")
-        mod_imagesets = mod.luapackages / mod.image_set_directory
-        mod_imagesets_copy = temp_dir / "mod_imagesets"
-        logging.info("Copying mod imageSets...")
-        shutil.copytree(mod_imagesets, mod_imagesets_copy)
-
-        # Getting deployment info
-        mod_deployment: Deployment = DeployHistory.search(mod.fileVersion)
-        target_deployment: Deployment = DeployHistory.search(config.target_version)
-
-        logging.info("Downloading LuaPackages...")
-        package: str = "extracontent-luapackages.zip"
-        download_dir: Path = temp_dir / "download"
-        mod_deployment.download_package(package, download_dir / "mod_luapackages.zip")
-        target_deployment.download_package(package, download_dir / "target_luapackages.zip")
-
-        mod_luapackages: Path = temp_dir / "mod_luapackages"
-        target_luapackages: Path = temp_dir / "target_luapackages"
-
-        logging.info("Extracting LuaPackages...")
-        zip_extractor.extract(download_dir / "mod_luapackages.zip", mod_luapackages)
-        zip_extractor.extract(download_dir / "target_luapackages.zip", target_luapackages)
-
-        pattern = re.compile(r"^img_set_[1-3]x_\d+\.png$")
-        for (root, dirs, files) in os.walk(target_luapackages):
-            if any(pattern.match(file) for file in files):
-                target_image_set_directory = Path(root).relative_to(target_luapackages)
-                break
-        else:
-            logging.error(f"Unable to update mod: imageSets not found in target version ({config.target_version})")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-
-        logging.info("Checking for GetImageSetData.lua")
-        mod_imagesetdata_file: Path = (mod_luapackages / mod.image_set_directory).parent / "Generated" / "GetImageSetData.lua"
-        target_imagesetdata_file: Path = (target_luapackages / target_image_set_directory).parent / "Generated" / "GetImageSetData.lua"
-
-        if not mod_imagesetdata_file.exists():
-            logging.error(f"Unable to update mod: GetImageSetData.lua not found in mod version ({mod.fileVersion})")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-        if not target_imagesetdata_file.exists():
-            logging.error(f"Unable to update mod: GetImageSetData.lua not found in target version ({config.target_version})")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-        
-        logging.info("Comparing file hashes...")
-        if sha256sum(mod_imagesetdata_file) == sha256sum(target_imagesetdata_file):
-            logging.warning(f"Unable to update mod: Mod is not outdated!")
-            mod.update_info(config.target_version)
-            input("Press ENTER to exit...")
-            sys.exit(1)
-
-        logging.info("Parsing data...")
-        mod_imagesetdata: list[ImageSet] = get_imagesetdata(mod_imagesetdata_file, mod_luapackages / mod.image_set_directory)
-        target_imagesetdata: list[ImageSet] = get_imagesetdata(target_imagesetdata_file, target_luapackages / target_image_set_directory)
-
-        logging.info("Detecting modded icons...")
-        modded_icon_count: int = 0
-        modded_icon_data: dict[str, dict[str, tuple[tuple[int, int, int, int], Image.Image]]] = {}
-        for imageset in mod_imagesetdata:
-            mod_imageset_path: Path = mod_imagesets_copy / f"{imageset.name}.png"
-            if not mod_imageset_path.exists():
-                logging.info(f"Skipping '{imageset.name}': File not found!")
-                continue
-
-            with Image.open(imageset.path) as original_image:
-                if original_image.mode != "RGBA":
-                    original_image = original_image.convert("RGBA")
-
-                with Image.open(mod_imageset_path) as mod_image:
-                    if mod_image.mode != "RGBA":
-                        mod_image = mod_image.convert("RGBA")
-
-                    for icon in imageset.icons:
-                        original_icon: Image.Image = original_image.crop(icon.box)
-                        mod_icon: Image.Image = mod_image.crop(icon.box)
-                        if compare_images(mod_icon, original_icon):
-                            continue  # Image is not modded
-
-                        if imageset.size not in modded_icon_data:
-                            modded_icon_data[imageset.size] = {}
-                        modded_icon_data[imageset.size][icon.name] = (icon.box, mod_icon)
-                        modded_icon_count += 1
-
-        if modded_icon_count == 0:
-            logging.warning(f"Unable to update mod: No modded icons detected!")
-            mod.update_info(config.target_version)
-            input("Press ENTER to exit...")
-            sys.exit(1)
-
-        logging.info(f"{modded_icon_count} modded icons detected")
-
-        logging.info("Detecting new icon positions...")
-        updated_icon_data: dict[str, list[tuple[tuple[int, int, int, int], Image.Image]]] = {}
-        for imageset in target_imagesetdata:
-            modded_icons: dict[str, tuple] | None = modded_icon_data.get(imageset.size)
-            if modded_icons is None:
-                continue
-            for icon in imageset.icons:
-                modded_icon: tuple | None = modded_icons.get(icon.name)
-                if modded_icon is None:
-                    continue
-                if imageset.name not in updated_icon_data:
-                    updated_icon_data[imageset.name] = []
-                updated_icon_data[imageset.name].append((icon.box, modded_icon[1]))
-        
-        if not updated_icon_data:
-            logging.error("Failed to update mod: modded icons not found in new imageSets!")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-
-        logging.info("Updating new imageSets...")
-        removed_imageset_count: int = 0
-        for imageset in target_imagesetdata:
-            modded_icons: list[tuple[tuple[int, int, int, int], Image.Image]] | None = updated_icon_data.get(imageset.name)
-            if modded_icons is None:  # Remove unmodded imageSets
-                # logging.warning(f"Removing unmodded imageSet: '{imageset.name}'")
-                removed_imageset_count += 1
-                imageset.path.unlink()
-                continue
-
-            with Image.open(imageset.path) as new_image:
-                if new_image.mode != "RGBA":
-                    new_image = new_image.convert("RGBA")
-
-                for box, icon in modded_icons:
-                    new_image.paste(icon, box)
-                
-                new_image.save(imageset.path, format="PNG")
-        
-        logging.info("Done!")
-        logging.warning(f"Removed {removed_imageset_count} unmodded imageSets")
-
-        mod.backup()
-        mod.update(target_luapackages / target_image_set_directory, target_image_set_directory, config.target_version)
+
+        if args.refresh_history:
+            try:
+                DeployHistory.refresh()
+            except DeployHistoryError as e:
+                fail(str(e))
+
+        # The pool is shared by all mods of a batch
+        executor = create_pool(args.jobs)
+        try:
+            with PackageStore(cache, temp_dir / "download", args.partial) as store:
+                if not config.batch:
+                    results: list[UpdateResult] | None = update_single(config.mod_paths[0], config, store, temp_dir, executor, args)
+                    if results is None:
+                        return
+                else:
+                    results = update_batch(config, store, temp_dir, executor, args)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+    print_summary(results)
+    if args.summary is not None:
+        write_summary(args.summary, results)
+        logging.info(f"Summary written to {args.summary}")
+    if any(result.status == "failed" for result in results):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -261,7 +482,7 @@ if __name__ == "__main__":
         print()
         print("[FATAL] Uncaught Exception!")
         print(type(e), e)
-        input("Press ENTER to exit...")
+        pause()
         sys.exit(1)
     else:
-        input("Press ENTER to exit...")
\ No newline at end of file
+        pause()
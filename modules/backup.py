@@ -0,0 +1,255 @@
+from dataclasses import asdict, dataclass
+import errno
+import json
+import logging
+import os
+from pathlib import Path, PurePosixPath
+import shutil
+from typing import Iterable
+import uuid
+
+try:
+    import fcntl
+except (ImportError, ModuleNotFoundError):  # Windows
+    fcntl = None
+
+from modules.hashing import sha256sum
+
+
+FICLONE: int = 0x40049409  # linux/fs.h, _IOW(0x94, 9, int)
+
+
+class BackupError(Exception):
+    pass
+
+
+@dataclass
+class ManifestEntry:
+    size: int
+    mtime_ns: int
+    sha256: str
+    method: str  # "linked", "cloned" or "copied"
+
+
+@dataclass
+class BackupStats:
+    linked: int = 0
+    cloned: int = 0
+    copied: int = 0
+    kept: int = 0
+    removed: int = 0
+    transferred: int = 0  # bytes that were actually copied
+
+    def __str__(self) -> str:
+        return f"{self.kept} kept, {self.linked} linked, {self.cloned} cloned, {self.copied} copied ({self.transferred / (1024 * 1024):.2f} MB), {self.removed} removed"
+
+
+def backup_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.mod-updater-backup")
+
+
+class Backup:
+    # Snapshot of a directory that is updated incrementally. The manifest records the size, mtime and sha256 of
+    # every file, so unchanged files are neither copied nor hashed again and restores can be verified.
+    # Files the update replaces are reflinked (copy-on-write) or copied, all other files are hardlinked,
+    # which only works as long as those files are replaced and never modified in place
+    MANIFEST: str = ".mod-updater-manifest.json"
+
+    source: Path
+    path: Path
+
+    def __init__(self, source: Path, path: Path | None = None) -> None:
+        self.source = source
+        self.path = path or backup_path(source)
+
+    def exists(self) -> bool:
+        return self.path.is_dir()
+
+    def create(self, touched: Iterable[Path] = ()) -> BackupStats:
+        # touched: files or directories (relative to source) that will be replaced, everything else is hardlinked
+        touched_paths: list[PurePosixPath] = [PurePosixPath(Path(path).as_posix()) for path in touched]
+        manifest: dict[str, ManifestEntry] | None = self._load_manifest()
+        if manifest is None and self.path.exists():
+            logging.warning("Removing existing backup without manifest...")
+            shutil.rmtree(self.path)
+        manifest = manifest or {}
+
+        # An interrupted backup leaves no manifest behind and is started over by the next run
+        (self.path / self.MANIFEST).unlink(missing_ok=True)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        stats = BackupStats()
+        files: dict[str, ManifestEntry] = {}
+        for name in _walk(self.source):
+            source: Path = self.source / name
+            target: Path = self.path / name
+            stat: os.stat_result = source.stat()
+            entry: ManifestEntry | None = manifest.get(name)
+            if entry is not None and self._is_current(entry, stat, source, target):
+                files[name] = entry
+                stats.kept += 1
+                continue
+
+            target.unlink(missing_ok=True)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if any(PurePosixPath(name).is_relative_to(path) for path in touched_paths):
+                method: str = clone_file(source, target)
+            else:
+                method = link_file(source, target)
+            setattr(stats, method, getattr(stats, method) + 1)
+            if method == "copied":
+                stats.transferred += stat.st_size
+            files[name] = ManifestEntry(stat.st_size, stat.st_mtime_ns, sha256sum(source), method)
+
+        for name in manifest.keys() - files.keys():
+            (self.path / name).unlink(missing_ok=True)
+            stats.removed += 1
+        _remove_empty_directories(self.path)
+
+        self._save_manifest(files)
+        return stats
+
+    def restore(self) -> BackupStats:
+        # Makes source identical to the backup. Backup files are verified before anything is changed
+        if not self.exists():
+            raise BackupError(f"Failed to restore backup: No backup was made! ({self.path})")
+        manifest: dict[str, ManifestEntry] | None = self._load_manifest()
+        if manifest is None:
+            logging.warning("Backup has no manifest, hashing backup files...")
+            manifest = self._scan()
+
+        stats = BackupStats()
+        restore: list[str] = []
+        for name, entry in manifest.items():
+            target: Path = self.source / name
+            if target.is_file():
+                stat: os.stat_result = target.stat()
+                if stat.st_size == entry.size and (stat.st_mtime_ns == entry.mtime_ns or sha256sum(target) == entry.sha256):
+                    stats.kept += 1
+                    continue
+            backup_file: Path = self.path / name
+            if not backup_file.is_file():
+                raise BackupError(f"Failed to restore backup: '{name}' is missing in {self.path}")
+            if backup_file.stat().st_size != entry.size or sha256sum(backup_file) != entry.sha256:
+                if entry.method != "linked":
+                    raise BackupError(f"Failed to restore backup: '{name}' is corrupted in {self.path}")
+                # A hardlinked file that was edited in place changed in the backup as well, the original is gone.
+                # The edited file is kept (or restored, if it was removed since) instead of failing the whole restore
+                logging.warning(f"'{name}' was edited in place since the backup was made, it can't be restored")
+                if target.is_file():
+                    stats.kept += 1
+                    continue
+            restore.append(name)
+
+        for name in restore:
+            target = self.source / name
+            if target.is_dir():
+                shutil.rmtree(target)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            temporary: Path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                method: str = clone_file(self.path / name, temporary)
+                os.replace(temporary, target)  # Atomic, the file is either the old or the restored one
+            finally:
+                temporary.unlink(missing_ok=True)
+            setattr(stats, method, getattr(stats, method) + 1)
+            if method == "copied":
+                stats.transferred += manifest[name].size
+
+        if self.source.exists():
+            for name in _walk(self.source):
+                if name not in manifest:
+                    (self.source / name).unlink()
+                    stats.removed += 1
+            _remove_empty_directories(self.source)
+        return stats
+
+    def _is_current(self, entry: ManifestEntry, stat: os.stat_result, source: Path, target: Path) -> bool:
+        try:
+            target_stat: os.stat_result = target.stat()
+        except FileNotFoundError:
+            return False
+        if target_stat.st_size != entry.size or stat.st_size != entry.size:
+            return False
+        if stat.st_mtime_ns == entry.mtime_ns:
+            return True
+        # Touched without changing its content
+        sha256: str = sha256sum(source)
+        if sha256 != entry.sha256:
+            return False
+        entry.mtime_ns = stat.st_mtime_ns
+        return True
+
+    def _scan(self) -> dict[str, ManifestEntry]:
+        manifest: dict[str, ManifestEntry] = {}
+        for name in _walk(self.path):
+            if name == self.MANIFEST:
+                continue
+            stat: os.stat_result = (self.path / name).stat()
+            manifest[name] = ManifestEntry(stat.st_size, stat.st_mtime_ns, sha256sum(self.path / name), "copied")
+        return manifest
+
+    def _load_manifest(self) -> dict[str, ManifestEntry] | None:
+        path: Path = self.path / self.MANIFEST
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r") as file:
+                data: dict[str, dict] = json.load(file)
+            return {name: ManifestEntry(**item) for name, item in data["files"].items()}
+        except (ValueError, TypeError, KeyError) as e:
+            logging.warning(f"Failed to load backup manifest: {e}")
+            return None
+
+    def _save_manifest(self, files: dict[str, ManifestEntry]) -> None:
+        path: Path = self.path / self.MANIFEST
+        temporary: Path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        with open(temporary, "w") as file:
+            json.dump({"files": {name: asdict(entry) for name, entry in sorted(files.items())}}, file, indent=4)
+        os.replace(temporary, path)
+
+
+def clone_file(source: Path, target: Path) -> str:
+    # Reflink (copy-on-write, e.g. Btrfs and XFS) when possible, a regular copy otherwise
+    if fcntl is None:
+        shutil.copy2(source, target)
+        return "copied"
+    try:
+        with open(source, "rb") as source_file, open(target, "wb") as target_file:
+            fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+        method: str = "cloned"
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EPERM, errno.EBADF):
+            raise
+        shutil.copyfile(source, target)
+        method = "copied"
+    shutil.copystat(source, target)
+    return method
+
+
+def link_file(source: Path, target: Path) -> str:
+    try:
+        os.link(source, target)
+        return "linked"
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP):
+            raise
+        return clone_file(source, target)
+
+
+def _walk(directory: Path) -> list[str]:
+    # Relative paths of all files in directory, always with '/' as separator
+    files: list[str] = []
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        relative = PurePosixPath(Path(root).relative_to(directory).as_posix())
+        for name in sorted(names):
+            if name != Backup.MANIFEST or root != str(directory):
+                files.append((relative / name).as_posix())
+    return files
+
+
+def _remove_empty_directories(directory: Path) -> None:
+    for root, dirs, names in os.walk(directory, topdown=False):
+        if root != str(directory) and not os.listdir(root):
+            os.rmdir(root)
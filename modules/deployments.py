@@ -1,10 +1,21 @@
+import json
 import logging
+import os
 from pathlib import Path
+import threading
 import time
-import urllib.request
-from urllib.error import HTTPError, URLError, ContentTooShortError
+from typing import TYPE_CHECKING
 
-import requests
+from modules.downloader import DownloadResult, download
+from modules.metrics import count, phase
+from modules.paths import cache_directory
+
+if TYPE_CHECKING:
+    import requests
+
+
+# Can be pointed at a local stand-in server for testing
+CDN: str = os.environ.get("SOBER_MOD_UPDATER_CDN", "https://setup.rbxcdn.com").rstrip("/")
 
 
 class Deployment:
@@ -15,93 +26,186 @@ class Deployment:
         self.version = version
         self.fileVersion = fileVersion
 
-    def download_package(self, package: str, target: Path) -> None:
-        download_url: str = f"https://setup.rbxcdn.com/{self.version}-{package}"
-        target.parent.mkdir(parents=True, exist_ok=True)
+    def package_url(self, package: str) -> str:
+        return f"{CDN}/{self.version}-{package}"
+
+    def download_package(self, package: str, target: Path, session: "requests.Session | None" = None) -> DownloadResult:
+        return download(self.package_url(package), target, session)
 
-        try:
-            start: float = time.time()
-            urllib.request.urlretrieve(download_url, target)
-            end: float = time.time()
-            duration: float = (end - start) * 1000
-            logging.info(f"DOWNLOAD {download_url} -> SUCCESS (duration: {duration:.2f}ms)")
-            return
 
-        except HTTPError as e:
-            logging.error(f"DOWNLOAD {download_url} -> {e.code} {e.reason or 'Reason unknown'}")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-        except URLError as e:
-            logging.error(f"DOWNLOAD {download_url} -> {e.reason}")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-        except Exception as e:
-            logging.error(f"DOWNLOAD {download_url} -> {type(e).__name__}: {e}")
-            input("Press ENTER to exit...")
-            sys.exit(1)
+class DeployHistoryError(Exception):
+    pass
 
 
 class DeployHistory:
-    API: str = "https://setup.rbxcdn.com/DeployHistory.txt"
+    API: str = f"{CDN}/DeployHistory.txt"
+    CACHE: Path | None = cache_directory() / "DeployHistory.json"
+
+    # Parsed Studio64 deployments, the latest deployment of a file version wins
+    _deployments: dict[int, str] | None = None  # fileVersion -> version hash
+    _fileVersions: dict[str, int] = {}  # version hash -> fileVersion
+    _etag: str | None = None
+    _last_modified: str | None = None
+    _length: int = 0  # Bytes of DeployHistory.txt that have been parsed, always ends on a line break
+    _refreshed: bool = False
+    _lock: threading.RLock = threading.RLock()
 
-    _history: list[Deployment] | None = None
     @classmethod
     def history(cls) -> list[Deployment]:
-        if cls._history is not None:
-            return cls._history
-        cls._set_deploy_history()
-        return cls._history
+        deployments: dict[int, str] = cls._get_deployments()
+        return [Deployment(deployments[fileVersion], fileVersion) for fileVersion in sorted(deployments, reverse=True)]
+
+    @classmethod
+    def search(cls, fileVersion: int) -> Deployment:
+        logging.info(f"Searching DeployHistory (Target version: {fileVersion})")
+        version: str | None = cls._get_deployments().get(fileVersion)
+        if version is None and not cls._refreshed:
+            cls.refresh()
+            version = cls._get_deployments().get(fileVersion)
+
+        if version is None:
+            raise DeployHistoryError(f"Deployment not found! (Target version: {fileVersion})")
+        return Deployment(version, fileVersion)
 
     @classmethod
-    def _set_deploy_history(cls) -> None:
-        logging.info("Loading DeployHistory...")
-        url: str = cls.API
-        history: list[DeployHistory] = []
+    def lookup(cls, fileVersion: int) -> Deployment | None:
+        # Like search, but never goes online: None if the file version isn't in the cached DeployHistory
+        version: str | None = cls._get_deployments(refresh=False).get(fileVersion)
+        return None if version is None else Deployment(version, fileVersion)
 
-        try:
-            start: float = time.time()
-            response = requests.get(url, timeout=(10, 15))
-            response.raise_for_status()
-            end: float = time.time()
-            duration: float = (end - start) * 1000
-            logging.info(f"GET {url} -> {response.status_code} {response.reason or 'Reason unknown'} (duration: {duration:.2f}ms)")
-
-        except requests.HTTPError as e:
-            response = e.response
-            logging.error("Failed to load DeployHistory: Request failed.)")
-            logging.error(f"GET {url} -> {response.status_code} {response.reason or 'Reason unknown'}")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-
-        except Exception:
-            logging.error("Failed to load DeployHistory: Request failed.)")
-            logging.error(f"GET {url} -> {type(e).__name__}: {e}")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-
-        data = response.text
+    @classmethod
+    def find(cls, version: str, refresh: bool = True) -> Deployment | None:
+        # The deployment of a version hash, also for deployments that were superseded by a later one of the same file version.
+        # Without refresh, only the cached DeployHistory is searched
+        cls._get_deployments(refresh=refresh)
+        fileVersion: int | None = cls._fileVersions.get(version)
+        if fileVersion is None and refresh and not cls._refreshed:
+            cls.refresh()
+            fileVersion = cls._fileVersions.get(version)
+        return None if fileVersion is None else Deployment(version, fileVersion)
+
+    @classmethod
+    def refresh(cls) -> int:
+        # Only fetches what was appended since the last refresh, returns the number of new deployments
+        import requests
+
+        with cls._lock, phase("history"):
+            cls._get_deployments(refresh=False)
+            logging.info("Refreshing DeployHistory...")
+            url: str = cls.API
+            headers: dict[str, str] = {}
+            if cls._etag:
+                headers["If-None-Match"] = cls._etag
+            elif cls._last_modified:
+                headers["If-Modified-Since"] = cls._last_modified
+            if cls._length:  # Starts one byte early to check that the file was appended to, not rewritten
+                headers["Range"] = f"bytes={cls._length - 1}-"
+
+            try:
+                start: float = time.perf_counter()
+                response = requests.get(url, headers=headers, timeout=(10, 15))
+                count("bytes_downloaded", len(response.content))
+                if response.status_code == 416 or (response.status_code == 206 and not response.content.startswith(b"\n")):
+                    logging.info(f"GET {url} -> {response.status_code} {response.reason or 'Reason unknown'} (DeployHistory was rewritten)")
+                    response = requests.get(url, timeout=(10, 15))
+                    count("bytes_downloaded", len(response.content))
+                response.raise_for_status()
+                duration: float = (time.perf_counter() - start) * 1000
+                logging.info(f"GET {url} -> {response.status_code} {response.reason or 'Reason unknown'} ({len(response.content) / 1024:.2f} KB, duration: {duration:.2f}ms)")
+
+            except requests.RequestException as e:
+                if isinstance(e, requests.HTTPError):
+                    reason: str = f"GET {url} -> {e.response.status_code} {e.response.reason or 'Reason unknown'}"
+                else:
+                    reason = f"GET {url} -> {type(e).__name__}: {e}"
+                if not cls._length:
+                    raise DeployHistoryError(f"Failed to load DeployHistory: {reason}")
+                logging.warning(f"Failed to refresh DeployHistory, using cached DeployHistory: {reason}")
+                cls._refreshed = True
+                return 0
+
+            cls._refreshed = True
+            if response.status_code == 304:
+                return 0
+
+            data: bytes = response.content
+            if response.status_code == 206:
+                data = data[1:]
+            else:
+                cls._deployments = {}
+                cls._fileVersions = {}
+                cls._length = 0
+
+            consumed: int = data.rfind(b"\n") + 1  # An incomplete last line is parsed by the next refresh
+            new: int = cls._parse(data[:consumed].decode("utf-8", errors="replace"))
+            cls._length += consumed
+            cls._etag = response.headers.get("ETag")
+            cls._last_modified = response.headers.get("Last-Modified")
+            cls._save()
+            logging.info(f"DeployHistory: {new} new deployments ({len(cls._deployments)} file versions)")
+            return new
+
+    @classmethod
+    def _parse(cls, data: str) -> int:
+        entry_count: int = 0
         for line in data.splitlines():
+            if " Studio64 " not in line:
+                continue
             try:
                 split: list[str] = line.split()
                 if split[1] != "Studio64" or split[7] != "file" or split[8] != "version:":
                     continue
                 version = split[2]
                 fileVersion = int(split[10].removesuffix(","))
-                deployment: Deployment = Deployment(version, fileVersion)
-                history.append(deployment)
             except Exception:
                 continue
-        history.reverse()
-        cls._history = history
+            cls._deployments[fileVersion] = version
+            cls._fileVersions[version] = fileVersion
+            entry_count += 1
+        return entry_count
 
     @classmethod
-    def search(cls, fileVersion: int) -> Deployment:
-        history = cls.history()
-        logging.info(f"Searching DeployHistory (Target version: {fileVersion})")
-        for deployment in history:
-            if deployment.fileVersion == fileVersion:
-                return deployment
-        else:
-            logging.error(f"Deployment not found! (Target version: {fileVersion})")
-            input("Press ENTER to exit...")
-            sys.exit(1)
\ No newline at end of file
+    def _get_deployments(cls, refresh: bool = True) -> dict[int, str]:
+        with cls._lock:
+            if cls._deployments is None:
+                cls._deployments = {}
+                cls._fileVersions = {}
+                if not cls._load() and refresh:
+                    cls.refresh()
+            return cls._deployments
+
+    @classmethod
+    def _load(cls) -> bool:
+        if cls.CACHE is None or not cls.CACHE.exists():
+            return False
+        try:
+            with open(cls.CACHE, "r") as file:
+                data: dict = json.load(file)
+            deployments: dict[int, str] = {int(fileVersion): version for fileVersion, version in data["deployments"]}
+            length: int = int(data["length"])
+        except (ValueError, TypeError, KeyError) as e:
+            logging.warning(f"Failed to load cached DeployHistory: {e}")
+            return False
+
+        cls._deployments = deployments
+        cls._fileVersions = {version: fileVersion for fileVersion, version in deployments.items()}
+        cls._etag = data.get("etag")
+        cls._last_modified = data.get("last_modified")
+        cls._length = length
+        logging.info(f"Loaded cached DeployHistory ({len(deployments)} file versions)")
+        return True
+
+    @classmethod
+    def _save(cls) -> None:
+        if cls.CACHE is None:
+            return
+        cls.CACHE.parent.mkdir(parents=True, exist_ok=True)
+        temporary: Path = cls.CACHE.with_name(f".{cls.CACHE.name}.{os.getpid()}.tmp")
+        with open(temporary, "w") as file:
+            json.dump({
+                "etag": cls._etag,
+                "last_modified": cls._last_modified,
+                "length": cls._length,
+                "deployments": list(cls._deployments.items())
+            }, file, separators=(",", ":"))
+        os.replace(temporary, cls.CACHE)
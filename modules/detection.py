@@ -0,0 +1,283 @@
+from concurrent.futures import Executor
+from contextlib import ExitStack
+from dataclasses import dataclass
+import hashlib
+import importlib.util
+from io import BytesIO
+import logging
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, TYPE_CHECKING
+import zlib
+
+from modules.imagesets import Icon, ImageSet
+from modules.metrics import count
+from modules.parallel import map_ordered
+from modules.zip_fs import ZipPath
+
+# Pillow and NumPy are slow to import, they are imported by the functions that use them
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+Box = tuple[int, int, int, int]
+HASH_SIZE: int = 16
+
+
+@dataclass(frozen=True, slots=True)
+class IconSource:
+    # The zlib compressed RGBA pixels of a modded icon, in memory or at offset in a file (an icon patch, or the
+    # icons detected during an update). Pixels are only loaded while the imageSet they are painted onto is written
+    box: Box
+    data: bytes | None = None
+    path: Path | None = None
+    offset: int = 0
+    length: int = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.data) if self.data is not None else self.length
+
+    def image(self) -> "Image.Image":
+        return next(load_icons([self]))
+
+
+# Size class -> icon name -> (box of the icon, where its modded pixels are)
+ModdedIconData = dict[str, dict[str, tuple[Box, IconSource]]]
+
+
+def numpy_available() -> bool:
+    # Without importing it
+    return importlib.util.find_spec("numpy") is not None
+
+
+def compare_images(image1: "Image.Image", image2: "Image.Image") -> bool:
+    if image1.size != image2.size:
+        return False
+
+    image1_data = image1.getdata()
+    image2_data = image2.getdata()
+
+    for pixel1, pixel2 in zip(image1_data, image2_data):
+        a1, a2 = pixel1[3], pixel2[3]
+        if a1 != a2:
+            return False
+        elif a1 == 0:
+            continue
+        elif pixel1[:3] != pixel2[:3]:
+            return False
+    return True
+
+
+def detect_modded_icons(imagesetdata: list[ImageSet], mod_imageset_directory: Path, use_numpy: bool | None = None, executor: Executor | None = None, icon_file: Path | None = None) -> ModdedIconData:
+    # With NumPy, all icons of an imageSet are checked at once using a summed-area table
+    # of the per-pixel difference mask. use_numpy=False forces the pure-Python fallback.
+    # Every imageSet is a separate work unit that runs on executor if one is given.
+    # The modded icons are compressed and written to icon_file, or kept in memory without one
+    if use_numpy is None:
+        use_numpy = numpy_available()
+    elif use_numpy and not numpy_available():
+        raise ModuleNotFoundError("No module named 'numpy'")
+
+    imagesets: list[tuple[ImageSet, Path]] = []
+    for imageset in imagesetdata:
+        mod_imageset_path: Path = mod_imageset_directory / f"{imageset.name}.png"
+        if not mod_imageset_path.exists():
+            logging.info(f"Skipping '{imageset.name}': File not found!")
+            continue
+        imagesets.append((imageset, mod_imageset_path))
+
+    def work_units() -> Iterator[tuple]:
+        for imageset, mod_imageset_path in imagesets:
+            # Archive members can't be sent to another process, their (compressed) bytes can
+            original: Path | bytes | ZipPath = imageset.path
+            if executor is not None and not isinstance(original, Path):
+                original = original.read_bytes()
+            yield (original, mod_imageset_path, imageset.icons, use_numpy)
+
+    _count_compared(imageset for imageset, _ in imagesets)
+    results: Iterator[list[tuple[str, Box, bytes]]] = map_ordered(detect_imageset, work_units(), executor)
+    return _store_icons(zip((imageset for imageset, _ in imagesets), results), icon_file)
+
+
+def detect_imageset(original: "Path | bytes | ZipPath", mod_imageset_path: Path, icons: list[Icon], use_numpy: bool) -> list[tuple[str, Box, bytes]]:
+    # Modded icons of a single imageSet as (icon name, box, compressed icon)
+    from PIL import Image
+
+    with open_image(original) as original_image, Image.open(mod_imageset_path) as mod_image:
+        if original_image.mode != "RGBA":
+            original_image = original_image.convert("RGBA")
+        if mod_image.mode != "RGBA":
+            mod_image = mod_image.convert("RGBA")
+
+        if use_numpy:
+            modded_icons: list[Icon] = _find_modded_icons_numpy(original_image, mod_image, icons)
+        else:
+            modded_icons = _find_modded_icons_python(original_image, mod_image, icons)
+
+        return [(icon.name, icon.box, compress_icon(mod_image, icon.box)) for icon in modded_icons]
+
+
+def detect_modded_icons_by_hash(imagesets: list[tuple[ImageSet, list[bytes]]], mod_imageset_directory: Path, executor: Executor | None = None, icon_file: Path | None = None) -> ModdedIconData:
+    # Like detect_modded_icons, but compares the mod's icons to hashes of the original icons (see icon_hashes)
+    # instead of the original imageSets, so the original package isn't needed
+    units: list[tuple[ImageSet, Path, list[bytes]]] = []
+    for imageset, hashes in imagesets:
+        mod_imageset_path: Path = mod_imageset_directory / f"{imageset.name}.png"
+        if not mod_imageset_path.exists():
+            logging.info(f"Skipping '{imageset.name}': File not found!")
+            continue
+        units.append((imageset, mod_imageset_path, hashes))
+
+    _count_compared(imageset for imageset, _, _ in units)
+    work_units = ((mod_imageset_path, imageset.icons, hashes) for imageset, mod_imageset_path, hashes in units)
+    results: Iterator[list[tuple[str, Box, bytes]]] = map_ordered(detect_imageset_by_hash, work_units, executor)
+    return _store_icons(zip((imageset for imageset, _, _ in units), results), icon_file)
+
+
+def detect_imageset_by_hash(mod_imageset_path: Path, icons: list[Icon], hashes: list[bytes]) -> list[tuple[str, Box, bytes]]:
+    from PIL import Image
+
+    with Image.open(mod_imageset_path) as mod_image:
+        if mod_image.mode != "RGBA":
+            mod_image = mod_image.convert("RGBA")
+        mod_hashes: list[bytes] = icon_hashes(mod_image, icons)
+        return [(icon.name, icon.box, compress_icon(mod_image, icon.box)) for icon, mod_hash, original_hash in zip(icons, mod_hashes, hashes) if mod_hash != original_hash]
+
+
+def hash_imageset(original: "Path | bytes | ZipPath", icons: list[Icon]) -> list[bytes]:
+    with open_image(original) as image:
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        return icon_hashes(image, icons)
+
+
+def icon_hashes(image: "Image.Image", icons: list[Icon]) -> list[bytes]:
+    # Two icons have the same hash if compare_images considers them equal: the color of
+    # fully transparent pixels doesn't matter, so it is cleared before hashing
+    from PIL import Image
+
+    alpha: Image.Image = image.getchannel("A")
+    visible: Image.Image = alpha.point(lambda value: 255 if value else 0)
+    normalized: Image.Image = Image.composite(image, Image.new("RGBA", image.size, (0, 0, 0, 0)), visible)
+    return [hashlib.blake2b(normalized.crop(icon.box).tobytes(), digest_size=HASH_SIZE).digest() for icon in icons]
+
+
+def compress_icon(image: "Image.Image", box: Box) -> bytes:
+    return zlib.compress(image.crop(box).tobytes())
+
+
+def read_icons(sources: Iterable[IconSource]) -> Iterator[bytes]:
+    # The compressed pixels of every source in order, each file is only opened once
+    with ExitStack() as stack:
+        files: dict[Path, BinaryIO] = {}
+        for source in sources:
+            if source.data is not None:
+                yield source.data
+                continue
+            file: BinaryIO | None = files.get(source.path)
+            if file is None:
+                file = stack.enter_context(open(source.path, "rb"))
+                files[source.path] = file
+            file.seek(source.offset)
+            data: bytes = file.read(source.length)
+            if len(data) != source.length:
+                raise EOFError(f"Icon data is truncated: {source.path}")
+            yield data
+
+
+def load_icons(sources: list[IconSource]) -> Iterator["Image.Image"]:
+    from PIL import Image
+
+    for source, data in zip(sources, read_icons(sources)):
+        x0, y0, x1, y1 = source.box
+        yield Image.frombytes("RGBA", (x1 - x0, y1 - y0), zlib.decompress(data))
+
+
+def _store_icons(results: Iterable[tuple[ImageSet, list[tuple[str, Box, bytes]]]], icon_file: Path | None) -> ModdedIconData:
+    # Only the location of each icon is kept in memory when there is an icon file
+    modded_icon_data: ModdedIconData = {}
+    with ExitStack() as stack:
+        file: BinaryIO | None = stack.enter_context(open(icon_file, "wb")) if icon_file is not None else None
+        for imageset, modded_icons in results:
+            for name, box, data in modded_icons:
+                if file is None:
+                    source = IconSource(box, data)
+                else:
+                    source = IconSource(box, path=icon_file, offset=file.tell(), length=len(data))
+                    file.write(data)
+                if imageset.size not in modded_icon_data:
+                    modded_icon_data[imageset.size] = {}
+                modded_icon_data[imageset.size][name] = (box, source)
+    return modded_icon_data
+
+
+def _count_compared(imagesets: Iterable[ImageSet]) -> None:
+    # Counted here rather than by the work units, which may run in other processes
+    for imageset in imagesets:
+        count("icons_compared", len(imageset.icons))
+        count("pixels_scanned", sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in (icon.box for icon in imageset.icons)))
+
+
+def open_image(source: "Path | bytes | ZipPath") -> "Image.Image":
+    from PIL import Image
+
+    if isinstance(source, bytes):
+        return Image.open(BytesIO(source))
+    if isinstance(source, Path):
+        return Image.open(source)
+    # Image.open doesn't close file objects it was given, Image.load() reads everything up front
+    with source.open("rb") as file:
+        image: Image.Image = Image.open(file)
+        image.load()
+    return image
+
+
+def _find_modded_icons_python(original_image: "Image.Image", mod_image: "Image.Image", icons: list[Icon]) -> list[Icon]:
+    modded_icons: list[Icon] = []
+    for icon in icons:
+        if not compare_images(mod_image.crop(icon.box), original_image.crop(icon.box)):
+            modded_icons.append(icon)
+    return modded_icons
+
+
+def _find_modded_icons_numpy(original_image: "Image.Image", mod_image: "Image.Image", icons: list[Icon]) -> list[Icon]:
+    import numpy as np
+
+    if not icons:
+        return []
+
+    boxes = np.array([icon.box for icon in icons], dtype=np.int64).reshape(-1, 4)
+    # Image.crop pads with transparent pixels outside of the image,
+    # so both images are padded to a common size that covers every box
+    width: int = max(original_image.width, mod_image.width, int(boxes[:, 2].max()))
+    height: int = max(original_image.height, mod_image.height, int(boxes[:, 3].max()))
+    original = _as_padded_array(original_image, width, height)
+    mod = _as_padded_array(mod_image, width, height)
+
+    alpha = original[:, :, 3]
+    differs = (alpha != mod[:, :, 3]) | ((alpha != 0) & (original[:, :, :3] != mod[:, :, :3]).any(axis=2))
+    del original, mod, alpha
+
+    summed_area = np.zeros((height + 1, width + 1), dtype=np.int64)
+    np.cumsum(differs, axis=0, out=summed_area[1:, 1:])
+    np.cumsum(summed_area[1:, 1:], axis=1, out=summed_area[1:, 1:])
+
+    # Pixels left of or above the image are equal padding on both sides
+    boxes = boxes.clip(0)
+    x0, y0, x1, y1 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    x1 = np.maximum(x0, x1)
+    y1 = np.maximum(y0, y1)
+    totals = summed_area[y1, x1] - summed_area[y0, x1] - summed_area[y1, x0] + summed_area[y0, x0]
+
+    return [icon for icon, total in zip(icons, totals.tolist()) if total > 0]
+
+
+def _as_padded_array(image: "Image.Image", width: int, height: int):
+    import numpy as np
+
+    array = np.asarray(image)
+    if array.shape[:2] == (height, width):
+        return array
+    padded = np.zeros((height, width, 4), dtype=np.uint8)
+    padded[:image.height, :image.width] = array
+    return padded
@@ -0,0 +1,179 @@
+from dataclasses import dataclass
+import logging
+import os
+from pathlib import Path
+import time
+from typing import TYPE_CHECKING
+
+from modules.metrics import count
+
+# requests is slow to import, it is only imported once something is downloaded
+if TYPE_CHECKING:
+    import requests
+
+
+CHUNK_SIZE: int = 1024 * 1024
+RETRIES: int = 5
+BACKOFF: float = 0.5
+TIMEOUT: tuple[float, float] = (10, 30)
+PROGRESS_INTERVAL: float = 5
+
+
+class DownloadError(Exception):
+    url: str
+
+    def __init__(self, url: str, message: str) -> None:
+        super().__init__(message)
+        self.url = url
+
+
+@dataclass
+class DownloadResult:
+    url: str
+    target: Path
+    size: int
+    transferred: int
+    duration: float
+
+    @property
+    def throughput(self) -> float:  # bytes per second
+        return self.transferred / self.duration if self.duration > 0 else 0.0
+
+
+def create_session(pool_size: int = 8) -> "requests.Session":
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def download(url: str, target: Path, session: "requests.Session | None" = None, retries: int = RETRIES, backoff: float = BACKOFF) -> DownloadResult:
+    # Streams into '<target>.part' and resumes it with a Range request if the connection drops
+    session = session or create_session(1)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    part: Path = target.with_name(f"{target.name}.part")
+    start: float = time.perf_counter()
+    transferred: int = 0  # Received by this call, not what an earlier run left in the '.part' file
+
+    for attempt in range(retries + 1):
+        offset: int = part.stat().st_size if part.exists() else 0
+        try:
+            transferred += _download_part(url, part, offset, session)
+        except _RetryableError as e:
+            transferred += e.transferred
+            if attempt == retries:
+                raise DownloadError(url, f"{e} (gave up after {retries + 1} attempts)")
+            delay: float = backoff * 2 ** attempt
+            logging.warning(f"DOWNLOAD {url} -> {e}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        os.replace(part, target)
+        duration: float = time.perf_counter() - start
+        size: int = target.stat().st_size
+        result = DownloadResult(url, target, size, transferred, duration)
+        logging.info(f"DOWNLOAD {url} -> SUCCESS ({result.size / (1024 * 1024):.2f} MB, duration: {duration * 1000:.2f}ms, {result.throughput / (1024 * 1024):.2f} MB/s)")
+        return result
+
+    raise DownloadError(url, "Download failed")
+
+
+class _RetryableError(Exception):
+    transferred: int  # Bytes received before the error
+
+    def __init__(self, message: str, transferred: int = 0) -> None:
+        super().__init__(message)
+        self.transferred = transferred
+
+
+def _download_part(url: str, part: Path, offset: int, session: "requests.Session") -> int:
+    # Returns the number of bytes received, which is more than the file grew by when the download started over
+    import requests
+
+    headers: dict[str, str] = {"Range": f"bytes={offset}-"} if offset else {}
+    transferred: int = 0
+    try:
+        with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code == 416 and offset:  # Nothing left to download, or the file changed
+                total: int | None = _parse_total(response.headers.get("Content-Range"))
+                if total == offset:
+                    return 0
+                part.unlink()
+                raise _RetryableError("416 Range Not Satisfiable")
+
+            if response.status_code >= 500 or response.status_code in (408, 429):
+                raise _RetryableError(f"{response.status_code} {response.reason or 'Reason unknown'}")
+            if response.status_code >= 400:
+                raise DownloadError(url, f"{response.status_code} {response.reason or 'Reason unknown'}")
+
+            if response.status_code == 206:
+                total = _parse_total(response.headers.get("Content-Range"))
+                if offset:
+                    logging.info(f"DOWNLOAD {url} -> Resuming at {offset / (1024 * 1024):.2f} MB")
+            else:  # The server ignored the Range header, start over
+                offset = 0
+                content_length: str | None = response.headers.get("Content-Length")
+                total = int(content_length) if content_length is not None else None
+
+            last_report: float = time.perf_counter()
+            with open(part, "ab" if offset else "wb") as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+                    transferred += len(chunk)
+                    now: float = time.perf_counter()
+                    if total and now - last_report >= PROGRESS_INTERVAL:
+                        last_report = now
+                        logging.info(f"DOWNLOAD {url} -> {(offset + transferred) / total:.0%}")
+    except requests.RequestException as e:
+        raise _RetryableError(f"{type(e).__name__}: {e}", transferred)
+    except _RetryableError as e:
+        e.transferred = transferred
+        raise
+    finally:
+        count("bytes_downloaded", transferred)
+
+    size: int = part.stat().st_size
+    if total is not None and size != total:
+        raise _RetryableError(f"Incomplete download ({size}/{total} bytes)", transferred)
+    return transferred
+
+
+def _parse_total(content_range: str | None) -> int | None:
+    # Content-Range: bytes 0-1023/4096 or bytes */4096
+    if not content_range or "/" not in content_range:
+        return None
+    total: str = content_range.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
+def fetch_range(url: str, start: int, end: int | None = None, session: "requests.Session | None" = None, retries: int = RETRIES, backoff: float = BACKOFF) -> bytes:
+    # end is inclusive, a negative start without an end requests the last -start bytes
+    import requests
+
+    session = session or create_session(1)
+    if start < 0:
+        byte_range: str = f"bytes={start}"
+    else:
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, headers={"Range": byte_range}, timeout=TIMEOUT)
+            if response.status_code >= 500 or response.status_code in (408, 429):
+                raise _RetryableError(f"{response.status_code} {response.reason or 'Reason unknown'}")
+            if response.status_code != 206:
+                raise DownloadError(url, f"{response.status_code} {response.reason or 'Reason unknown'} (expected 206 Partial Content for Range: {byte_range})")
+            count("bytes_downloaded", len(response.content))
+            return response.content
+        except (requests.RequestException, _RetryableError) as e:
+            if attempt == retries:
+                raise DownloadError(url, f"{e} (gave up after {retries + 1} attempts)")
+            delay: float = backoff * 2 ** attempt
+            logging.warning(f"GET {url} [{byte_range}] -> {e}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    raise DownloadError(url, "Request failed")
@@ -0,0 +1,36 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except (ImportError, ModuleNotFoundError):  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    # Exclusive lock between processes, blocks until it is available. The lock file is left behind:
+    # removing it would let a waiting process lock a file nobody else can see anymore.
+    # Not reentrant, a second lock on the same file from the same process waits for the first one
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after 10 attempts
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
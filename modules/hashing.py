@@ -0,0 +1,17 @@
+import hashlib
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from modules.zip_fs import ZipPath
+
+
+# https://stackoverflow.com/a/44873382
+def sha256sum(target: "Path | ZipPath") -> str:
+    h  = hashlib.sha256()
+    b  = bytearray(128*1024)
+    mv = memoryview(b)
+    with (open(target, 'rb', buffering=0) if isinstance(target, Path) else target.open("rb")) as f:
+        while n := f.readinto(mv):
+            h.update(mv[:n])
+    return h.hexdigest()
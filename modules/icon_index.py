@@ -0,0 +1,54 @@
+from dataclasses import dataclass
+
+from modules.icon_manifest import IconManifest
+from modules.imagesets import Icon, Layout
+
+
+@dataclass
+class RemapStats:
+    by_name: int = 0
+    by_hash: int = 0  # Renamed icons, found by the hash of their original pixels
+    unmatched: int = 0
+
+
+class IconIndex:
+    # The icons of a deployment by size class and name, and by the hash of their original pixels once
+    # hashes were added. Built once per deployment and shared by every mod updated to it
+
+    _by_name: dict[str, dict[str, Icon]]
+    _by_hash: dict[str, dict[bytes, list[Icon]]] | None
+
+    def __init__(self, layout: Layout) -> None:
+        self._by_name = {size: {icon.name: icon for icon in icons} for size, icons in layout.items()}
+        self._by_hash = None
+
+    @property
+    def has_hashes(self) -> bool:
+        return self._by_hash is not None
+
+    def get(self, size: str, name: str) -> Icon | None:
+        return self._by_name.get(size, {}).get(name)
+
+    def add_hashes(self, manifest: IconManifest) -> None:
+        by_hash: dict[str, dict[bytes, list[Icon]]] = {}
+        for size, icons in manifest.layout.items():
+            hashes: dict[bytes, list[Icon]] = by_hash.setdefault(size, {})
+            for icon, icon_hash in zip(icons, manifest.hashes[size]):
+                hashes.setdefault(icon_hash, []).append(icon)
+        self._by_hash = by_hash
+
+    def find_renamed(self, original_hashes: dict[tuple[str, str], bytes], source_names: dict[str, set[str]]) -> dict[tuple[str, str], Icon]:
+        # Icons of the mod's version that aren't in this deployment, (size class, name) -> their icon in this deployment.
+        # An icon matches an icon with a new name and the same original pixels, as long as that is the only one:
+        # icons that exist in both versions keep their name, and identical placeholder icons are ambiguous
+        if self._by_hash is None:
+            raise ValueError("no hashes, see add_hashes")
+        candidates: dict[tuple[str, str], Icon] = {}
+        claims: dict[tuple[str, str], int] = {}
+        for (size, name), original_hash in original_hashes.items():
+            names: set[str] = source_names.get(size, set())
+            icons: list[Icon] = [icon for icon in self._by_hash.get(size, {}).get(original_hash, []) if icon.name not in names]
+            if len(icons) == 1:
+                candidates[(size, name)] = icons[0]
+                claims[(size, icons[0].name)] = claims.get((size, icons[0].name), 0) + 1
+        return {key: icon for key, icon in candidates.items() if claims[(key[0], icon.name)] == 1}
@@ -0,0 +1,114 @@
+from concurrent.futures import Executor
+from dataclasses import dataclass
+import logging
+import os
+from pathlib import Path
+import struct
+from typing import TYPE_CHECKING, Iterator
+
+from modules.detection import HASH_SIZE, hash_imageset
+from modules.imagesets import ImageSet, Layout, decode_layout, encode_layout, get_imagesets
+from modules.parallel import map_ordered
+from modules.paths import cache_directory
+
+if TYPE_CHECKING:
+    from modules.zip_fs import ZipPath
+
+
+MANIFEST_CACHE: Path | None = cache_directory() / "manifests"
+
+# Icon manifest file, all integers little-endian:
+#   header  magic "SMUM", format version (u16), fileVersion (u32), sha256 of GetImageSetData.lua (32 bytes),
+#           length of the imageSet directory (u16), followed by the imageSet directory (UTF-8)
+#   layout  encoded layout, see modules/imagesets.py
+#   hashes  per size class in layout order: the hash of every icon (HASH_SIZE bytes each), in layout order
+MAGIC: bytes = b"SMUM"
+FORMAT_VERSION: int = 1
+HEADER = struct.Struct("<4sHI32sH")
+
+
+@dataclass
+class IconManifest:
+    # Layout and a hash of every original icon of a deployment, enough to detect modded icons without its package
+    fileVersion: int
+    image_set_directory: str
+    imagesetdata_sha256: str
+    layout: Layout
+    hashes: dict[str, list[bytes]]  # size class -> icon hashes, in layout order
+
+    def imagesets(self, imageset_directory: Path) -> list[tuple[ImageSet, list[bytes]]]:
+        hashes: dict[tuple[str, str], bytes] = {}
+        for size, icons in self.layout.items():
+            for icon, icon_hash in zip(icons, self.hashes[size]):
+                hashes[(size, icon.name)] = icon_hash
+        return [(imageset, [hashes[(imageset.size, icon.name)] for icon in imageset.icons]) for imageset in get_imagesets(self.layout, imageset_directory)]
+
+
+def build_manifest(fileVersion: int, image_set_directory: str, imagesetdata_sha256: str, layout: Layout, imageset_directory: "Path | ZipPath", executor: Executor | None = None) -> IconManifest:
+    imagesets: list[ImageSet] = get_imagesets(layout, imageset_directory)
+
+    def work_units() -> Iterator[tuple]:
+        for imageset in imagesets:
+            original: Path | bytes | ZipPath = imageset.path
+            if executor is not None and not isinstance(original, Path):
+                original = original.read_bytes()
+            yield (original, imageset.icons)
+
+    hashes: dict[tuple[str, str], bytes] = {}
+    for imageset, imageset_hashes in zip(imagesets, map_ordered(hash_imageset, work_units(), executor)):
+        for icon, icon_hash in zip(imageset.icons, imageset_hashes):
+            hashes[(imageset.size, icon.name)] = icon_hash
+
+    return IconManifest(fileVersion, image_set_directory, imagesetdata_sha256, layout, {size: [hashes[(size, icon.name)] for icon in icons] for size, icons in layout.items()})
+
+
+def has_manifest(fileVersion: int) -> bool:
+    return MANIFEST_CACHE is not None and (MANIFEST_CACHE / f"{fileVersion}.manifest").exists()
+
+
+def load_manifest(fileVersion: int) -> IconManifest | None:
+    if MANIFEST_CACHE is None:
+        return None
+    path: Path = MANIFEST_CACHE / f"{fileVersion}.manifest"
+    if not path.exists():
+        return None
+
+    try:
+        with open(path, "rb") as file:
+            data: bytes = file.read()
+        magic, format_version, manifest_fileVersion, imagesetdata_sha256, directory_length = HEADER.unpack_from(data)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            return None
+        offset: int = HEADER.size
+        image_set_directory: str = data[offset:offset + directory_length].decode("utf-8")
+        layout, offset = decode_layout(data, offset + directory_length)
+
+        hashes: dict[str, list[bytes]] = {}
+        for size, icons in layout.items():
+            end: int = offset + len(icons) * HASH_SIZE
+            if end > len(data):
+                raise ValueError("truncated")
+            hashes[size] = [data[index:index + HASH_SIZE] for index in range(offset, end, HASH_SIZE)]
+            offset = end
+        return IconManifest(manifest_fileVersion, image_set_directory, imagesetdata_sha256.hex(), layout, hashes)
+    except (OSError, ValueError, struct.error) as e:
+        logging.warning(f"Failed to load icon manifest {fileVersion}: {e}")
+        return None
+
+
+def save_manifest(manifest: IconManifest) -> None:
+    if MANIFEST_CACHE is None:
+        return
+
+    directory: bytes = manifest.image_set_directory.encode("utf-8")
+    parts: list[bytes] = [
+        HEADER.pack(MAGIC, FORMAT_VERSION, manifest.fileVersion, bytes.fromhex(manifest.imagesetdata_sha256), len(directory)) + directory,
+        encode_layout(manifest.layout),
+    ]
+    parts += [b"".join(manifest.hashes[size]) for size in manifest.layout]
+    MANIFEST_CACHE.mkdir(parents=True, exist_ok=True)
+    path: Path = MANIFEST_CACHE / f"{manifest.fileVersion}.manifest"
+    temporary: Path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(temporary, "wb") as file:
+        file.write(b"".join(parts))
+    os.replace(temporary, path)
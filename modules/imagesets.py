@@ -1,9 +1,43 @@
 from dataclasses import dataclass
-from pathlib import Path
+import logging
+import os
+from pathlib import Path, PurePosixPath
 import re
+import struct
+import threading
+from typing import Iterable, TYPE_CHECKING
 
+from modules.metrics import phase
+from modules.paths import cache_directory
+from modules.zip_extractor import normalize
 
-@dataclass
+if TYPE_CHECKING:
+    from modules.zip_fs import ZipPath
+
+
+IMAGESET_PATTERN = re.compile(r"^img_set_[1-3]x_\d+\.png$")
+
+# Size class headers, icon entries and the end of a size class, matched in a single pass
+TOKEN_PATTERN = re.compile(
+    r"function make_assets_(\dx)\(\)"
+    r"|\['([^']+)'\] = \{ ImageRectOffset = Vector2\.new\((\d+), (\d+)\), ImageRectSize = Vector2\.new\((\d+), (\d+)\), ImageSet = '([^']+)' \}"
+    r"|(\} end)"
+)
+
+LAYOUT_CACHE: Path | None = cache_directory() / "layouts"
+
+# Encoded layout (layout cache files and icon manifests), all integers little-endian:
+#   header  magic "SMUL", format version (u16), size class count (u32)
+#   per size class: lengths of the size class, the icon names and the imageSet names (u32 each), icon count (u32),
+#           followed by the size class, the icon names and the imageSet names (UTF-8, names separated by NUL),
+#           the index of every icon's imageSet name and x, y, w, h of every icon (u32 each)
+LAYOUT_MAGIC: bytes = b"SMUL"
+LAYOUT_FORMAT_VERSION: int = 1
+LAYOUT_HEADER = struct.Struct("<4sHI")
+SIZE_CLASS_HEADER = struct.Struct("<4I")
+
+
+@dataclass(slots=True)
 class Icon:
     name: str
     imageset: str
@@ -17,30 +51,54 @@ class Icon:
 @dataclass
 class ImageSet:
     name: str
-    path: Path
+    path: "Path | ZipPath"
     size: str
     icons: list[Icon]
 
 
-def get_imagesetdata(data_file: Path, imageset_directory: Path) -> list[ImageSet]:
-    with open(data_file, "r") as file:
-        content: str = file.read()
-    parsed: dict[str, dict[str, dict[str, str | int]]] = _parse_file_content(content)
+def find_image_set_directory(names: Iterable[str]) -> PurePosixPath | None:
+    for name in names:
+        path = PurePosixPath(name)
+        if IMAGESET_PATTERN.match(path.name):
+            return path.parent
+    return None
 
-    imagesets_dict: dict[str, ImageSet] = {}
 
-    for size, icons in parsed.items():
-        for name, data in icons.items():
-            imageset: str = data["image_set"]
-            x: int = data["x"]
-            y: int = data["y"]
-            w: int = data["w"]
-            h: int = data["h"]
-            icon: Icon = Icon(name, imageset, x, y, w, h, (x, y, x + w, y + h))
+def get_imagesetdata_path(image_set_directory: PurePosixPath) -> PurePosixPath:
+    return image_set_directory.parent / "Generated" / "GetImageSetData.lua"
+
+
+def get_imageset_members(names: Iterable[str], image_set_directory: PurePosixPath | None = None) -> list[str]:
+    # The archive members needed to update a mod: the imageSet directory and GetImageSetData.lua
+    normalized: dict[str, str] = {normalize(name): name for name in names}
+    if image_set_directory is None:
+        image_set_directory = find_image_set_directory(normalized)
+        if image_set_directory is None:
+            return []
+    prefix: str = f"{image_set_directory.as_posix()}/"
+    data_file: str = get_imagesetdata_path(image_set_directory).as_posix()
+    return [name for path, name in normalized.items() if path.startswith(prefix) or path == data_file]
+
 
-            imageset_item: ImageSet | None = imagesets_dict.get(imageset)
+# Icons of each size class in file order
+Layout = dict[str, list[Icon]]
+
+_layouts: dict[str, Layout] = {}
+_layouts_lock = threading.Lock()
+
+
+def get_imagesetdata(data_file: "Path | ZipPath", imageset_directory: "Path | ZipPath", sha256: str | None = None) -> list[ImageSet]:
+    return get_imagesets(get_layout(data_file, sha256), imageset_directory)
+
+
+def get_imagesets(layout: Layout, imageset_directory: "Path | ZipPath") -> list[ImageSet]:
+    imagesets_dict: dict[str, ImageSet] = {}
+
+    for size, icons in layout.items():
+        for icon in icons:
+            imageset_item: ImageSet | None = imagesets_dict.get(icon.imageset)
             if imageset_item is None:
-                imagesets_dict[imageset] = ImageSet(imageset, imageset_directory / f"{imageset}.png", size, [icon])
+                imagesets_dict[icon.imageset] = ImageSet(icon.imageset, imageset_directory / f"{icon.imageset}.png", size, [icon])
             else:
                 imageset_item.icons.append(icon)
 
@@ -48,26 +106,137 @@ def get_imagesetdata(data_file: Path, imageset_directory: Path) -> list[ImageSet
     return imagesets
 
 
-def _parse_file_content(content: str) -> dict[str, dict[str, dict[str, str | int]]]:  # ChatGPT
-    icon_map: dict[str, dict[str, dict[str, str | int]]] = {}
-
-    image_size_pattern: str = r"function make_assets_(\dx)\(\).*?(\{.*?\}) end"
-    icon_data_pattern: str = r"\['([^']+)'\] = \{ ImageRectOffset = Vector2\.new\((\d+), (\d+)\), ImageRectSize = Vector2\.new\((\d+), (\d+)\), ImageSet = '([^']+)' \}"
-
-    image_size_matches: list = re.findall(image_size_pattern, content, re.DOTALL)
-    for size, data in image_size_matches:
-        if size not in icon_map:
-            icon_map[size] = {}
-
-        icon_data_matches: list = re.findall(icon_data_pattern, data)
-        for icon in icon_data_matches:
-            name, x, y, w, h, image_set = icon
-            icon_map[size][name] = {
-                "image_set": image_set,
-                "x": int(x),
-                "y": int(y),
-                "w": int(w),
-                "h": int(h)
-            }
-
-    return icon_map
\ No newline at end of file
+def get_layout(data_file: "Path | ZipPath", sha256: str | None = None) -> Layout:
+    # With the file's sha256, parse results are reused from memory or the layout cache
+    with phase("parse"):
+        return _get_layout(data_file, sha256)
+
+
+def _get_layout(data_file: "Path | ZipPath", sha256: str | None) -> Layout:
+    if sha256 is None:
+        return _parse_file_content(data_file.read_text())
+
+    with _layouts_lock:
+        layout: Layout | None = _layouts.get(sha256)
+    if layout is not None:
+        return layout
+
+    layout = _load_layout(sha256)
+    if layout is None:
+        layout = _parse_file_content(data_file.read_text())
+        _save_layout(sha256, layout)
+
+    with _layouts_lock:
+        _layouts[sha256] = layout
+    return layout
+
+
+def cache_layout(data_file: "Path | ZipPath", sha256: str) -> bool:
+    # Parses a layout into the layout cache ahead of time without keeping it in memory, False if it was already cached
+    if LAYOUT_CACHE is None or (LAYOUT_CACHE / f"{sha256}.layout").exists():
+        return False
+    with phase("parse"):
+        _save_layout(sha256, _parse_file_content(data_file.read_text()))
+    return True
+
+
+def _parse_file_content(content: str) -> Layout:
+    icon_map: dict[str, dict[str, Icon]] = {}
+    icons: dict[str, Icon] | None = None
+
+    for match in TOKEN_PATTERN.finditer(content):
+        size, name, x, y, w, h, imageset, end = match.groups()
+        if size is not None:
+            icons = icon_map.setdefault(size, {})
+        elif end is not None:
+            icons = None
+        elif icons is not None:
+            x, y, w, h = int(x), int(y), int(w), int(h)
+            icons[name] = Icon(name, imageset, x, y, w, h, (x, y, x + w, y + h))
+
+    return {size: list(icons.values()) for size, icons in icon_map.items()}
+
+
+def _load_layout(sha256: str) -> Layout | None:
+    if LAYOUT_CACHE is None:
+        return None
+    path: Path = LAYOUT_CACHE / f"{sha256}.layout"
+    if not path.exists():
+        return None
+
+    try:
+        with open(path, "rb") as file:
+            layout, _ = decode_layout(file.read())
+    except (OSError, ValueError) as e:
+        logging.warning(f"Failed to load cached layout {sha256}: {e}")
+        return None
+    return layout
+
+
+def _save_layout(sha256: str, layout: Layout) -> None:
+    if LAYOUT_CACHE is None:
+        return
+
+    data: bytes = encode_layout(layout)
+
+    try:
+        LAYOUT_CACHE.mkdir(parents=True, exist_ok=True)
+        path: Path = LAYOUT_CACHE / f"{sha256}.layout"
+        temporary: Path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temporary, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+    except OSError as e:
+        logging.warning(f"Failed to cache layout {sha256}: {e}")
+
+
+def encode_layout(layout: Layout) -> bytes:
+    # Columns instead of one record per icon, a lot faster to decode
+    parts: list[bytes] = [LAYOUT_HEADER.pack(LAYOUT_MAGIC, LAYOUT_FORMAT_VERSION, len(layout))]
+    for size, icons in layout.items():
+        imageset_names: dict[str, int] = {}
+        imageset_indices: list[int] = [imageset_names.setdefault(icon.imageset, len(imageset_names)) for icon in icons]
+        size_data: bytes = size.encode("utf-8")
+        names: bytes = "\0".join(icon.name for icon in icons).encode("utf-8")
+        imagesets: bytes = "\0".join(imageset_names).encode("utf-8")
+        parts.append(SIZE_CLASS_HEADER.pack(len(size_data), len(names), len(imagesets), len(icons)) + size_data + names + imagesets)
+        parts.append(struct.pack(f"<{len(icons)}I", *imageset_indices))
+        parts.append(struct.pack(f"<{len(icons) * 4}I", *(value for icon in icons for value in (icon.x, icon.y, icon.w, icon.h))))
+    return b"".join(parts)
+
+
+def decode_layout(data: bytes, offset: int = 0) -> tuple[Layout, int]:
+    # The layout encoded at offset and the offset right after it, ValueError if it isn't a layout of this format
+    try:
+        magic, format_version, size_count = LAYOUT_HEADER.unpack_from(data, offset)
+        if magic != LAYOUT_MAGIC:
+            raise ValueError("not an encoded layout")
+        if format_version != LAYOUT_FORMAT_VERSION:
+            raise ValueError(f"unsupported layout format version {format_version}")
+        offset += LAYOUT_HEADER.size
+
+        layout: Layout = {}
+        for _ in range(size_count):
+            size_length, names_length, imagesets_length, icon_count = SIZE_CLASS_HEADER.unpack_from(data, offset)
+            offset += SIZE_CLASS_HEADER.size
+            size: str = data[offset:offset + size_length].decode("utf-8")
+            offset += size_length
+            names: list[str] = data[offset:offset + names_length].decode("utf-8").split("\0") if icon_count else []
+            offset += names_length
+            imageset_names: list[str] = data[offset:offset + imagesets_length].decode("utf-8").split("\0")
+            offset += imagesets_length
+            imageset_indices: tuple[int, ...] = struct.unpack_from(f"<{icon_count}I", data, offset)
+            offset += icon_count * 4
+            values: tuple[int, ...] = struct.unpack_from(f"<{icon_count * 4}I", data, offset)
+            offset += icon_count * 16
+            if len(names) != icon_count:
+                raise ValueError(f"{len(names)} icon names for {icon_count} icons")
+
+            icons: list[Icon] = []
+            for index, name in enumerate(names):
+                x, y, w, h = values[index * 4:index * 4 + 4]
+                icons.append(Icon(name, imageset_names[imageset_indices[index]], x, y, w, h, (x, y, x + w, y + h)))
+            layout[size] = icons
+    except (struct.error, UnicodeDecodeError, IndexError) as e:
+        raise ValueError(f"corrupted layout: {e}")
+    return layout, offset
@@ -0,0 +1,65 @@
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+
+from modules.deployments import DeployHistory, Deployment
+from modules.file_lock import file_lock
+from modules.paths import cache_directory
+
+
+# sha256 of GetImageSetData.lua of every deployment whose package was opened, by version hash.
+# Enough to tell that a mod isn't outdated without downloading anything
+LAYOUT_HASHES: Path | None = cache_directory() / "layout_hashes.json"
+
+_hashes: dict[str, str] | None = None
+_lock: threading.Lock = threading.Lock()
+
+
+def known_layout_hash(fileVersion: int) -> str | None:
+    # None if the file version isn't in the cached DeployHistory or its package was never opened
+    deployment: Deployment | None = DeployHistory.lookup(fileVersion)
+    if deployment is None:
+        return None
+    with _lock:
+        return _load().get(deployment.version)
+
+
+def save_layout_hash(deployment: Deployment, sha256: str) -> None:
+    global _hashes
+    if LAYOUT_HASHES is None:
+        return
+    with _lock:
+        if _load().get(deployment.version) == sha256:
+            return
+        try:
+            # Other processes may have saved hashes since this one loaded them, merge with the file under its lock
+            with file_lock(LAYOUT_HASHES.with_name(f".{LAYOUT_HASHES.name}.lock")):
+                hashes: dict[str, str] = {**_load(), **_read()}
+                hashes[deployment.version] = sha256
+                _hashes = hashes
+                temporary: Path = LAYOUT_HASHES.with_name(f".{LAYOUT_HASHES.name}.{os.getpid()}.tmp")
+                with open(temporary, "w") as file:
+                    json.dump(hashes, file, separators=(",", ":"))
+                os.replace(temporary, LAYOUT_HASHES)
+        except OSError as e:
+            logging.warning(f"Failed to save layout hashes: {e}")
+
+
+def _load() -> dict[str, str]:
+    global _hashes
+    if _hashes is None:
+        _hashes = _read()
+    return _hashes
+
+
+def _read() -> dict[str, str]:
+    if LAYOUT_HASHES is None or not LAYOUT_HASHES.exists():
+        return {}
+    try:
+        with open(LAYOUT_HASHES, "r") as file:
+            return {str(version): str(sha256) for version, sha256 in json.load(file).items()}
+    except (ValueError, AttributeError, OSError) as e:
+        logging.warning(f"Failed to load layout hashes: {e}")
+        return {}
@@ -0,0 +1,196 @@
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Iterator, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import cProfile
+
+
+# Phases of a run, in the order they usually happen
+PHASES: list[str] = ["config", "history", "download", "extract", "hash", "parse", "detect", "remap", "repaint", "backup", "update"]
+REPORT_VERSION: int = 1
+
+
+@dataclass
+class PhaseStats:
+    time: float = 0.0  # Summed over all calls, phases of mods updated in parallel overlap
+    wall: float = 0.0  # From the start of the first call to the end of the last one
+    calls: int = 0
+    traced_peak: int | None = None  # Peak of Python allocations while the phase ran, with trace_memory
+
+    first_start: float | None = None
+    last_end: float | None = None
+
+
+class Metrics:
+    # Phase timings (monotonic clock) and counters of a run, shared by all threads of this process.
+    # Work done on the process pool is timed by the phase that waits for it
+    trace_memory: bool
+    profile_phase: str | None
+    started: float
+    _phases: dict[str, PhaseStats]
+    _counters: dict[str, int]
+    _profiles: list["cProfile.Profile"]
+    _active: dict[int, list]  # Phases in progress while tracing memory: [phase, peak]
+    _next_key: int
+    _local: threading.local
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.trace_memory = False
+        self.profile_phase = None
+        self.started = time.perf_counter()
+        self._phases = {}
+        self._counters = {}
+        self._profiles = []
+        self._active = {}
+        self._next_key = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def configure(self, trace_memory: bool = False, profile_phase: str | None = None) -> None:
+        self.trace_memory = trace_memory
+        self.profile_phase = profile_phase
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start: float = time.perf_counter()
+        key: int | None = self._enter_memory(name) if self.trace_memory else None
+        profile: "cProfile.Profile | None" = self._start_profile() if name == self.profile_phase else None
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._local.profiling = False
+            end: float = time.perf_counter()
+            traced_peak: int | None = self._exit_memory(key) if key is not None else None
+            with self._lock:
+                stats: PhaseStats = self._phases.setdefault(name, PhaseStats())
+                stats.time += end - start
+                stats.calls += 1
+                stats.first_start = start if stats.first_start is None else min(stats.first_start, start)
+                stats.last_end = end if stats.last_end is None else max(stats.last_end, end)
+                stats.wall = stats.last_end - stats.first_start
+                if traced_peak is not None:
+                    stats.traced_peak = max(stats.traced_peak or 0, traced_peak)
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def report(self, exit_code: int | None = None) -> dict:
+        with self._lock:
+            phases: dict[str, dict] = {}
+            for name in sorted(self._phases, key=lambda name: (PHASES.index(name) if name in PHASES else len(PHASES), name)):
+                stats: dict = asdict(self._phases[name])
+                del stats["first_start"], stats["last_end"]
+                if stats["traced_peak"] is None:
+                    del stats["traced_peak"]
+                phases[name] = stats
+            counters: dict[str, int] = dict(sorted(self._counters.items()))
+        return {
+            "version": REPORT_VERSION,
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "argv": sys.argv[1:],
+            "exit_code": exit_code,
+            "wall_time": time.perf_counter() - self.started,
+            "peak_rss": peak_rss(),
+            "phases": phases,
+            "counters": counters,
+        }
+
+    def write_report(self, path: Path, exit_code: int | None = None) -> None:
+        temporary: Path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(temporary, "w") as file:
+            json.dump(self.report(exit_code), file, indent=4)
+        os.replace(temporary, path)
+
+    def write_profile(self, path: Path) -> bool:
+        # Profiles of every call of the profiled phase, merged. False if the phase never ran
+        import pstats
+
+        with self._lock:
+            profiles: list[cProfile.Profile] = list(self._profiles)
+        if not profiles:
+            return False
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return True
+
+    def _start_profile(self) -> "cProfile.Profile | None":
+        # cProfile only sees the thread it was enabled on, nested calls are covered by the outer one
+        import cProfile
+
+        if getattr(self._local, "profiling", False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Another profiler is active
+            return None
+        self._local.profiling = True
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def _enter_memory(self, name: str) -> int:
+        # The traced peak is reset whenever a phase starts or ends, so the peak so far is first handed to every running phase
+        with self._lock:
+            self._update_peaks()
+            self._next_key += 1
+            key: int = self._next_key
+            self._active[key] = [name, 0]
+            return key
+
+    def _exit_memory(self, key: int) -> int:
+        with self._lock:
+            self._update_peaks()
+            return self._active.pop(key)[1]
+
+    def _update_peaks(self) -> None:
+        peak: int = tracemalloc.get_traced_memory()[1]
+        for active in self._active.values():
+            active[1] = max(active[1], peak)
+        tracemalloc.reset_peak()
+
+
+def peak_rss() -> int:
+    # Peak resident set size of this process in bytes. ru_maxrss survives exec() on Linux,
+    # so VmHWM is preferred there to not report the parent's peak
+    try:
+        with open("/proc/self/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+METRICS = Metrics()
+
+
+def phase(name: str):
+    return METRICS.phase(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    METRICS.count(name, value)
@@ -2,116 +2,198 @@ import json
 import logging
 import os
 from pathlib import Path
-import re
 import shutil
-import sys
+
+from modules.backup import Backup, BackupError, BackupStats, backup_path, clone_file
+from modules.hashing import sha256sum
+from modules.imagesets import IMAGESET_PATTERN
+from modules.patch import PATCH_FILE
+
+
+class ModError(Exception):
+    pass
 
 
 class Mod:
+    JOURNAL: str = ".mod-updater-update.json"
+
     name: str
     path: Path
     luapackages: Path
     image_set_directory: Path
     fileVersion: int
-    _backup: Path | None = None
 
-    def __init__(self, path: Path) -> None:
+    def __init__(self, path: Path, interactive: bool = True) -> None:
+        # Raises ModError if the mod can't be loaded, only prompts for a missing fileVersion if interactive
         self.path = path
         self.name = path.name
+        self._load(interactive)
+
+    def _load(self, interactive: bool) -> None:
+        if (self.path / self.JOURNAL).exists():
+            logging.warning(f"A previous update of {self.name} was interrupted, restoring backup...")
+            try:
+                stats: BackupStats = Backup(self.path, self.backup_path).restore()
+            except BackupError as e:
+                raise ModError(f"Failed to roll back interrupted update: {e}")
+            (self.path / self.JOURNAL).unlink(missing_ok=True)
+            logging.info(f"Backup restored! ({stats})")
 
         info_path: Path = self.path / "info.json"
         if not info_path.exists():
-            logging.error("Failed to load mod info: info.json file does not exist!")
-            input("Press ENTER to exit...")
-            sys.exit(1)
+            raise ModError("Failed to load mod info: info.json file does not exist!")
         
         with open(info_path, "r") as file:
             data = json.load(file)
         fileVersion = data.get("fileVersion")
         try:
             if fileVersion is None:
+                if not interactive:
+                    raise ModError("Failed to load mod info[fileVersion]: fileVersion is None")
                 logging.warning("Failed to load mod info[fileVersion]: fileVersion is None")
                 print()
                 fileVersion = input("Mod file version: ")
             fileVersion = int(fileVersion)
             self.fileVersion = fileVersion
         except ValueError as e:
-            logging.error(f"Failed to load mod info[fileVersion]: {e}")
-            input("Press ENTER to exit...")
-            sys.exit(1)
+            raise ModError(f"Failed to load mod info[fileVersion]: {e}")
         
         logging.info("Locating imageSets...")
         self.luapackages: Path = self.path / "ExtraContent" / "LuaPackages"
         if not self.luapackages.exists():
-            logging.error("Incompatible mod: LuaPackages does not exist!")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-        pattern = re.compile(r"^img_set_[1-3]x_\d+\.png$")
+            raise ModError("Incompatible mod: LuaPackages does not exist!")
         for (root, dirs, files) in os.walk(self.luapackages):
-            if any(pattern.match(file) for file in files):
+            if any(IMAGESET_PATTERN.match(file) for file in files):
                 self.image_set_directory = Path(root).relative_to(self.luapackages)
                 break
         else:
-            logging.error("Incompatible mod: imageSets not found!")
-            input("Press ENTER to exit...")
-            sys.exit(1)
+            raise ModError("Incompatible mod: imageSets not found!")
         logging.info(self.image_set_directory)
 
-    def backup(self) -> None:
+    @property
+    def backup_path(self) -> Path:
+        return backup_path(self.path)
+
+    def backup(self) -> BackupStats:
+        # Only files that changed since the last backup are copied, see modules/backup.py
         logging.info(f"Backing up mod: {self.name}")
-        target: Path = self.path.with_name(f"{self.name}.mod-updater-backup")
-        if target.exists():
-            logging.warning("Removing existing backup...")
-            shutil.rmtree(target)
-            logging.info("Backing up mod...")
-        shutil.copytree(self.path, target)
-        logging.info("Backup complete!")
-
-    def restore_backup(self) -> None:
-        if self._backup is None:
-            logging.error("Failed to restore backup: No backup was made!")
-            input("Press ENTER to exit...")
-            sys.exit(1)
-
-        if self.path.exists():
-            logging.error("Failed to restore backup: Original mod exists!")
-            print(f"Please restore the backup manually: {self._backup}")
-
-        logging.info(f"Restoring backup: {self._backup.name}")
-        self._backup.rename(self.path)
-        logging.info("Backup restored!")
-        logging.info("Removing backup...")
-        shutil.rmtree(self._backup)
-        self._backup = None
+        touched: list[Path] = [Path("info.json"), Path(PATCH_FILE), self.luapackages.relative_to(self.path) / self.image_set_directory]
+        stats: BackupStats = Backup(self.path, self.backup_path).create(touched)
+        logging.info(f"Backup complete! ({stats})")
+        return stats
+
+    def restore_backup(self) -> BackupStats:
+        # Raises BackupError if there is no backup or it is damaged, the mod is left untouched then
+        logging.info(f"Restoring backup: {self.backup_path.name}")
+        stats: BackupStats = Backup(self.path, self.backup_path).restore()
+        logging.info(f"Backup restored! ({stats})")
+        self._load(interactive=False)
+        return stats
+
+    def export(self, destination: Path, imagesets: Path, imageset_directory: Path, fileVersion: int) -> "Mod":
+        # A copy of the mod with other imageSets, the mod itself is left untouched. Files are reflinked where possible.
+        # The copy is made next to destination and then renamed, an existing destination is replaced
+        logging.info(f"Exporting mod: {destination.name}")
+        temporary: Path = destination.with_name(f".{destination.name}.tmp")
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if temporary.exists():
+            shutil.rmtree(temporary)
+
+        old_imagesets: Path = self.luapackages / self.image_set_directory
+        for root, dirs, files in os.walk(self.path):
+            if Path(root) == old_imagesets:
+                dirs.clear()
+                continue
+            for name in files:
+                source: Path = Path(root) / name
+                if source.parent == self.path and name in (self.JOURNAL, PATCH_FILE):
+                    continue
+                target: Path = temporary / source.relative_to(self.path)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                clone_file(source, target)
+
+        new_imagesets: Path = temporary / self.luapackages.relative_to(self.path) / imageset_directory
+        new_imagesets.mkdir(parents=True, exist_ok=True)
+        for file in imagesets.iterdir():
+            if file.is_file():
+                clone_file(file, new_imagesets / file.name)
+        _write_atomic(temporary / "info.json", json.dumps({"fileVersion": fileVersion}, indent=4).encode())
+
+        if destination.exists():
+            logging.warning(f"Replacing existing copy: {destination}")
+            shutil.rmtree(destination)
+        temporary.rename(destination)
+        return Mod(destination, interactive=False)
 
     def update_info(self, fileVersion: int) -> None:
         logging.info("Updating mod info...")
-        info_path: Path = self.path / "info.json"
-        with open(info_path, "w") as file:
-            json.dump({"fileVersion": fileVersion}, file, indent=4)
+        # Replaced instead of rewritten, a backup may share the file (hardlink)
+        _write_atomic(self.path / "info.json", json.dumps({"fileVersion": fileVersion}, indent=4).encode())
         self.fileVersion = fileVersion
 
     def update(self, updated_imagesets: Path, updated_imageset_directory: Path, fileVersion: int) -> None:
+        # Only new or changed imageSets are written, each one to a temporary file that is renamed over the old one,
+        # then stale files are removed. The journal marks the update as in progress until the mod is consistent
+        # again, an interrupted update is rolled back from the backup the next time the mod is loaded
         logging.info(f"Updating mod files: {self.name}")
+        journal: Path = self.path / self.JOURNAL
+        _write_atomic(journal, json.dumps({"fileVersion": fileVersion}).encode())
 
-        logging.info("Removing old imageSets...")
         old_imagesets: Path = self.luapackages / self.image_set_directory
-        shutil.rmtree(old_imagesets)
+        new_imagesets: Path = self.luapackages / updated_imageset_directory
+        new_imagesets.mkdir(parents=True, exist_ok=True)
+
+        logging.info("Writing changed imageSets...")
+        written: int = 0
+        unchanged: int = 0
+        keep: set[Path] = set()
+        for file in sorted(updated_imagesets.iterdir()):
+            target: Path = new_imagesets / file.name
+            keep.add(target)
+            if target.is_file() and target.stat().st_size == file.stat().st_size and sha256sum(target) == sha256sum(file):
+                unchanged += 1
+                continue
+            _write_atomic(target, file.read_bytes())
+            written += 1
+
+        self.image_set_directory = updated_imageset_directory
+        self.update_info(fileVersion)
 
-        parent = old_imagesets.parent
+        logging.info("Removing stale imageSets...")
+        removed: int = 0
+        for directory in {old_imagesets, new_imagesets}:
+            if not directory.exists():
+                continue
+            for file in sorted(directory.rglob("*"), reverse=True):
+                if file.is_dir():
+                    if not any(file.iterdir()):
+                        file.rmdir()
+                elif file not in keep:
+                    file.unlink()
+                    removed += 1
+
+        # Prune the old imageSet directory and its parents if they are empty now
+        parent: Path = old_imagesets
         safeguard: str = self.luapackages.name
-        while not os.listdir(parent):
+        while parent.exists() and not os.listdir(parent):
             if parent.name == safeguard:
                 break
             parent.rmdir()
             parent = parent.parent
 
-        logging.info("Copying new imageSets...")
-        new_imagesets: Path = self.luapackages / updated_imageset_directory
-        new_imagesets.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copytree(updated_imagesets, new_imagesets)
-        self.image_set_directory = updated_imageset_directory
-        
-        self.update_info(fileVersion)
+        journal.unlink()
+        logging.info(f"{written} imageSets written, {unchanged} unchanged, {removed} stale files removed")
+        logging.info("Mod updated successfully!")
+
 
-        logging.info("Mod updated successfully!")
\ No newline at end of file
+def _write_atomic(path: Path, data: bytes) -> None:
+    # The file is either the old or the new one, even if the process or system crashes
+    temporary: Path = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(temporary, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    finally:
+        temporary.unlink(missing_ok=True)
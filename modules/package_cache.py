@@ -0,0 +1,233 @@
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+import uuid
+from typing import Callable, Iterator, TYPE_CHECKING
+from zipfile import is_zipfile
+
+from modules.deployments import Deployment
+from modules.downloader import DownloadError
+from modules.file_lock import file_lock
+from modules.hashing import sha256sum
+from modules.metrics import count, phase
+
+if TYPE_CHECKING:
+    import requests
+
+
+@dataclass
+class CacheEntry:
+    version: str
+    package: str
+    size: int
+    sha256: str
+    created: float
+    last_used: float
+    mtime_ns: int = 0  # Of the cached file once its sha256 was checked, 0 in indexes of older versions
+
+    @property
+    def key(self) -> str:
+        return f"{self.version}-{self.package}"
+
+
+class PackageCache:
+    # Can be shared by several processes (e.g. --watch next to normal runs): the index is re-read
+    # and written back under a lock on the cache directory by every change
+    DEFAULT_MAX_SIZE: int = 1024 * 1024 * 1024  # 1 GiB
+    INDEX: str = "index.json"
+    LOCK: str = ".lock"
+
+    directory: Path
+    max_size: int
+    _entries: dict[str, CacheEntry]
+    _lock: threading.RLock
+
+    def __init__(self, directory: Path, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.RLock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._entries = self._load_index()
+
+    @property
+    def size(self) -> int:
+        return sum(entry.size for entry in self._entries.values())
+
+    def entries(self) -> list[CacheEntry]:
+        with self._locked():
+            return sorted(self._entries.values(), key=lambda entry: entry.last_used, reverse=True)
+
+    def path(self, version: str, package: str) -> Path:
+        return self.directory / f"{version}-{package}"
+
+    def get(self, deployment: Deployment, package: str) -> Path | None:
+        # A hit is checked by size and modification time. The full sha256 is only checked when the file changed
+        # since it was cached (or by prune), and outside of the lock so other threads and processes aren't held up
+        key: str = f"{deployment.version}-{package}"
+        path: Path = self.path(deployment.version, package)
+        with self._locked():
+            entry: CacheEntry | None = self._entries.get(key)
+            if entry is None:
+                return None
+            try:
+                stat: os.stat_result = path.stat()
+            except FileNotFoundError:
+                return self._discard(entry)
+            if stat.st_size != entry.size:
+                return self._discard(entry)
+            if stat.st_mtime_ns == entry.mtime_ns:
+                entry.last_used = time.time()
+                self._save_index()
+                return path
+            sha256: str = entry.sha256
+
+        try:
+            with phase("hash"):
+                valid: bool = sha256sum(path) == sha256
+        except FileNotFoundError:
+            valid = False
+        with self._locked():
+            entry = self._entries.get(key)
+            if entry is None or entry.sha256 != sha256:  # Replaced or removed meanwhile
+                return None
+            if not valid:
+                return self._discard(entry)
+            entry.mtime_ns = stat.st_mtime_ns
+            entry.last_used = time.time()
+            self._save_index()
+            return path
+
+    def put(self, deployment: Deployment, package: str, source: Path) -> Path:
+        if not is_zipfile(source):
+            source.unlink(missing_ok=True)
+            raise DownloadError(deployment.package_url(package), f"Refusing to cache '{package}' ({deployment.version}): not a valid zip file")
+
+        size: int = source.stat().st_size
+        sha256: str = sha256sum(source)
+        with self._locked():
+            target: Path = self.path(deployment.version, package)
+            os.replace(source, target)  # Atomic, readers never see a partial file
+            now: float = time.time()
+            entry: CacheEntry = CacheEntry(deployment.version, package, size, sha256, now, now, target.stat().st_mtime_ns)
+            self._entries[entry.key] = entry
+            self._evict(keep=entry.key)
+            self._save_index()
+        return target
+
+    def fetch(self, deployment: Deployment, package: str, session_factory: "Callable[[], requests.Session] | None" = None) -> Path:
+        # session_factory is only called on a cache miss, so a cache hit doesn't need to import requests
+        cached: Path | None = self.get(deployment, package)
+        if cached is None:
+            # Another process downloading the same package is waited for, the package is then in the cache
+            with file_lock(self.directory / f".{deployment.version}-{package}.lock"):
+                cached = self.get(deployment, package)
+                if cached is None:
+                    logging.info(f"CACHE {deployment.version}-{package} -> MISS")
+                    count("cache_misses")
+                    # Not randomized, so an interrupted download ('.part' file) is resumed by the next run
+                    temporary: Path = self.directory / f".{deployment.version}-{package}.download"
+                    try:
+                        deployment.download_package(package, temporary, session_factory() if session_factory is not None else None)
+                        return self.put(deployment, package, temporary)
+                    finally:
+                        temporary.unlink(missing_ok=True)
+
+        logging.info(f"CACHE {deployment.version}-{package} -> HIT")
+        count("cache_hits")
+        return cached
+
+    def prune(self, max_size: int | None = None) -> int:
+        # Removes corrupted entries, leftover files and least recently used entries. Dot files are
+        # the lock files, temporary files and partial downloads of runs that may still be going on
+        with self._locked():
+            freed: int = 0
+            for entry in list(self._entries.values()):
+                if not self._verify(entry, self.path(entry.version, entry.package)):
+                    freed += self._remove(entry)
+
+            known: set[str] = {self.INDEX, *self._entries.keys()}
+            for path in self.directory.iterdir():
+                if path.is_file() and path.name not in known and not path.name.startswith("."):
+                    freed += path.stat().st_size
+                    path.unlink()
+
+            freed += self._evict(max_size=max_size)
+            self._save_index()
+            return freed
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        # Other processes may have changed the index since it was last read. Changes are written
+        # to the index before the lock is released, so the index on disk is always the latest one
+        with self._lock, file_lock(self.directory / self.LOCK):
+            self._entries = self._load_index()
+            yield
+
+    def _evict(self, max_size: int | None = None, keep: str | None = None) -> int:
+        limit: int = self.max_size if max_size is None else max_size
+        freed: int = 0
+        for entry in sorted(self._entries.values(), key=lambda entry: entry.last_used):
+            if self.size <= limit:
+                break
+            if entry.key == keep:
+                continue
+            logging.info(f"Evicting cached package: {entry.key}")
+            freed += self._remove(entry)
+        return freed
+
+    def _discard(self, entry: CacheEntry) -> None:
+        logging.warning(f"Discarding corrupted cache entry: {entry.key}")
+        self._remove(entry)
+        self._save_index()
+
+    def _remove(self, entry: CacheEntry) -> int:
+        self._entries.pop(entry.key, None)
+        path: Path = self.path(entry.version, entry.package)
+        try:
+            size: int = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return 0
+        return size
+
+    def _verify(self, entry: CacheEntry, path: Path) -> bool:
+        try:
+            stat: os.stat_result = path.stat()
+        except FileNotFoundError:
+            return False
+        if stat.st_size != entry.size:
+            return False
+        with phase("hash"):
+            if sha256sum(path) != entry.sha256:
+                return False
+        entry.mtime_ns = stat.st_mtime_ns
+        return True
+
+    def _temporary_path(self, name: str) -> Path:
+        return self.directory / f".{name}.{uuid.uuid4().hex}.tmp"
+
+    def _load_index(self) -> dict[str, CacheEntry]:
+        index: Path = self.directory / self.INDEX
+        if not index.exists():
+            return {}
+        try:
+            with open(index, "r") as file:
+                data: list[dict] = json.load(file)
+            entries: list[CacheEntry] = [CacheEntry(**item) for item in data]
+        except (ValueError, TypeError) as e:
+            logging.warning(f"Failed to load package cache index, starting empty: {e}")
+            return {}
+        return {entry.key: entry for entry in entries}
+
+    def _save_index(self) -> None:
+        index: Path = self.directory / self.INDEX
+        temporary: Path = self._temporary_path(self.INDEX)
+        with open(temporary, "w") as file:
+            json.dump([asdict(entry) for entry in self._entries.values()], file, indent=4)
+        os.replace(temporary, index)
+
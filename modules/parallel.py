@@ -0,0 +1,44 @@
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import multiprocessing
+import os
+from typing import Callable, Iterable, Iterator, TypeVar
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def default_jobs() -> int:
+    return max(len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1, 1)
+
+
+def create_pool(jobs: int) -> ProcessPoolExecutor | None:
+    # None for a single job, work then runs in the calling thread without pickling anything.
+    # Workers are spawned instead of forked since the updater already runs download threads
+    if jobs <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn"))
+
+
+def map_ordered(function: Callable[..., R], items: Iterable[tuple], executor: Executor | None = None, window: int | None = None) -> Iterator[R]:
+    # Like executor.map(function, *zip(*items)), but items are only taken from the iterable while fewer
+    # than window work units are in flight, so inputs (and results) never pile up in memory.
+    # Results are yielded in the order of items
+    if executor is None:
+        for item in items:
+            yield function(*item)
+        return
+
+    window = window or 2 * getattr(executor, "_max_workers", 1)
+    pending: deque[Future] = deque()
+    try:
+        for item in items:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(function, *item))
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
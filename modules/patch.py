@@ -0,0 +1,156 @@
+from dataclasses import dataclass
+import hashlib
+import logging
+import os
+from pathlib import Path
+import struct
+
+from modules.detection import Box, IconSource, ModdedIconData, read_icons
+from modules.hashing import sha256sum
+from modules.metrics import phase
+
+
+# Icon patch file, all integers little-endian:
+#   header  magic "SMUP", format version (u16), fileVersion (u32), sha256 of GetImageSetData.lua (32 bytes),
+#           fingerprint of the mod's imageSets (32 bytes), icon count (u32)
+#   index   per icon: name length (u16), size class length (u8), x, y, w, h (u32), data offset (u64),
+#           data length (u32), followed by the name and size class (UTF-8)
+#   data    per icon: zlib compressed RGBA pixels, offsets are relative to the start of the data section
+MAGIC: bytes = b"SMUP"
+FORMAT_VERSION: int = 1
+HEADER = struct.Struct("<4sHI32s32sI")
+INDEX_ENTRY = struct.Struct("<HB4IQI")
+PATCH_FILE: str = "icons.patch"
+
+
+class PatchError(Exception):
+    pass
+
+
+@dataclass
+class PatchEntry:
+    name: str
+    size: str
+    box: Box
+    source: IconSource  # The compressed pixels, read from the patch file only when needed
+
+
+class IconPatch:
+    # The modded icons of a mod, so later updates only need the target version's layout to paste them
+
+    fileVersion: int
+    imagesetdata_sha256: str
+    fingerprint: str
+    entries: list[PatchEntry]
+
+    def __init__(self, fileVersion: int, imagesetdata_sha256: str, fingerprint: str, entries: list[PatchEntry]) -> None:
+        self.fileVersion = fileVersion
+        self.imagesetdata_sha256 = imagesetdata_sha256
+        self.fingerprint = fingerprint
+        self.entries = entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def modded_icon_data(self) -> ModdedIconData:
+        modded_icon_data: ModdedIconData = {}
+        for entry in self.entries:
+            if entry.size not in modded_icon_data:
+                modded_icon_data[entry.size] = {}
+            modded_icon_data[entry.size][entry.name] = (entry.box, entry.source)
+        return modded_icon_data
+
+    @classmethod
+    def from_modded_icon_data(cls, modded_icon_data: ModdedIconData, fileVersion: int, imagesetdata_sha256: str, fingerprint: str) -> "IconPatch":
+        # The icons are already compressed, they are copied when the patch is written
+        entries: list[PatchEntry] = []
+        for size, icons in sorted(modded_icon_data.items()):
+            for name, (box, source) in sorted(icons.items()):
+                entries.append(PatchEntry(name, size, box, source))
+        return cls(fileVersion, imagesetdata_sha256, fingerprint, entries)
+
+    @classmethod
+    def read(cls, path: Path) -> "IconPatch":
+        # Only the header and the index are read
+        with open(path, "rb") as file:
+            try:
+                magic, format_version, fileVersion, imagesetdata_sha256, fingerprint, count = HEADER.unpack(file.read(HEADER.size))
+                if magic != MAGIC:
+                    raise PatchError(f"Not an icon patch: {path}")
+                if format_version != FORMAT_VERSION:
+                    raise PatchError(f"Unsupported icon patch format version {format_version}: {path}")
+
+                index: list[tuple[str, str, Box, int, int]] = []
+                for _ in range(count):
+                    name_length, size_length, x, y, w, h, offset, length = INDEX_ENTRY.unpack(file.read(INDEX_ENTRY.size))
+                    name_data: bytes = file.read(name_length)
+                    size_data: bytes = file.read(size_length)
+                    if len(name_data) != name_length or len(size_data) != size_length:
+                        raise PatchError(f"Corrupted icon patch: {path} (truncated)")
+                    index.append((name_data.decode("utf-8"), size_data.decode("utf-8"), (x, y, x + w, y + h), offset, length))
+            except (struct.error, UnicodeDecodeError) as e:
+                raise PatchError(f"Corrupted icon patch: {path} ({e})")
+            body_offset: int = file.tell()
+            body_size: int = os.fstat(file.fileno()).st_size - body_offset
+
+        if any(offset + length > body_size for _, _, _, offset, length in index):
+            raise PatchError(f"Corrupted icon patch: {path} (truncated)")
+        entries: list[PatchEntry] = [PatchEntry(name, size, box, IconSource(box, path=path, offset=body_offset + offset, length=length)) for name, size, box, offset, length in index]
+        return cls(fileVersion, imagesetdata_sha256.hex(), fingerprint.hex(), entries)
+
+    def write(self, path: Path) -> None:
+        # The icon data is copied one icon at a time, path may be the file the patch was read from
+        index: list[bytes] = []
+        offset: int = 0
+        for entry in self.entries:
+            x0, y0, x1, y1 = entry.box
+            name: bytes = entry.name.encode("utf-8")
+            size: bytes = entry.size.encode("utf-8")
+            index.append(INDEX_ENTRY.pack(len(name), len(size), x0, y0, x1 - x0, y1 - y0, offset, entry.source.size) + name + size)
+            offset += entry.source.size
+        header: bytes = HEADER.pack(MAGIC, FORMAT_VERSION, self.fileVersion, bytes.fromhex(self.imagesetdata_sha256), bytes.fromhex(self.fingerprint), len(self.entries))
+
+        temporary: Path = path.with_name(f".{path.name}.tmp")
+        try:
+            with open(temporary, "wb") as file:
+                file.write(header)
+                file.write(b"".join(index))
+                for data in read_icons(entry.source for entry in self.entries):
+                    file.write(data)
+            os.replace(temporary, path)
+        finally:
+            temporary.unlink(missing_ok=True)
+
+
+def imageset_fingerprint(directory: Path) -> str:
+    # Changes whenever a file in the imageSet directory is added, removed or edited
+    h = hashlib.sha256()
+    with phase("hash"):
+        for file in sorted(directory.iterdir()):
+            if file.is_file():
+                h.update(f"{file.name}\0{sha256sum(file)}\0".encode("utf-8"))
+    return h.hexdigest()
+
+
+def read_patch(path: Path, fileVersion: int) -> IconPatch | None:
+    # The patch, if there is one for fileVersion. Only its header and index are read,
+    # whether it still describes the mod's imageSets is checked by patch_matches
+    if not path.exists():
+        return None
+    try:
+        patch: IconPatch = IconPatch.read(path)
+    except PatchError as e:
+        logging.warning(f"Ignoring icon patch: {e}")
+        return None
+    if patch.fileVersion != fileVersion:
+        logging.warning(f"Ignoring icon patch: made for version {patch.fileVersion}, mod version is {fileVersion}")
+        return None
+    return patch
+
+
+def patch_matches(patch: IconPatch, imageset_directory: Path) -> bool:
+    # Hashes every file of the mod's imageSets, only needed once the modded icons are
+    if patch.fingerprint != imageset_fingerprint(imageset_directory):
+        logging.warning("Ignoring icon patch: the mod's imageSets changed since it was made")
+        return False
+    return True
@@ -0,0 +1,10 @@
+import os
+from pathlib import Path
+
+
+def cache_directory() -> Path:
+    path: str | None = os.environ.get("SOBER_MOD_UPDATER_CACHE")
+    if path:
+        return Path(path).expanduser().resolve()
+    xdg_cache_home: str = os.environ.get("XDG_CACHE_HOME") or "~/.cache"
+    return Path(xdg_cache_home, "sober-mod-updater").expanduser().resolve()
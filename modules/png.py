@@ -0,0 +1,29 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+# Pillow save options of each mode
+PNG_MODES: dict[str, dict] = {
+    "fast": {"compress_level": 1},  # Faster, larger files, for iterating on a mod
+    "default": {"compress_level": 6},  # Pillow's default
+    "max": {"optimize": True},  # Smallest files, slowest, for releases
+}
+
+
+@dataclass(frozen=True)
+class PngEncoder:
+    # How updated imageSets are written. Without a process pool, threads > 0 paints and encodes imageSets
+    # on that many threads instead of the calling thread, zlib releases the GIL while it compresses
+    mode: str = "default"
+    threads: int = 0
+
+    def __post_init__(self) -> None:
+        if self.mode not in PNG_MODES:
+            raise ValueError(f"Unknown PNG mode '{self.mode}', expected one of {', '.join(PNG_MODES)}")
+
+    def save(self, image: "Image.Image", target: Path | BinaryIO) -> None:
+        image.save(target, format="PNG", **PNG_MODES[self.mode])
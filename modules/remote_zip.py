@@ -0,0 +1,199 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+import logging
+import struct
+import threading
+from typing import Iterable, TYPE_CHECKING
+import zlib
+
+from modules.downloader import DownloadError, create_session, fetch_range
+
+if TYPE_CHECKING:
+    import requests
+
+
+# https://pkware.cachefly.net/webdocs/casestudies/APPNOTE.TXT
+EOCD_SIGNATURE: bytes = b"PK\x05\x06"
+EOCD_SIZE: int = 22
+ZIP64_LOCATOR_SIGNATURE: bytes = b"PK\x06\x07"
+ZIP64_LOCATOR_SIZE: int = 20
+ZIP64_EOCD_SIGNATURE: bytes = b"PK\x06\x06"
+CENTRAL_DIRECTORY_SIGNATURE: bytes = b"PK\x01\x02"
+LOCAL_HEADER_SIGNATURE: bytes = b"PK\x03\x04"
+LOCAL_HEADER_SIZE: int = 30
+MAX_COMMENT_SIZE: int = 0xFFFF
+
+STORED: int = 0
+DEFLATED: int = 8
+
+# Members closer together than this are fetched with a single request
+MERGE_GAP: int = 256 * 1024
+
+
+@dataclass
+class RemoteZipInfo:
+    filename: str
+    compress_type: int
+    compress_size: int
+    file_size: int
+    CRC: int
+    header_offset: int
+
+
+class RemoteZip:
+    # Read-only ZipFile look-alike that only downloads the members it needs using HTTP Range requests.
+    # fetch() downloads several members in as few requests as possible, read() fetches a member on its own if needed
+
+    url: str
+    transferred: int
+    _session: "requests.Session"
+    _infos: dict[str, RemoteZipInfo]
+    _raw: dict[str, bytes]
+    _central_directory_offset: int
+    _lock: threading.Lock
+
+    def __init__(self, url: str, session: "requests.Session | None" = None) -> None:
+        self.url = url
+        self.transferred = 0
+        self._lock = threading.Lock()
+        self._session = session or create_session(4)
+        self._raw = {}
+        self._infos = {}
+        self._read_central_directory()
+
+    def __enter__(self) -> "RemoteZip":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._raw.clear()
+
+    def namelist(self) -> list[str]:
+        return list(self._infos.keys())
+
+    def getinfo(self, name: str) -> RemoteZipInfo:
+        info: RemoteZipInfo | None = self._infos.get(name)
+        if info is None:
+            raise KeyError(f"There is no item named '{name}' in the archive")
+        return info
+
+    def fetch(self, names: Iterable[str]) -> None:
+        infos: list[RemoteZipInfo] = sorted((self.getinfo(name) for name in names if name not in self._raw), key=lambda info: info.header_offset)
+        if not infos:
+            return
+
+        # A member ends where the next one (or the central directory) starts
+        offsets: list[int] = sorted({info.header_offset for info in self._infos.values()} | {self._central_directory_offset})
+        next_offset: dict[int, int] = dict(zip(offsets, offsets[1:]))
+
+        groups: list[list[RemoteZipInfo]] = []
+        ranges: list[tuple[int, int]] = []
+        for info in infos:
+            start: int = info.header_offset
+            end: int = next_offset.get(start, self._central_directory_offset)
+            if ranges and start - ranges[-1][1] <= MERGE_GAP:
+                ranges[-1] = (ranges[-1][0], end)
+                groups[-1].append(info)
+            else:
+                ranges.append((start, end))
+                groups.append([info])
+
+        with ThreadPoolExecutor(max_workers=min(len(ranges), 4), thread_name_prefix="remote-zip") as executor:
+            chunks: list[bytes] = list(executor.map(lambda item: self._get(item[0], item[1] - 1), ranges))
+
+        for (start, end), group, chunk in zip(ranges, groups, chunks):
+            for info in group:
+                local_start: int = info.header_offset - start
+                local_end: int = next_offset.get(info.header_offset, self._central_directory_offset) - start
+                self._raw[info.filename] = chunk[local_start:local_end]
+
+    def read(self, name: str) -> bytes:
+        info: RemoteZipInfo = self.getinfo(name)
+        if name not in self._raw:
+            self.fetch([name])
+        raw: bytes = self._raw[name]
+
+        if raw[:4] != LOCAL_HEADER_SIGNATURE:
+            raise ValueError(f"Bad local file header for '{name}'")
+        name_length, extra_length = struct.unpack("<HH", raw[26:30])
+        data_start: int = LOCAL_HEADER_SIZE + name_length + extra_length
+        compressed: bytes = raw[data_start:data_start + info.compress_size]
+
+        if info.compress_type == STORED:
+            data: bytes = compressed
+        elif info.compress_type == DEFLATED:
+            data = zlib.decompress(compressed, -15)
+        else:
+            raise NotImplementedError(f"Unsupported compression method {info.compress_type} for '{name}'")
+
+        if len(data) != info.file_size or zlib.crc32(data) != info.CRC:
+            raise ValueError(f"Bad CRC-32 for '{name}'")
+        return data
+
+    def open(self, name: str, mode: str = "r") -> BytesIO:
+        if mode != "r":
+            raise ValueError("RemoteZip is read-only")
+        return BytesIO(self.read(name))
+
+    def _get(self, start: int, end: int | None = None) -> bytes:
+        data: bytes = fetch_range(self.url, start, end, self._session)
+        if end is not None and start >= 0 and len(data) != end - start + 1:
+            raise DownloadError(self.url, f"Incomplete range response ({len(data)}/{end - start + 1} bytes)")
+        with self._lock:
+            self.transferred += len(data)
+        return data
+
+    def _read_central_directory(self) -> None:
+        tail: bytes = self._get(-(EOCD_SIZE + MAX_COMMENT_SIZE + ZIP64_LOCATOR_SIZE))
+        eocd_position: int = tail.rfind(EOCD_SIGNATURE)
+        if eocd_position < 0:
+            raise ValueError(f"Not a zip file: {self.url}")
+
+        (_, _, _, _, entry_count, directory_size, directory_offset, _) = struct.unpack("<4s4H2LH", tail[eocd_position:eocd_position + EOCD_SIZE])
+
+        locator_position: int = eocd_position - ZIP64_LOCATOR_SIZE
+        if locator_position >= 0 and tail[locator_position:locator_position + 4] == ZIP64_LOCATOR_SIGNATURE:
+            (_, _, zip64_eocd_offset, _) = struct.unpack("<4sLQL", tail[locator_position:eocd_position])
+            zip64_eocd: bytes = self._get(zip64_eocd_offset, zip64_eocd_offset + 55)
+            if zip64_eocd[:4] != ZIP64_EOCD_SIGNATURE:
+                raise ValueError(f"Bad ZIP64 end of central directory: {self.url}")
+            (entry_count, directory_size, directory_offset) = struct.unpack("<QQQ", zip64_eocd[32:56])
+
+        self._central_directory_offset = directory_offset
+        directory: bytes = self._get(directory_offset, directory_offset + directory_size - 1) if directory_size else b""
+        logging.info(f"GET {self.url} -> Central directory: {entry_count} members ({len(directory) / 1024:.2f} KB)")
+
+        position: int = 0
+        while position + 46 <= len(directory):
+            (signature, _, _, flags, compress_type, _, _, crc, compress_size, file_size, name_length, extra_length, comment_length, _, _, _, header_offset) = struct.unpack("<4s6H3L5H2L", directory[position:position + 46])
+            if signature != CENTRAL_DIRECTORY_SIGNATURE:
+                raise ValueError(f"Bad central directory entry: {self.url}")
+            name_bytes: bytes = directory[position + 46:position + 46 + name_length]
+            extra: bytes = directory[position + 46 + name_length:position + 46 + name_length + extra_length]
+            filename: str = name_bytes.decode("utf-8" if flags & 0x800 else "cp437")
+
+            if 0xFFFFFFFF in (compress_size, file_size, header_offset):
+                file_size, compress_size, header_offset = _read_zip64_extra(extra, file_size, compress_size, header_offset)
+
+            self._infos[filename] = RemoteZipInfo(filename, compress_type, compress_size, file_size, crc, header_offset)
+            position += 46 + name_length + extra_length + comment_length
+
+
+def _read_zip64_extra(extra: bytes, file_size: int, compress_size: int, header_offset: int) -> tuple[int, int, int]:
+    position: int = 0
+    while position + 4 <= len(extra):
+        header_id, size = struct.unpack("<HH", extra[position:position + 4])
+        if header_id == 0x0001:
+            values: list[int] = [value for (value,) in struct.iter_unpack("<Q", extra[position + 4:position + 4 + size - size % 8])]
+            if file_size == 0xFFFFFFFF:
+                file_size = values.pop(0)
+            if compress_size == 0xFFFFFFFF:
+                compress_size = values.pop(0)
+            if header_offset == 0xFFFFFFFF:
+                header_offset = values.pop(0)
+            break
+        position += 4 + size
+    return file_size, compress_size, header_offset
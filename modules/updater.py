@@ -0,0 +1,625 @@
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import logging
+from pathlib import Path, PurePosixPath
+import shutil
+import threading
+import time
+from typing import Iterator, TYPE_CHECKING
+from zipfile import BadZipFile
+
+from modules.deployments import DeployHistory, DeployHistoryError, Deployment
+from modules.detection import Box, IconSource, ModdedIconData, detect_modded_icons, detect_modded_icons_by_hash, hash_imageset, load_icons, open_image
+from modules.downloader import DownloadError, create_session
+from modules.hashing import sha256sum
+from modules.icon_index import IconIndex, RemapStats
+from modules.icon_manifest import IconManifest, build_manifest, load_manifest, save_manifest
+from modules.imagesets import Icon, ImageSet, Layout, get_imagesetdata, get_imageset_members, get_layout
+from modules.layout_hashes import known_layout_hash, save_layout_hash
+from modules.metrics import count, phase
+from modules.mod import Mod
+from modules.package_cache import PackageCache
+from modules.parallel import map_ordered
+from modules.patch import PATCH_FILE, IconPatch, imageset_fingerprint, patch_matches, read_patch
+from modules.png import PngEncoder
+from modules.remote_zip import RemoteZip
+from modules.zip_fs import ZipFS, ZipPath
+
+if TYPE_CHECKING:
+    import requests
+
+
+PACKAGE: str = "extracontent-luapackages.zip"
+
+
+class UpdateError(Exception):
+    pass
+
+
+@dataclass
+class UpdateResult:
+    mod: Path
+    status: str  # "updated", "up-to-date", "unmodded" or "failed"
+    source_version: int | None
+    target_version: int
+    message: str = ""
+    modded_icons: int = 0
+    removed_imagesets: int = 0
+    duration: float = 0.0
+    output: Path | None = None  # The updated copy, if the mod wasn't updated in place
+    copied_imagesets: int = 0  # Layout and original unchanged, the mod's file was reused
+    repainted_imagesets: int = 0
+    renamed_icons: int = 0  # Modded icons found by the hash of their original pixels, see IconIndex.find_renamed
+    unmatched_icons: int = 0  # Modded icons that aren't in the target version
+
+
+@dataclass
+class SourceImageSet:
+    # An imageSet of the mod's version: its icons, and the hashes of the original icons if the original isn't available
+    imageset: ImageSet
+    hashes: list[bytes] | None = None
+
+
+@dataclass
+class Target:
+    # A target version's package, checked before anything is detected
+    version: int
+    package: "DeploymentPackage"
+    image_set_directory: PurePosixPath
+    imagesetdata_sha256: str
+
+
+class DeploymentPackage:
+    # A deployment's LuaPackages, opened once and shared by every mod that needs it
+
+    deployment: Deployment
+    fs: ZipFS
+    _hashes: dict[PurePosixPath, str]
+    _indexes: dict[PurePosixPath, IconIndex]
+    _lock: threading.Lock
+    _index_lock: threading.Lock
+
+    def __init__(self, deployment: Deployment, fs: ZipFS) -> None:
+        self.deployment = deployment
+        self.fs = fs
+        self._hashes = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+
+    def imagesetdata_file(self, image_set_directory: PurePosixPath) -> ZipPath:
+        return self.fs.imagesetdata_file(image_set_directory)
+
+    def imagesetdata_hash(self, image_set_directory: PurePosixPath) -> str:
+        with self._lock:
+            sha256: str | None = self._hashes.get(image_set_directory)
+            if sha256 is None:
+                with phase("hash"):
+                    sha256 = sha256sum(self.imagesetdata_file(image_set_directory))
+                self._hashes[image_set_directory] = sha256
+                save_layout_hash(self.deployment, sha256)
+            return sha256
+
+    def imagesetdata(self, image_set_directory: PurePosixPath) -> list[ImageSet]:
+        return get_imagesetdata(self.imagesetdata_file(image_set_directory), self.fs.path(image_set_directory), self.imagesetdata_hash(image_set_directory))
+
+    def icon_index(self, image_set_directory: PurePosixPath, executor: Executor | None = None, hashes: bool = False) -> IconIndex:
+        # With hashes, the hashes of the original icons are added from the deployment's icon manifest,
+        # which is built and saved first if there is none
+        with self._index_lock:
+            sha256: str = self.imagesetdata_hash(image_set_directory)
+            index: IconIndex | None = self._indexes.get(image_set_directory)
+            if index is None:
+                index = IconIndex(get_layout(self.imagesetdata_file(image_set_directory), sha256))
+                self._indexes[image_set_directory] = index
+            if hashes and not index.has_hashes:
+                manifest: IconManifest | None = load_manifest(self.deployment.fileVersion)
+                if manifest is None or manifest.imagesetdata_sha256 != sha256 or manifest.image_set_directory != image_set_directory.as_posix():
+                    logging.info(f"Building icon manifest of version {self.deployment.fileVersion}...")
+                    manifest = self.manifest(executor)
+                    save_manifest(manifest)
+                index.add_hashes(manifest)
+            return index
+
+    def manifest(self, executor: Executor | None = None) -> IconManifest:
+        # Raises UpdateError if the package has no imageSets
+        image_set_directory: PurePosixPath | None = self.fs.find_image_set_directory()
+        if image_set_directory is None or not self.imagesetdata_file(image_set_directory).exists():
+            raise UpdateError(f"imageSets or GetImageSetData.lua not found in version {self.deployment.fileVersion}")
+        sha256: str = self.imagesetdata_hash(image_set_directory)
+        layout: Layout = get_layout(self.imagesetdata_file(image_set_directory), sha256)
+        return build_manifest(self.deployment.fileVersion, image_set_directory.as_posix(), sha256, layout, self.fs.path(image_set_directory), executor)
+
+
+class PackageStore:
+    # Downloads and opens each deployment's package at most once, even when requested from several threads
+
+    cache: PackageCache | None
+    partial: bool
+    download_dir: Path
+    _session: "requests.Session | None"  # Created when the first package is downloaded
+    _packages: dict[int, Future]
+    _lock: threading.Lock
+
+    def __init__(self, cache: PackageCache | None, download_dir: Path, partial: bool = False) -> None:
+        self.cache = cache
+        self.partial = partial
+        self.download_dir = download_dir
+        self._session = None
+        self._packages = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "PackageStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            for future in self._packages.values():
+                if future.done() and future.exception() is None:
+                    future.result().fs.close()
+            self._packages.clear()
+
+    def get(self, fileVersion: int) -> DeploymentPackage:
+        with self._lock:
+            future: Future | None = self._packages.get(fileVersion)
+            owner: bool = future is None
+            if owner:
+                future = Future()
+                self._packages[fileVersion] = future
+
+        if owner:
+            try:
+                future.set_result(self._open(fileVersion))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def release(self, fileVersion: int) -> None:
+        # Closes a package that is no longer needed
+        with self._lock:
+            future: Future | None = self._packages.pop(fileVersion, None)
+        if future is not None and future.done() and future.exception() is None:
+            future.result().fs.close()
+
+    def prefetch(self, fileVersions: list[int]) -> None:
+        # Failures are reported when the package is requested with get()
+        with ThreadPoolExecutor(max_workers=max(len(fileVersions), 1), thread_name_prefix="download") as executor:
+            for future in [executor.submit(self.get, fileVersion) for fileVersion in fileVersions]:
+                future.exception()
+
+    def _get_session(self) -> "requests.Session":
+        with self._lock:
+            if self._session is None:
+                self._session = create_session(8)
+            return self._session
+
+    def _open(self, fileVersion: int) -> DeploymentPackage:
+        deployment: Deployment = DeployHistory.search(fileVersion)
+        try:
+            return self._open_package(deployment)
+        except (BadZipFile, ValueError) as e:  # A truncated download, or an error page instead of the package
+            raise DownloadError(deployment.package_url(PACKAGE), f"Not a valid package: {e}")
+
+    def _open_package(self, deployment: Deployment) -> DeploymentPackage:
+        if self.partial:
+            with phase("download"):
+                archive = RemoteZip(deployment.package_url(PACKAGE), self._get_session())
+                members: list[str] = get_imageset_members(archive.namelist())
+                archive.fetch(members)
+            logging.info(f"PARTIAL {archive.url} -> {len(members)} members ({archive.transferred / (1024 * 1024):.2f} MB transferred)")
+            with phase("extract"):
+                return DeploymentPackage(deployment, ZipFS(archive))
+
+        with phase("download"):
+            if self.cache is not None:
+                path: Path = self.cache.fetch(deployment, PACKAGE, self._get_session)
+            else:
+                path = self.download_dir / f"{deployment.version}-{PACKAGE}"
+                deployment.download_package(PACKAGE, path, self._get_session())
+        with phase("extract"):
+            return DeploymentPackage(deployment, ZipFS(path))
+
+
+def repaint_imagesets(imagesetdata: list[ImageSet], updated_icon_data: dict[str, list[tuple[Box, IconSource]]], output_directory: Path, executor: Executor | None = None, encoder: PngEncoder = PngEncoder()) -> int:
+    # Pastes the modded icons onto the new imageSets and returns the number of unmodded imageSets, which are left out.
+    # Every imageSet is a separate work unit that runs on executor if one is given, or on encoder.threads threads
+    if executor is None and encoder.threads > 0:
+        with ThreadPoolExecutor(max_workers=encoder.threads, thread_name_prefix="encode") as thread_executor:
+            return repaint_imagesets(imagesetdata, updated_icon_data, output_directory, thread_executor, encoder)
+
+    removed_imageset_count: int = 0
+
+    def work_units() -> Iterator[tuple]:
+        nonlocal removed_imageset_count
+        for imageset in imagesetdata:
+            modded_icons: list[tuple[Box, IconSource]] | None = updated_icon_data.get(imageset.name)
+            if modded_icons is None:  # Remove unmodded imageSets
+                # logging.warning(f"Removing unmodded imageSet: '{imageset.name}'")
+                removed_imageset_count += 1
+                continue
+            original: Path | bytes | ZipPath = imageset.path
+            if executor is not None and not isinstance(original, Path):
+                original = original.read_bytes()
+            yield (original, modded_icons, output_directory / imageset.path.name, encoder)
+
+    for _ in map_ordered(repaint_imageset, work_units(), executor):
+        pass
+    return removed_imageset_count
+
+
+def repaint_imageset(original: "Path | bytes | ZipPath", modded_icons: list[tuple[Box, IconSource]], target: Path, encoder: PngEncoder = PngEncoder()) -> None:
+    # Only the icons this imageSet needs are loaded, everything is freed once it is written
+    with open_image(original) as new_image:
+        if new_image.mode != "RGBA":
+            new_image = new_image.convert("RGBA")
+
+        for (box, _), icon in zip(modded_icons, load_icons([source for _, source in modded_icons])):
+            new_image.paste(icon, box)
+
+        encoder.save(new_image, target)
+
+
+def find_unchanged_imagesets(imagesetdata: list[ImageSet], updated_icon_data: dict[str, list[tuple[Box, IconSource]]], source_imagesets: dict[str, SourceImageSet], executor: Executor | None = None) -> set[str]:
+    # Names of the modded imageSets whose icons are at the same positions as in the mod's version and whose
+    # original icons didn't change either, the mod's own files are already up to date for those.
+    # Only imageSets with the same icon table are compared, every comparison is a work unit that runs on executor
+    candidates: list[tuple[ImageSet, SourceImageSet]] = []
+    for imageset in imagesetdata:
+        source: SourceImageSet | None = source_imagesets.get(imageset.name)
+        if imageset.name not in updated_icon_data or source is None:
+            continue
+        if [(icon.name, icon.box) for icon in source.imageset.icons] == [(icon.name, icon.box) for icon in imageset.icons]:
+            candidates.append((imageset, source))
+
+    def work_units() -> Iterator[tuple]:
+        for imageset, source in candidates:
+            original: Path | bytes | ZipPath = imageset.path
+            source_original: Path | bytes | ZipPath | list[bytes] = source.hashes if source.hashes is not None else source.imageset.path
+            if executor is not None:
+                if not isinstance(original, Path):
+                    original = original.read_bytes()
+                if isinstance(source_original, ZipPath):
+                    source_original = source_original.read_bytes()
+            yield (original, source_original, imageset.icons)
+
+    unchanged: set[str] = set()
+    for (imageset, _), is_unchanged in zip(candidates, map_ordered(original_unchanged, work_units(), executor)):
+        if is_unchanged:
+            unchanged.add(imageset.name)
+    return unchanged
+
+
+def original_unchanged(original: "Path | bytes | ZipPath", source: "Path | bytes | ZipPath | list[bytes]", icons: list[Icon]) -> bool:
+    # Whether the icons of an original imageSet are the same as in the mod's version,
+    # source is the mod version's original imageSet or the hashes of its icons
+    if not isinstance(original, bytes):
+        original = original.read_bytes()
+    if isinstance(source, list):
+        return hash_imageset(original, icons) == source
+    if not isinstance(source, bytes):
+        source = source.read_bytes()
+    return original == source or hash_imageset(original, icons) == hash_imageset(source, icons)
+
+
+def update_mod(mod: Mod, target_versions: list[int], store: PackageStore, temp_dir: Path, executor: Executor | None = None, use_patch: bool = True, use_manifest: bool = True, output_directory: Path | None = None, encoder: PngEncoder = PngEncoder()) -> list[UpdateResult]:
+    # One result per target version. A single target version updates the mod in place, with several target versions
+    # the mod is left untouched and an updated copy '<mod>.<version>' is written to output_directory (default: next to the mod).
+    # Modded icons are detected once for all targets: with a valid icon patch (see modules/patch.py) they are taken from
+    # the patch, with an icon manifest of the mod's version (see modules/icon_manifest.py) its package isn't needed
+    start: float = time.perf_counter()
+    source_version: int = mod.fileVersion
+    in_place: bool = len(target_versions) == 1
+    output_directory = output_directory or mod.path.parent
+    results: dict[int, UpdateResult] = {}
+
+    def result(target_version: int, status: str, message: str = "", started: float = start, **kwargs) -> UpdateResult:
+        if status == "failed":
+            logging.error(f"Version {target_version}: {message}")
+        output: Path | None = None if in_place or status == "failed" else output_directory / f"{mod.name}.{target_version}"
+        return UpdateResult(mod.path, status, source_version, target_version, message, duration=time.perf_counter() - started, output=output, **kwargs)
+
+    if in_place and mod.fileVersion == target_versions[0]:
+        return [result(target_versions[0], "up-to-date", "Mod version and target version are the same!")]
+
+    mod_imagesets: Path = mod.luapackages / mod.image_set_directory
+    # The patch is only checked against the mod's imageSets once modded icons are needed, a mod that isn't outdated
+    # keeps its patch as it is
+    patch: IconPatch | None = read_patch(mod.path / PATCH_FILE, mod.fileVersion) if use_patch else None
+
+    # Targets whose GetImageSetData.lua is known to be the same as the mod version's (see modules/layout_hashes.py)
+    # are handled before anything is downloaded
+    known_source_hash: str | None = known_layout_hash(mod.fileVersion)
+    if known_source_hash is None and patch is not None:
+        known_source_hash = patch.imagesetdata_sha256
+    if known_source_hash is not None:
+        for target_version in target_versions:
+            if known_layout_hash(target_version) == known_source_hash:
+                _apply_unchanged(mod, target_version, in_place, output_directory, patch)
+                results[target_version] = result(target_version, "up-to-date", "Unable to update mod: Mod is not outdated!")
+    pending_versions: list[int] = [target_version for target_version in target_versions if target_version not in results]
+    if not pending_versions:
+        return [results[target_version] for target_version in target_versions]
+
+    manifest: IconManifest | None = _load_source_manifest(mod) if patch is None and use_manifest else None
+
+    logging.info("Downloading LuaPackages...")
+    source_needed: bool = patch is None and manifest is None
+    store.prefetch(([mod.fileVersion] if source_needed else []) + pending_versions)
+
+    targets: list[Target] = []
+    for target_version in pending_versions:
+        try:
+            targets.append(_open_target(store, target_version))
+        except UpdateError as e:
+            results[target_version] = result(target_version, "failed", str(e))
+
+    if patch is not None:
+        source_imagesetdata_hash: str = patch.imagesetdata_sha256
+    elif manifest is not None:
+        source_imagesetdata_hash = manifest.imagesetdata_sha256
+    else:
+        mod_package, mod_image_set_directory = _open_source(store, mod)
+        source_imagesetdata_hash = mod_package.imagesetdata_hash(mod_image_set_directory)
+
+    logging.info("Comparing file hashes...")
+    outdated: list[Target] = []
+    for target in targets:
+        if target.imagesetdata_sha256 != source_imagesetdata_hash:
+            outdated.append(target)
+            continue
+        _apply_unchanged(mod, target.version, in_place, output_directory, patch)
+        results[target.version] = result(target.version, "up-to-date", "Unable to update mod: Mod is not outdated!")
+
+    if outdated:
+        # The mod version's imageSets, to find imageSets that didn't change. A patch has no layout, the manifest is used if there is one
+        source_imagesets: dict[str, SourceImageSet] = {}
+        detect_start: float = time.perf_counter()
+        if patch is not None and not patch_matches(patch, mod_imagesets):
+            patch = None
+            manifest = _load_source_manifest(mod) if use_manifest else None
+        if patch is not None:
+            logging.info(f"Using icon patch: {len(patch)} modded icons")
+            modded_icon_data: ModdedIconData = patch.modded_icon_data()
+            mod_imageset_files: Path = mod_imagesets
+            manifest = load_manifest(mod.fileVersion) if use_manifest else None
+            if manifest is not None and manifest.imagesetdata_sha256 == patch.imagesetdata_sha256:
+                source_imagesets = {imageset.name: SourceImageSet(imageset, hashes) for imageset, hashes in manifest.imagesets(mod_imagesets)}
+        elif manifest is not None:
+            mod_imagesets_copy: Path = _copy_mod_imagesets(mod_imagesets, temp_dir)
+            logging.info("Detecting modded icons...")
+            manifest_imagesets: list[tuple[ImageSet, list[bytes]]] = manifest.imagesets(mod_imagesets_copy)
+            with phase("detect"):
+                modded_icon_data = detect_modded_icons_by_hash(manifest_imagesets, mod_imagesets_copy, executor, temp_dir / "modded_icons")
+            mod_imageset_files = mod_imagesets_copy
+            source_imagesets = {imageset.name: SourceImageSet(imageset, hashes) for imageset, hashes in manifest_imagesets}
+        else:
+            mod_package, mod_image_set_directory = _open_source(store, mod)
+            logging.info("Parsing data...")
+            mod_imagesetdata: list[ImageSet] = mod_package.imagesetdata(mod_image_set_directory)
+
+            mod_imagesets_copy = _copy_mod_imagesets(mod_imagesets, temp_dir)
+            logging.info("Detecting modded icons...")
+            with phase("detect"):
+                modded_icon_data = detect_modded_icons(mod_imagesetdata, mod_imagesets_copy, executor=executor, icon_file=temp_dir / "modded_icons")
+            mod_imageset_files = mod_imagesets_copy
+            source_imagesets = {imageset.name: SourceImageSet(imageset) for imageset in mod_imagesetdata}
+        modded_icon_count: int = sum(len(icons) for icons in modded_icon_data.values())
+        count("modded_icons", modded_icon_count)
+        logging.info(f"{modded_icon_count} modded icons detected ({(time.perf_counter() - detect_start) * 1000:.2f}ms)")
+
+        if modded_icon_count == 0:
+            for target in outdated:
+                _apply_unchanged(mod, target.version, in_place, output_directory, None)
+                results[target.version] = result(target.version, "unmodded", "Unable to update mod: No modded icons detected!")
+        else:
+            # Targets are painted concurrently, but applied one at a time
+            def paint(target: Target) -> tuple[float, Path, ModdedIconData, int, int, int, RemapStats]:
+                started: float = time.perf_counter()
+                target_dir: Path = temp_dir / f"target-{target.version}"
+                target_dir.mkdir()
+                return (started, *_paint_target(target, modded_icon_data, source_imagesets, mod_imageset_files, target_dir, executor, encoder))
+
+            with ThreadPoolExecutor(max_workers=len(outdated), thread_name_prefix="paint") as paint_executor:
+                futures = [paint_executor.submit(paint, target) for target in outdated]
+                for target, future in zip(outdated, futures):
+                    try:
+                        started, updated_imagesets, updated_patch_data, removed_imageset_count, copied_imageset_count, repainted_imageset_count, remap_stats = future.result()
+                        _apply_updated(mod, target, updated_imagesets, updated_patch_data, in_place, output_directory)
+                    except UpdateError as e:
+                        results[target.version] = result(target.version, "failed", str(e))
+                        continue
+                    painted_icon_count: int = sum(len(icons) for icons in updated_patch_data.values())
+                    results[target.version] = result(target.version, "updated", started=started, modded_icons=painted_icon_count, removed_imagesets=removed_imageset_count, copied_imagesets=copied_imageset_count, repainted_imagesets=repainted_imageset_count, renamed_icons=remap_stats.by_hash, unmatched_icons=remap_stats.unmatched)
+                    logging.info(f"Version {target.version}: updated in {results[target.version].duration * 1000:.2f}ms")
+
+    return [results[target_version] for target_version in target_versions]
+
+
+def _load_source_manifest(mod: Mod) -> IconManifest | None:
+    manifest: IconManifest | None = load_manifest(mod.fileVersion)
+    if manifest is not None and manifest.image_set_directory != mod.image_set_directory.as_posix():
+        logging.warning(f"Ignoring icon manifest: imageSets are in '{manifest.image_set_directory}' in version {mod.fileVersion}")
+        return None
+    if manifest is not None:
+        logging.info(f"Using icon manifest of version {mod.fileVersion}")
+    return manifest
+
+
+def _open_source(store: PackageStore, mod: Mod) -> tuple[DeploymentPackage, PurePosixPath]:
+    # The mod version's package, when neither an icon patch nor an icon manifest can be used
+    try:
+        mod_package: DeploymentPackage = store.get(mod.fileVersion)
+    except (DownloadError, DeployHistoryError) as e:
+        raise UpdateError(f"DOWNLOAD {e.url} -> {e}" if isinstance(e, DownloadError) else str(e))
+    mod_image_set_directory = PurePosixPath(mod.image_set_directory.as_posix())
+    if not mod_package.imagesetdata_file(mod_image_set_directory).exists():
+        raise UpdateError(f"Unable to update mod: GetImageSetData.lua not found in mod version ({mod.fileVersion})")
+    return mod_package, mod_image_set_directory
+
+
+def _copy_mod_imagesets(mod_imagesets: Path, temp_dir: Path) -> Path:
+    # Only once modded icons are detected, a mod that isn't outdated or has an icon patch doesn't need a copy
+    mod_imagesets_copy: Path = temp_dir / "mod_imagesets"
+    logging.info("Copying mod imageSets...")
+    with phase("extract"):
+        shutil.copytree(mod_imagesets, mod_imagesets_copy)
+    return mod_imagesets_copy
+
+
+def _open_target(store: PackageStore, target_version: int) -> Target:
+    try:
+        package: DeploymentPackage = store.get(target_version)
+    except DownloadError as e:
+        raise UpdateError(f"DOWNLOAD {e.url} -> {e}")
+    except DeployHistoryError as e:
+        raise UpdateError(str(e))
+
+    image_set_directory: PurePosixPath | None = package.fs.find_image_set_directory()
+    if image_set_directory is None:
+        raise UpdateError(f"Unable to update mod: imageSets not found in target version ({target_version})")
+
+    logging.info("Checking for GetImageSetData.lua")
+    if not package.imagesetdata_file(image_set_directory).exists():
+        raise UpdateError(f"Unable to update mod: GetImageSetData.lua not found in target version ({target_version})")
+    return Target(target_version, package, image_set_directory, package.imagesetdata_hash(image_set_directory))
+
+
+def _paint_target(target: Target, modded_icon_data: ModdedIconData, source_imagesets: dict[str, SourceImageSet], mod_imageset_files: Path, temp_dir: Path, executor: Executor | None, encoder: PngEncoder) -> tuple[Path, ModdedIconData, int, int, int, RemapStats]:
+    # The updated imageSet directory, the modded icons at their new positions, the number of removed, copied and repainted imageSets
+    # and how the modded icons were found.
+    # Modded imageSets that didn't change since the mod's version are copied from the mod, only the others are repainted
+    logging.info(f"Parsing data... ({target.version})")
+    target_imagesetdata: list[ImageSet] = target.package.imagesetdata(target.image_set_directory)
+
+    logging.info(f"Detecting new icon positions... ({target.version})")
+    with phase("remap"):
+        updated_icon_data, updated_patch_data, remap_stats = _remap_icons(target, modded_icon_data, source_imagesets, executor)
+    logging.info(f"{remap_stats.by_name} modded icons matched by name, {remap_stats.by_hash} by hash, {remap_stats.unmatched} unmatched ({target.version})")
+    count("icons_matched_by_name", remap_stats.by_name)
+    count("icons_matched_by_hash", remap_stats.by_hash)
+    count("icons_unmatched", remap_stats.unmatched)
+
+    if not updated_icon_data:
+        raise UpdateError("Failed to update mod: modded icons not found in new imageSets!")
+
+    logging.info(f"Updating new imageSets... ({target.version})")
+    updated_imagesets: Path = temp_dir / "updated_imagesets"
+    updated_imagesets.mkdir()
+    imageset_names: set[str] = {imageset.name for imageset in target_imagesetdata}
+    for file in target.package.fs.iterdir(target.image_set_directory):
+        if file.stem not in imageset_names:  # Not an imageSet, keep it as is
+            (updated_imagesets / file.name).write_bytes(file.read_bytes())
+
+    unchanged: set[str] = set()
+    with phase("repaint"):
+        if source_imagesets:
+            logging.info(f"Comparing imageSet layouts... ({target.version})")
+            unchanged = {name for name in find_unchanged_imagesets(target_imagesetdata, updated_icon_data, source_imagesets, executor) if (mod_imageset_files / f"{name}.png").is_file()}
+            for name in unchanged:
+                shutil.copyfile(mod_imageset_files / f"{name}.png", updated_imagesets / f"{name}.png")
+
+        removed_imageset_count: int = repaint_imagesets([imageset for imageset in target_imagesetdata if imageset.name not in unchanged], updated_icon_data, updated_imagesets, executor, encoder)
+    repainted_imageset_count: int = len(updated_icon_data) - len(unchanged)
+    count("imagesets_removed", removed_imageset_count)
+    count("imagesets_copied", len(unchanged))
+    count("imagesets_repainted", repainted_imageset_count)
+
+    logging.info(f"Done! ({target.version})")
+    logging.info(f"{len(unchanged)} imageSets copied unchanged, {repainted_imageset_count} repainted ({target.version})")
+    logging.warning(f"Removed {removed_imageset_count} unmodded imageSets")
+    return updated_imagesets, updated_patch_data, removed_imageset_count, len(unchanged), repainted_imageset_count, remap_stats
+
+
+def _remap_icons(target: Target, modded_icon_data: ModdedIconData, source_imagesets: dict[str, SourceImageSet], executor: Executor | None) -> tuple[dict[str, list[tuple[Box, IconSource]]], ModdedIconData, RemapStats]:
+    # The modded icons at their positions in the target version, by imageSet name and by size class.
+    # Icons are found by name, renamed icons by the hash of their original pixels (see IconIndex.find_renamed),
+    # which needs the original icons of the mod's version: its package or its icon manifest
+    index: IconIndex = target.package.icon_index(target.image_set_directory)
+    missing: list[tuple[str, str]] = [(size, name) for size, icons in modded_icon_data.items() for name in icons if index.get(size, name) is None]
+    renamed: dict[tuple[str, str], Icon] = {}
+    if missing and source_imagesets:
+        original_hashes: dict[tuple[str, str], bytes] = _original_hashes(missing, source_imagesets)
+        if original_hashes:
+            index = target.package.icon_index(target.image_set_directory, executor, hashes=True)
+            source_names: dict[str, set[str]] = {}
+            for source in source_imagesets.values():
+                source_names.setdefault(source.imageset.size, set()).update(icon.name for icon in source.imageset.icons)
+            renamed = index.find_renamed(original_hashes, source_names)
+
+    stats = RemapStats()
+    updated_icon_data: dict[str, list[tuple[Box, IconSource]]] = {}
+    updated_patch_data: ModdedIconData = {}
+    unmatched: list[str] = []
+    for size, icons in modded_icon_data.items():
+        for name, (_, source) in icons.items():
+            icon: Icon | None = index.get(size, name)
+            if icon is not None:
+                stats.by_name += 1
+            else:
+                icon = renamed.get((size, name))
+                if icon is None:
+                    stats.unmatched += 1
+                    unmatched.append(f"{name} ({size})")
+                    continue
+                stats.by_hash += 1
+            updated_icon_data.setdefault(icon.imageset, []).append((icon.box, source))
+            updated_patch_data.setdefault(size, {})[icon.name] = (icon.box, source)
+
+    if unmatched:
+        logging.warning(f"{len(unmatched)} modded icons not found in version {target.version}: {', '.join(unmatched[:10])}{', ...' if len(unmatched) > 10 else ''}")
+    return updated_icon_data, updated_patch_data, stats
+
+
+def _original_hashes(icons: list[tuple[str, str]], source_imagesets: dict[str, SourceImageSet]) -> dict[tuple[str, str], bytes]:
+    # (size class, name) -> hash of the original icon in the mod's version, from the icon manifest or the original imageSets
+    wanted: set[tuple[str, str]] = set(icons)
+    hashes: dict[tuple[str, str], bytes] = {}
+    for source in source_imagesets.values():
+        indices: list[int] = [index for index, icon in enumerate(source.imageset.icons) if (source.imageset.size, icon.name) in wanted]
+        if not indices:
+            continue
+        if source.hashes is not None:
+            values: list[bytes] = [source.hashes[index] for index in indices]
+        else:
+            values = hash_imageset(source.imageset.path, [source.imageset.icons[index] for index in indices])
+        for index, value in zip(indices, values):
+            hashes[(source.imageset.size, source.imageset.icons[index].name)] = value
+    return hashes
+
+
+def _apply_updated(mod: Mod, target: Target, updated_imagesets: Path, updated_patch_data: ModdedIconData, in_place: bool, output_directory: Path) -> None:
+    if in_place:
+        with phase("backup"):
+            mod.backup()
+        try:
+            with phase("update"):
+                mod.update(updated_imagesets, Path(target.image_set_directory), target.version)
+        except Exception as e:
+            logging.error(f"Failed to update mod files: {type(e).__name__}: {e}")
+            mod.restore_backup()
+            raise UpdateError(f"Failed to update mod, the backup was restored: {type(e).__name__}: {e}")
+        updated: Mod = mod
+    else:
+        with phase("update"):
+            updated = mod.export(output_directory / f"{mod.name}.{target.version}", updated_imagesets, Path(target.image_set_directory), target.version)
+
+    logging.info("Writing icon patch...")
+    fingerprint: str = imageset_fingerprint(updated.luapackages / updated.image_set_directory)
+    with phase("update"):
+        IconPatch.from_modded_icon_data(updated_patch_data, target.version, target.imagesetdata_sha256, fingerprint).write(updated.path / PATCH_FILE)
+
+
+def _apply_unchanged(mod: Mod, target_version: int, in_place: bool, output_directory: Path, patch: IconPatch | None) -> None:
+    # The mod works for target_version as it is
+    with phase("update"):
+        if in_place:
+            mod.update_info(target_version)
+            updated: Mod = mod
+        else:
+            updated = mod.export(output_directory / f"{mod.name}.{target_version}", mod.luapackages / mod.image_set_directory, mod.image_set_directory, target_version)
+        if patch is not None:
+            patch.fileVersion = target_version
+            patch.write(updated.path / PATCH_FILE)
@@ -0,0 +1,98 @@
+import logging
+from pathlib import PurePosixPath
+import threading
+from typing import Callable
+
+from modules.deployments import DeployHistory, DeployHistoryError
+from modules.imagesets import cache_layout
+from modules.updater import DeploymentPackage, PackageStore
+
+
+class Watcher:
+    # Polls DeployHistory for new Studio64 deployments and warms the package cache and the layout cache with them,
+    # so updating to a new version only has to wait for the update itself
+
+    store: PackageStore
+    interval: float
+    _known: dict[int, str]  # fileVersion -> version hash of the deployments seen so far
+    _pending: set[int]  # File versions that failed to warm, retried on the next poll
+    _latest: int  # Latest file version handed to on_new_version, or known at the start
+
+    def __init__(self, store: PackageStore, interval: float) -> None:
+        self.store = store
+        self.interval = interval
+        self._known = {}
+        self._pending = set()
+        self._latest = 0
+
+    def start(self) -> None:
+        # Everything already in DeployHistory is known, only the latest version is warmed. Refreshed first,
+        # otherwise deployments since the cached DeployHistory was saved would be taken for new ones on the first poll
+        try:
+            DeployHistory.refresh()
+        except DeployHistoryError as e:
+            logging.warning(f"{e}, starting from the cached DeployHistory")
+        self._known = {deployment.fileVersion: deployment.version for deployment in DeployHistory.history()}
+        self._latest = max(self._known, default=0)
+        if self._known:
+            self.warm(self._latest)
+
+    def poll(self) -> list[int]:
+        # New file versions, or file versions that were deployed again, in ascending order
+        try:
+            if not DeployHistory.refresh():
+                return []
+        except DeployHistoryError as e:
+            logging.warning(f"{e}, retrying in {self.interval:.0f}s")
+            return []
+
+        changed: list[int] = []
+        for deployment in DeployHistory.history():
+            if self._known.get(deployment.fileVersion) != deployment.version:
+                self._known[deployment.fileVersion] = deployment.version
+                changed.append(deployment.fileVersion)
+        return sorted(changed)
+
+    def warm(self, fileVersion: int) -> bool:
+        # Downloads the version's package into the package cache and parses its layout into the layout cache
+        try:
+            package: DeploymentPackage = self.store.get(fileVersion)
+            image_set_directory: PurePosixPath | None = package.fs.find_image_set_directory()
+            if image_set_directory is None or not package.imagesetdata_file(image_set_directory).exists():
+                logging.warning(f"Version {fileVersion}: imageSets or GetImageSetData.lua not found, nothing to parse")
+            elif cache_layout(package.imagesetdata_file(image_set_directory), package.imagesetdata_hash(image_set_directory)):
+                logging.info(f"Version {fileVersion}: layout parsed")
+        except Exception as e:  # Not only download errors: one bad package (corrupt zip, unreadable file) must not stop the watch
+            logging.error(f"Failed to prefetch version {fileVersion}: {e}")
+            self._pending.add(fileVersion)
+            return False
+        finally:
+            self.store.release(fileVersion)
+        self._pending.discard(fileVersion)
+        logging.info(f"Version {fileVersion}: ready")
+        return True
+
+    def run(self, on_new_version: Callable[[int], None] | None = None, stop: threading.Event | None = None) -> None:
+        # Until stop is set. on_new_version is called with the latest file version once it is warmed,
+        # if it is newer than every version known before
+        stop = stop or threading.Event()
+        self.start()
+        logging.info(f"Watching DeployHistory every {self.interval:.0f}s...")
+        while not stop.wait(self.interval):
+            retries: set[int] = set(self._pending)
+            for fileVersion in self.poll():
+                logging.info(f"New deployment: version {fileVersion}")
+                retries.discard(fileVersion)
+                self.warm(fileVersion)
+            for fileVersion in sorted(retries):
+                logging.info(f"Retrying version {fileVersion}")
+                self.warm(fileVersion)
+
+            latest: int = max(self._known, default=0)
+            if latest > self._latest and latest not in self._pending:
+                self._latest = latest
+                if on_new_version is not None:
+                    try:
+                        on_new_version(latest)
+                    except Exception as e:
+                        logging.error(f"Failed to update to version {latest}: {e}")
@@ -1,19 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
 from pathlib import Path
+import re
+import shutil
+from typing import Callable, IO, Iterable, Protocol
 from zipfile import ZipFile
 
 
-def extract(source: Path, destination: Path) -> None:
+BUFFER_SIZE: int = 1024 * 1024
+
+
+class Archive(Protocol):  # ZipFile, RemoteZip
+    def namelist(self) -> list[str]: ...
+    def open(self, name: str, mode: str = "r") -> IO[bytes]: ...
+
+
+# A glob or compiled regex matched against the normalized member name,
+# a predicate that receives the normalized member name, or a collection of member names
+MemberFilter = str | re.Pattern | Callable[[str], bool] | Iterable[str]
+
+
+def normalize(member: str) -> str:
+    return member.lstrip("\\/").replace("\\\\", "/").replace("\\", "/")
+
+
+def extract(source: Path | Archive, destination: Path, members: MemberFilter | None = None, workers: int = 1) -> int:
+    # Returns the number of extracted files
     destination.mkdir(parents=True, exist_ok=True)
 
-    with ZipFile(source, "r") as archive:
-        for member in archive.namelist():
-            normalized = member.lstrip("\\/").replace("\\\\", "/").replace("\\", "/")
-            if not normalized.strip():
-                continue
-            target: Path = destination / normalized
-            if normalized.endswith("/"):
-                target.mkdir(parents=True, exist_ok=True)
-            else:
-                target.parent.mkdir(parents=True, exist_ok=True)
-                with archive.open(member) as archived, open(target, "wb") as file:
-                    file.write(archived.read())
\ No newline at end of file
+    if isinstance(source, Path):
+        with ZipFile(source, "r") as archive:
+            return _extract(archive, destination, members, workers)
+    return _extract(source, destination, members, workers)
+
+
+def _extract(archive: Archive, destination: Path, members: MemberFilter | None, workers: int) -> int:
+    accept: Callable[[str, str], bool] = _get_filter(members)
+
+    directories: set[Path] = set()
+    files: list[tuple[str, Path]] = []
+    for member in archive.namelist():
+        normalized = normalize(member)
+        if not normalized.strip() or not accept(member, normalized):
+            continue
+        target: Path = destination / normalized
+        if normalized.endswith("/"):
+            directories.add(target)
+        else:
+            directories.add(target.parent)
+            files.append((member, target))
+
+    for directory in sorted(directories):
+        directory.mkdir(parents=True, exist_ok=True)
+
+    if workers > 1 and len(files) > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract") as executor:
+            for _ in executor.map(lambda item: _extract_member(archive, *item), files):
+                pass
+    else:
+        for member, target in files:
+            _extract_member(archive, member, target)
+    return len(files)
+
+
+def _extract_member(archive: Archive, member: str, target: Path) -> None:
+    with archive.open(member) as archived, open(target, "wb") as file:
+        shutil.copyfileobj(archived, file, BUFFER_SIZE)
+
+
+def _get_filter(members: MemberFilter | None) -> Callable[[str, str], bool]:
+    if members is None:
+        return lambda member, normalized: True
+    if isinstance(members, str):
+        return lambda member, normalized: fnmatchcase(normalized, members)
+    if isinstance(members, re.Pattern):
+        return lambda member, normalized: members.search(normalized) is not None
+    if callable(members):
+        return lambda member, normalized: members(normalized)
+    names: set[str] = set(members)
+    return lambda member, normalized: member in names
@@ -0,0 +1,156 @@
+import io
+import mmap
+from pathlib import Path, PurePosixPath
+from typing import IO, Iterator
+from zipfile import ZipFile
+
+from modules.imagesets import find_image_set_directory, get_imagesetdata_path
+from modules.zip_extractor import Archive, normalize
+
+
+class ZipFS:
+    # Read-only view over a package, so files can be read without extracting them to disk.
+    # Local zip files are memory-mapped unless use_mmap is False, RemoteZip archives work as well
+
+    archive: Archive
+    _names: dict[str, str]  # normalized name -> archive member
+    _file: IO[bytes] | None
+    _mmap: mmap.mmap | None
+
+    def __init__(self, source: Path | Archive, use_mmap: bool = True) -> None:
+        self._file = None
+        self._mmap = None
+        if isinstance(source, Path):
+            self._file = open(source, "rb")
+            if use_mmap:
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.archive = ZipFile(_MappedFile(self._mmap) if self._mmap is not None else self._file, "r")
+        else:
+            self.archive = source
+
+        self._names = {}
+        for member in self.archive.namelist():
+            normalized: str = normalize(member)
+            if normalized.strip():
+                self._names[normalized.rstrip("/")] = member
+
+    def __enter__(self) -> "ZipFS":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if isinstance(self.archive, ZipFile):
+            self.archive.close()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def path(self, *parts: str | PurePosixPath) -> "ZipPath":
+        return ZipPath(self, PurePosixPath(*parts))
+
+    def exists(self, name: str | PurePosixPath) -> bool:
+        return PurePosixPath(name).as_posix() in self._names
+
+    def open(self, name: str | PurePosixPath) -> IO[bytes]:
+        member: str | None = self._names.get(PurePosixPath(name).as_posix())
+        if member is None:
+            raise FileNotFoundError(f"No such file in archive: '{name}'")
+        return self.archive.open(member)
+
+    def iterdir(self, directory: str | PurePosixPath) -> Iterator["ZipPath"]:
+        # Files directly inside directory
+        for name in self._names:
+            path = PurePosixPath(name)
+            if path.parent == PurePosixPath(directory) and not self._names[name].endswith("/"):
+                yield ZipPath(self, path)
+
+    def find_image_set_directory(self) -> PurePosixPath | None:
+        return find_image_set_directory(self._names)
+
+    def imagesetdata_file(self, image_set_directory: PurePosixPath) -> "ZipPath":
+        return ZipPath(self, get_imagesetdata_path(image_set_directory))
+
+
+class ZipPath:
+    # Just enough of the pathlib.Path interface for reading files out of a ZipFS
+
+    fs: ZipFS
+    _path: PurePosixPath
+
+    def __init__(self, fs: ZipFS, path: PurePosixPath) -> None:
+        self.fs = fs
+        self._path = path
+
+    def __truediv__(self, other: str | PurePosixPath) -> "ZipPath":
+        return ZipPath(self.fs, self._path / other)
+
+    def __str__(self) -> str:
+        return self._path.as_posix()
+
+    def __repr__(self) -> str:
+        return f"ZipPath('{self._path.as_posix()}')"
+
+    @property
+    def name(self) -> str:
+        return self._path.name
+
+    @property
+    def stem(self) -> str:
+        return self._path.stem
+
+    @property
+    def parent(self) -> "ZipPath":
+        return ZipPath(self.fs, self._path.parent)
+
+    def as_posix(self) -> str:
+        return self._path.as_posix()
+
+    def exists(self) -> bool:
+        return self.fs.exists(self._path)
+
+    def open(self, mode: str = "rb") -> IO[bytes]:
+        if mode != "rb":
+            raise ValueError(f"ZipPath is read-only (mode: '{mode}')")
+        return self.fs.open(self._path)
+
+    def read_bytes(self) -> bytes:
+        with self.open() as file:
+            return file.read()
+
+    def read_text(self, encoding: str = "utf-8") -> str:
+        return self.read_bytes().decode(encoding)
+
+
+class _MappedFile(io.RawIOBase):
+    # mmap.mmap only became a full file object (seekable()) in Python 3.13
+
+    _mmap: mmap.mmap
+
+    def __init__(self, mapped: mmap.mmap) -> None:
+        self._mmap = mapped
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._mmap.seek(offset, whence)
+        return self._mmap.tell()
+
+    def tell(self) -> int:
+        return self._mmap.tell()
+
+    def read(self, size: int | None = -1) -> bytes:
+        return self._mmap.read(None if size is None or size < 0 else size)
+
+    def readinto(self, buffer) -> int:
+        data: bytes = self._mmap.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
@@ -0,0 +1,122 @@
+# The NumPy and the pure-Python detection of modded icons have to find exactly the same icons.
+# Run from the repository root: python -m pytest tests
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+from PIL import Image
+
+from modules.detection import _find_modded_icons_numpy, _find_modded_icons_python, detect_imageset
+from modules.imagesets import Icon
+
+
+def icon(name: str, x: int, y: int, w: int, h: int) -> Icon:
+    return Icon(name, "img_set_1x_1", x, y, w, h, (x, y, x + w, y + h))
+
+
+def random_image(rnd: random.Random, width: int, height: int) -> Image.Image:
+    # About a third of the pixels are fully transparent, with random RGB
+    pixels: list[tuple[int, int, int, int]] = []
+    for _ in range(width * height):
+        alpha: int = 0 if rnd.random() < 0.3 else rnd.randrange(1, 256)
+        pixels.append((rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), alpha))
+    image = Image.new("RGBA", (width, height))
+    image.putdata(pixels)
+    return image
+
+
+def random_icons(rnd: random.Random, width: int, height: int, count: int) -> list[Icon]:
+    # Some boxes touch or cross the right and bottom edge of the image
+    icons: list[Icon] = []
+    for index in range(count):
+        w: int = rnd.randrange(1, 12)
+        h: int = rnd.randrange(1, 12)
+        x: int = rnd.randrange(0, width + 2)
+        y: int = rnd.randrange(0, height + 2)
+        if index % 4 == 0:
+            x = width - w
+        elif index % 4 == 1:
+            y = height - h
+        icons.append(icon(f"icon{index}", x, y, w, h))
+    return icons
+
+
+def modify(rnd: random.Random, image: Image.Image, changes: int) -> Image.Image:
+    # Changes the RGB of transparent pixels (not a modification), the alpha of some pixels
+    # and the RGB of visible pixels
+    mod: Image.Image = image.copy()
+    for _ in range(changes):
+        xy: tuple[int, int] = (rnd.randrange(image.width), rnd.randrange(image.height))
+        r, g, b, a = mod.getpixel(xy)
+        kind: int = rnd.randrange(3)
+        if kind == 0 or a == 0:
+            mod.putpixel(xy, ((r + 1) % 256, g, b, a) if a else (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), 0))
+        elif kind == 1:
+            mod.putpixel(xy, (r, g, b, (a + rnd.randrange(1, 256)) % 256))
+        else:
+            mod.putpixel(xy, (r, (g + 1) % 256, b, a))
+    return mod
+
+
+def find_both(original: Image.Image, mod: Image.Image, icons: list[Icon]) -> list[str]:
+    python: list[str] = [icon.name for icon in _find_modded_icons_python(original, mod, icons)]
+    numpy: list[str] = [icon.name for icon in _find_modded_icons_numpy(original, mod, icons)]
+    assert numpy == python
+    return python
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_imagesets(seed: int) -> None:
+    rnd = random.Random(seed)
+    width, height = rnd.randrange(8, 64), rnd.randrange(8, 64)
+    original: Image.Image = random_image(rnd, width, height)
+    mod: Image.Image = modify(rnd, original, rnd.randrange(0, 40))
+    find_both(original, mod, random_icons(rnd, width, height, 40))
+
+
+def test_transparent_pixels_with_different_rgb() -> None:
+    original = Image.new("RGBA", (8, 8), (10, 20, 30, 0))
+    mod = Image.new("RGBA", (8, 8), (200, 100, 50, 0))
+    mod.putpixel((7, 7), (0, 0, 0, 1))
+    assert find_both(original, mod, [icon("transparent", 0, 0, 4, 4), icon("visible", 4, 4, 4, 4)]) == ["visible"]
+
+
+def test_boxes_at_the_image_edge() -> None:
+    original = Image.new("RGBA", (16, 8), (255, 255, 255, 255))
+    mod = original.copy()
+    mod.putpixel((15, 0), (0, 0, 0, 255))
+    mod.putpixel((0, 7), (0, 0, 0, 255))
+    icons: list[Icon] = [
+        icon("right", 12, 0, 4, 4),
+        icon("bottom", 0, 4, 4, 4),
+        icon("inside", 4, 2, 4, 4),
+        icon("outside", 16, 0, 4, 4),
+        icon("crossing", 14, 6, 4, 4),
+    ]
+    assert find_both(original, mod, icons) == ["right", "bottom"]
+
+
+@pytest.mark.parametrize("mod_size", [(12, 8), (20, 8), (16, 6), (16, 10)])
+def test_size_mismatch(mod_size: tuple[int, int]) -> None:
+    # Image.crop pads with transparent pixels, so the part of a box outside of one image only matches transparent pixels
+    rnd = random.Random(sum(mod_size))
+    original: Image.Image = random_image(rnd, 16, 8)
+    mod = Image.new("RGBA", mod_size, (0, 0, 0, 0))
+    mod.paste(original.crop((0, 0, *mod_size)), (0, 0))
+    find_both(original, mod, random_icons(rnd, 20, 10, 40))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_detect_imageset(tmp_path, seed: int) -> None:
+    # End to end through PNG files, both paths return the same icons and pixels
+    rnd = random.Random(seed)
+    original: Image.Image = random_image(rnd, 48, 32)
+    mod: Image.Image = modify(rnd, original, 30)
+    original.save(tmp_path / "original.png")
+    mod.save(tmp_path / "mod.png")
+    icons: list[Icon] = random_icons(rnd, 48, 32, 30)
+    python = detect_imageset(tmp_path / "original.png", tmp_path / "mod.png", icons, use_numpy=False)
+    numpy = detect_imageset(tmp_path / "original.png", tmp_path / "mod.png", icons, use_numpy=True)
+    assert numpy == python
+    assert python
@@ -0,0 +1,74 @@
+# download() against the local CDN stand-in: resuming a '.part' file, a stale or complete '.part' file, and errors.
+# Run from the repository root: python -m pytest tests
+from pathlib import Path
+import random
+
+import pytest
+
+pytest.importorskip("requests")
+
+from benchmarks.cdn_server import CdnServer
+from modules.downloader import DownloadError, DownloadResult, download
+
+
+SIZE: int = 300 * 1024
+
+
+@pytest.fixture
+def cdn(tmp_path: Path):
+    root: Path = tmp_path / "cdn"
+    root.mkdir()
+    (root / "package.zip").write_bytes(random.Random(0).randbytes(SIZE))
+    with CdnServer(root) as server:
+        yield server
+
+
+def content(cdn: CdnServer) -> bytes:
+    return (cdn.root / "package.zip").read_bytes()
+
+
+def download_with_part(cdn: CdnServer, tmp_path: Path, part_data: bytes | None) -> tuple[Path, DownloadResult]:
+    target: Path = tmp_path / "download" / "package.zip"
+    if part_data is not None:
+        target.parent.mkdir(parents=True)
+        target.with_name(f"{target.name}.part").write_bytes(part_data)
+    return target, download(f"{cdn.url}/package.zip", target, backoff=0)
+
+
+def test_download(cdn: CdnServer, tmp_path: Path) -> None:
+    target, result = download_with_part(cdn, tmp_path, None)
+    assert target.read_bytes() == content(cdn)
+    assert (result.size, result.transferred, cdn.bytes_sent, cdn.requests) == (SIZE, SIZE, SIZE, 1)
+    assert not target.with_name(f"{target.name}.part").exists()
+
+
+def test_resume(cdn: CdnServer, tmp_path: Path) -> None:
+    # Only the rest of the file is requested
+    target, result = download_with_part(cdn, tmp_path, content(cdn)[:SIZE // 3])
+    assert target.read_bytes() == content(cdn)
+    assert (result.size, result.transferred, cdn.bytes_sent, cdn.requests) == (SIZE, SIZE - SIZE // 3, SIZE - SIZE // 3, 1)
+
+
+def test_stale_part(cdn: CdnServer, tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    # A '.part' file longer than the file on the server is left from another file: 416, then a full restart
+    target, result = download_with_part(cdn, tmp_path, b"\0" * (SIZE + 100))
+    assert "416 Range Not Satisfiable" in caplog.text
+    assert target.read_bytes() == content(cdn)
+    assert (result.size, result.transferred, cdn.bytes_sent, cdn.requests) == (SIZE, SIZE, SIZE, 1)
+
+
+def test_complete_part(cdn: CdnServer, tmp_path: Path) -> None:
+    # Nothing left to download, the 416 of the server says the '.part' file has the full size
+    target, result = download_with_part(cdn, tmp_path, content(cdn))
+    assert target.read_bytes() == content(cdn)
+    assert (result.size, result.transferred, cdn.bytes_sent) == (SIZE, 0, 0)
+
+
+def test_not_found(cdn: CdnServer, tmp_path: Path) -> None:
+    # Not retried, and nothing is left behind
+    target: Path = tmp_path / "download" / "missing.zip"
+    with pytest.raises(DownloadError, match="404") as error:
+        download(f"{cdn.url}/missing.zip", target, backoff=0)
+    assert error.value.url == f"{cdn.url}/missing.zip"
+    assert not target.exists()
+    assert not target.with_name(f"{target.name}.part").exists()